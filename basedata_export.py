@@ -6,13 +6,27 @@
  ***************************************************************************/
 """
 import os
-import math
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
-from qgis.PyQt.QtCore import QObject, QThread, pyqtSignal
+from qgis.PyQt.QtCore import QObject, QThread, QVariant, pyqtSignal
 from qgis.core import *
 
 from .basedata_read import BasedataRead
-from .citygml_serializer import CityGMLSerializer
+from .citygml_serializer import COMPRESSION_ZIP, CityGMLSerializer, CompactFeature, serializeMesh
+from .export_manifest import ExportManifest, MeshContentHash
+from .meshcode import MESH_LEVEL_3, checkMeshLevel, encodeMeshcode, encodeMeshcodes
+from .process_pool import spawnContext
+from .tracing import addTraceEvents, isTracing, traceSession, traceSpan
+
+# メッシュコードをまとめて計算する地物数
+FEATURE_BATCH_SIZE = 1000
+
+# 取り込んだ地物の保持先 memory:メモリレイヤー gpkg:一時GeoPackage（メモリに全地物を保持しない）
+STAGING_MEMORY = "memory"
+STAGING_GPKG = "gpkg"
+STAGINGS = [STAGING_MEMORY, STAGING_GPKG]
 
 class Exporter(QThread):
 
@@ -27,6 +41,29 @@ class Exporter(QThread):
 
         self.was_canceled = False
         self.dst_vlayer = None
+        self.mesh_level = MESH_LEVEL_3
+        self.worker_count = 1
+        self.errors = []
+
+        # 差分出力（入力内容が変わったメッシュのみ出力する）
+        self.incremental = False
+        self.manifest = None
+        self.replaced_files = []
+        self.written_meshcodes = set()
+        self.skipped_count = 0
+
+        # 出力したファイル名
+        self.written_files = []
+
+        # 出力しながらの検査結果（出力したgmlファイルのパス -> 検査結果）
+        self.check_results = {}
+
+        # トレースファイルの出力先（空の場合は記録しない）
+        self.trace_dir = ""
+
+        # 取り込んだ地物の保持先と一時GeoPackageのフォルダ
+        self.staging_type = STAGING_MEMORY
+        self.staging_dir = None
         # self.filesInfoList = []
 
     def cancel(self):
@@ -42,6 +79,125 @@ class Exporter(QThread):
         """
         return self.was_canceled
 
+    def meshLevel(self) -> int:
+        """
+        ファイルを分割するメッシュの次数取得
+        """
+        return self.mesh_level
+
+    def setMeshLevel(self, level: int):
+        """
+        ファイルを分割するメッシュの次数設定
+        """
+        checkMeshLevel(level)
+        self.mesh_level = level
+
+    def workerCount(self) -> int:
+        """
+        メッシュを並列に出力するワーカープロセス数取得
+        """
+        return self.worker_count
+
+    def setWorkerCount(self, count: int):
+        """
+        メッシュを並列に出力するワーカープロセス数設定（1以下は並列にしない）
+        """
+        self.worker_count = max(1, count)
+
+    def isIncremental(self) -> bool:
+        """
+        差分出力するか取得
+        """
+        return self.incremental
+
+    def setIncremental(self, incremental: bool):
+        """
+        差分出力するか設定（出力先のマニフェストと比較して、入力内容が変わったメッシュのみ出力する）
+        """
+        self.incremental = incremental
+
+    def skippedCount(self) -> int:
+        """
+        差分出力で出力を省略したメッシュ数
+        """
+        return self.skipped_count
+
+    def writtenFiles(self) -> list:
+        """
+        出力したファイル名（zipの場合は「zipファイル名/エントリ名」）
+        """
+        return self.written_files
+
+    def isInlineCheck(self) -> bool:
+        """
+        出力しながら検査するか取得
+        """
+        return self.serializer.isInlineCheck()
+
+    def setInlineCheck(self, inline_check: bool):
+        """
+        出力しながら検査するか設定（出力したファイルを解析し直さずに検査結果を得る）
+        """
+        self.serializer.setInlineCheck(inline_check)
+
+    def checkResults(self) -> dict:
+        """
+        出力しながら検査した結果（出力したgmlファイルのパス -> CityGMLFileChecker.results）
+        """
+        return self.check_results
+
+    def lastErrors(self) -> list:
+        """
+        エクスポート処理で発生したエラー
+        """
+        return self.errors
+
+    def traceDir(self) -> str:
+        """
+        トレースファイルの出力先
+        """
+        return self.trace_dir
+
+    def setTraceDir(self, trace_dir: str):
+        """
+        トレースファイルの出力先（処理段階ごとの処理時間を記録する 空の場合は記録しない）
+        """
+        self.trace_dir = trace_dir or ""
+
+    def stagingType(self) -> str:
+        """
+        取り込んだ地物の保持先取得
+        """
+        return self.staging_type
+
+    def setStagingType(self, staging_type: str):
+        """
+        取り込んだ地物の保持先設定（memory:メモリレイヤー gpkg:一時GeoPackage）
+        """
+        if staging_type not in STAGINGS:
+            raise ValueError(f"対応していない地物の保持先です: {staging_type}")
+        self.staging_type = staging_type
+
+    def removeStaging(self):
+        """
+        一時GeoPackageを削除する（出力後にレイヤーを使わなくなってから呼び出す）
+        """
+        if self.staging_dir is None:
+            return
+
+        # OGRの接続プールはレイヤーを削除してもGeoPackageを開いたままにするため、
+        # プールの接続を破棄してからレイヤー（プロバイダー）を削除する
+        # （Windowsでは開いたままのファイルを削除できない）
+        if self.dst_vlayer is not None and self.dst_vlayer.dataProvider() is not None:
+            self.dst_vlayer.dataProvider().reloadData()
+        self.dst_vlayer = None
+
+        try:
+            shutil.rmtree(self.staging_dir)
+        except OSError as e:
+            QgsMessageLog.logMessage(f"一時GeoPackageのフォルダを削除できませんでした。{self.staging_dir} {e}")
+        self.staging_dir = None
+
     def dstVLayer(self, thread):
         """
         レイヤをスレッドに移動
@@ -61,6 +217,13 @@ class Exporter(QThread):
         """
         エクスポート処理開始
         """
+        with traceSession(self.trace_dir, "export"):
+            self.export()
+
+    def export(self):
+        """
+        ベースデータを読み込み、メッシュコード別にCityGMLを出力する
+        """
 
         print(f"エクスポート処理開始")
 
@@ -71,6 +234,11 @@ class Exporter(QThread):
 
         total = len(file_paths) * 2 + 2
         step = 0
+        self.written_files = []
+        self.check_results = {}
+
+        # 座標変換の設定は出力ごとにやり直し、出力中は座標参照系の組ごとに1度だけ行う
+        self.generator.resetCompensatedCRS()
 
         src_vlayers = []
 
@@ -89,7 +257,8 @@ class Exporter(QThread):
                 layer_name = os.path.splitext(file_name)[0]
 
                 # ベクタレイヤーを作成する
-                src_vlayer = self.generator.createVectorLayerForSrc(file_path, layer_name)
+                with traceSpan("createVectorLayerForSrc", file=file_name):
+                    src_vlayer = self.generator.createVectorLayerForSrc(file_path, layer_name)
 
                 # ジオメトリのチェック
                 if output_type not in (QgsWkbTypes.Unknown, QgsWkbTypes.NoGeometry):
@@ -121,78 +290,97 @@ class Exporter(QThread):
             attribute_fields = self.generator.featureFields()
             attribute_count = attribute_fields.count()
 
-            # メモリレイヤーを作成
-            self.dst_vlayer = self.generator.createMemoryLayerForDst(output_type)
+            # メモリレイヤー（または一時GeoPackage）を作成
+            self.dst_vlayer = self.createDstLayer(attribute_fields, src_vlayers, output_type)
             if self.dst_vlayer is None:
                 return None
             dst_crs = self.dst_vlayer.crs()
+            # GeoPackageはfidフィールドがあるため、属性の位置はレイヤーのフィールドで求める
+            dst_fields = self.dst_vlayer.fields()
 
-            self.dst_vlayer.startEditing()
-            self.dst_vlayer.setCustomProperty("skipMemoryLayersCheck", 1)
+            # 地物は編集バッファを使わずにプロバイダーへ追加するので、編集モードにしない
+            if self.staging_type == STAGING_MEMORY:
+                self.dst_vlayer.setCustomProperty("skipMemoryLayersCheck", 1)
 
             # メッシュコードフィールド
             meshcode_field_name = self.generator.meshcodeFieldName()
-            meshcode_field_index = self.dst_vlayer.fields().indexFromName(meshcode_field_name)
+            meshcode_field_index = dst_fields.indexFromName(meshcode_field_name)
 
-            # メッシュコード別にCityGMLを出力したいので重複を許可しないset型
-            meshcode_set = set()
+            # メッシュコード別にCityGMLを出力したいので、取り込みと同時にメッシュごとの地物IDと範囲を集計する
+            partitions = {}
+            add_failed = False
 
             for src_vlayer in src_vlayers:
 
-                if self.was_canceled:
+                if self.was_canceled or add_failed:
                     break
 
-                transformer = None
-                if src_vlayer.crs() != self.dst_vlayer.crs():
-                    transformer = QgsCoordinateTransform(src_vlayer.crs(), dst_crs, QgsProject.instance().transformContext())
-                    self.generator.compensateCRS(src_vlayer.crs(), dst_crs)
-
-                # 元のレイヤーから必要な属性のインデックスを抜き出す
-                attr_indexes = {}
-                src_data_provider = src_vlayer.dataProvider()
-                for dst_index in range(0, attribute_count):
-                    field_name = attribute_fields.at(dst_index).name()
-                    src_index = src_data_provider.fieldNameIndex(field_name)
-                    if src_index >= 0:
-                        attr_indexes[field_name] = {"src": src_index, "dst": dst_index}
-
-                for src_feature in src_vlayer.getFeatures():
-                    dst_feature = QgsFeature(attribute_fields)
-                    if src_feature.hasGeometry():
-                        # ジオメトリをコピー
-                        g = QgsGeometry(src_feature.geometry())
-                        if transformer is not None:
-                            g.transform(transformer)
-                        if is_multi and not g.isMultipart():
-                            g.convertToMultiType()
-                        dst_feature.setGeometry(g)
-
-                        # ジオメトリはEPSG:6668に変換済みなので緯度経度になっているはず
+                with traceSpan("ingest", layer=src_vlayer.name()):
+                    # 元のレイヤーから必要な属性のインデックスを抜き出す
+                    attr_indexes = {}
+                    src_data_provider = src_vlayer.dataProvider()
+                    for attribute_index in range(0, attribute_count):
+                        field_name = attribute_fields.at(attribute_index).name()
+                        src_index = src_data_provider.fieldNameIndex(field_name)
+                        if src_index >= 0:
+                            attr_indexes[field_name] = {"src": src_index, "dst": dst_fields.indexFromName(field_name)}
+
+                    # 必要な属性のみ読み込む
+                    request = QgsFeatureRequest()
+                    request.setSubsetOfAttributes([indexes["src"] for indexes in attr_indexes.values()])
+
+                    # 座標変換は地物ごとにPythonから呼び出さず、読み込みと同時に行う
+                    # 変換できなかった地物はジオメトリが空になるので、地物IDを記録してエラーにする
+                    transform_failed_ids = []
+                    if src_vlayer.crs() != self.dst_vlayer.crs():
+                        request.setDestinationCrs(dst_crs, QgsProject.instance().transformContext())
+                        request.setTransformErrorCallback(lambda feature: transform_failed_ids.append(feature.id()))
+                        self.generator.compensateCRS(src_vlayer.crs(), dst_crs)
+
+                    # メッシュコードはまとめて計算するので、一定数ごとにメモリレイヤーに追加する
+                    batch = []
+                    for src_feature in src_vlayer.getFeatures(request):
+                        dst_feature = QgsFeature(dst_fields)
                         lon = None
                         lat = None
-                        if src_vlayer.geometryType() in (QgsWkbTypes.PolygonGeometry, QgsWkbTypes.LineGeometry):
-                            centroid = g.centroid().asPoint()
-                            lon = centroid.x()
-                            lat = centroid.y()
-                        elif src_vlayer.geometryType() == QgsWkbTypes.PointGeometry:
-                            point = g.asPoint()
-                            lon = point.x()
-                            lat = point.y()
-                        
-                        if lon != None and lat != None:
-                            # メッシュコードフィールドに値を設定する
-                            __meshcode = self.make_meshcode(lat, lon)
-                            dst_feature.setAttribute(meshcode_field_index, __meshcode)
-                            meshcode_set.add(__meshcode)
-
-                    # 元の地物から必要な属性の値を取得する
-                    # dst_feature.initAttributes(attribute_count)
-                    for field_name, indexes in attr_indexes.items():
-                        value = src_feature.attribute(indexes["src"])
-                        dst_feature.setAttribute(indexes["dst"], value)
-
-                    # メモリレイヤーに設定する
-                    self.dst_vlayer.addFeature(dst_feature)
+                        if src_feature.hasGeometry():
+                            # ジオメトリは読み込んだ地物のものを共有する（変更する場合のみ複製される）
+                            g = src_feature.geometry()
+                            if is_multi and not g.isMultipart():
+                                g.convertToMultiType()
+                            dst_feature.setGeometry(g)
+
+                            # ジオメトリはEPSG:6668に変換済みなので緯度経度になっているはず
+                            if src_vlayer.geometryType() in (QgsWkbTypes.PolygonGeometry, QgsWkbTypes.LineGeometry):
+                                centroid = g.centroid().asPoint()
+                                lon = centroid.x()
+                                lat = centroid.y()
+                            elif src_vlayer.geometryType() == QgsWkbTypes.PointGeometry:
+                                point = g.asPoint()
+                                lon = point.x()
+                                lat = point.y()
+
+                        # 元の地物から必要な属性の値を取得する
+                        # dst_feature.initAttributes(attribute_count)
+                        for field_name, indexes in attr_indexes.items():
+                            value = src_feature.attribute(indexes["src"])
+                            dst_feature.setAttribute(indexes["dst"], value)
+
+                        batch.append([dst_feature, lon, lat])
+                        if len(batch) >= FEATURE_BATCH_SIZE:
+                            add_failed = not self.addFeatureBatch(batch, meshcode_field_index, partitions, errors)
+                            batch = []
+
+                            # キャンセルは一定数ごとに確認する
+                            if self.was_canceled or add_failed:
+                                break
+
+                    if len(batch) > 0 and not self.was_canceled and not add_failed:
+                        add_failed = not self.addFeatureBatch(batch, meshcode_field_index, partitions, errors)
+
+                    if len(transform_failed_ids) > 0:
+                        errors.append(transformErrorMessage(src_vlayer.name(), transform_failed_ids))
+                        add_failed = True
 
                 step += 1
                 progress_value = round(step * 100 / total)
@@ -202,44 +390,413 @@ class Exporter(QThread):
             for vlayer in src_vlayers:
                 vlayer.deleteLater()
 
-            if self.was_canceled:
-                if self.dst_vlayer is not None:
-                    self.dst_vlayer.rollBack()
-            else:
-                if self.dst_vlayer is not None:
-                    self.dst_vlayer.commitChanges()
+            # プロバイダーに直接追加した地物はレイヤーの範囲に反映されないので、取り込み後に1度だけ更新する
+            self.dst_vlayer.updateExtents()
+
+            if self.was_canceled or add_failed:
+                break
+
+            # 差分出力ではメッシュごとの入力内容のハッシュ値を求める
+            # 追加した地物を地物IDの順に1回だけ走査する
+            if self.incremental:
+                for partition in partitions.values():
+                    partition.content_hash = MeshContentHash()
+                hash_field_names = [name for name in (self.generator.requiredField(), self.generator.heightFeatureField()) if name]
+                request = QgsFeatureRequest()
+                request.setSubsetOfAttributes([meshcode_field_name] + hash_field_names, self.dst_vlayer.fields())
+                with traceSpan("contentHash", meshes=len(partitions)):
+                    for feature in self.dst_vlayer.getFeatures(request):
+                        partition = partitions.get(feature.attribute(meshcode_field_index))
+                        if partition is not None:
+                            self.addFeatureHash(partition.content_hash, feature)
+
+            # 差分出力では入力内容が変わったメッシュのみ出力する
+            targets = partitions
+            if self.incremental:
+                targets = self.changedPartitions(partitions)
 
             # メッシュコード別にCityGML出力処理を行う
-            for meshcode in meshcode_set:
-                # メッシュコードフィルター
-                expression = QgsExpression(f"\"{meshcode_field_name}\"='{meshcode}'")
+            # zipは1つのファイルに書き込むため並列にしない
+            with traceSpan("serialize", meshes=len(targets), workers=self.worker_count):
+                if self.worker_count > 1 and len(targets) > 1 and self.serializer.compression() != COMPRESSION_ZIP:
+                    self.serializeInParallel(targets, step, total, errors)
+                elif len(targets) > 0:
+                    # 途中で失敗しても、zipは閉じて中央ディレクトリを書き込む
+                    try:
+                        self.serialize(targets, step, total, errors)
+                    finally:
+                        self.closeSerializer(errors)
+
+            if self.manifest is not None:
+                with traceSpan("finishManifest"):
+                    self.finishManifest(partitions, errors)
 
-                # ドキュメント作成開始
-                feature_itr = self.dst_vlayer.getFeatures(QgsFeatureRequest(expression))
+            break
 
-                boundedBy = self.getBound(self.dst_vlayer.getFeatures(QgsFeatureRequest(expression)))
+        self.errors = errors
+        for error in errors:
+            QgsMessageLog.logMessage(error)
+
+        print(f"エクスポート処理終了")
 
-                file_name = self.serializer.exec(feature_itr, boundedBy, meshcode)
+    def serialize(self, partitions: dict, step: int, total: int, errors: list):
+        """
+        メッシュコード別にCityGMLを順に出力する
+
+        @param partitions:メッシュコード別のMeshPartition
+        @param step:出力前までの進捗
+        @param total:進捗の総数
+        @param errors:エラーの格納先
+        """
+        done = 0
+        for meshcode, partition in partitions.items():
+
+            if self.was_canceled:
+                break
+
+            # ドキュメント作成開始
+            feature_itr = self.partitionFeatures(partition)
+
+            file_name = self.serializer.exec(feature_itr, partition.bound(), meshcode)
+
+            if file_name is None:
+                errors.append(self.serializer.lastError())
+                break
 
-                if file_name is None:
-                    errors.append(self.serializer.lastError())
+            self.meshWritten(partition, file_name)
+            self.checkWritten(file_name, self.serializer.lastCheckResults())
+            done += 1
+            self.emitSerializeProgress(step, total, done, len(partitions))
+
+    def closeSerializer(self, errors: list):
+        """
+        出力を終了する（zipを閉じる）
+
+        zipを閉じられなかった場合、今回zipに出力したメッシュは出力していないものとして扱う
+
+        @param errors:エラーの格納先
+        """
+        if self.serializer.close():
+            return
+
+        errors.append(self.serializer.lastError())
+        if self.manifest is not None:
+            for meshcode in self.written_meshcodes:
+                self.manifest.removeMesh(meshcode)
+        self.written_meshcodes.clear()
+
+    def serializeInParallel(self, partitions: dict, step: int, total: int, errors: list):
+        """
+        メッシュコード別のCityGML出力をワーカープロセスで並列に行う
+
+        各メッシュの地物はCompactFeatureにしてワーカーに渡す
+        同時に渡すメッシュはワーカー数の2倍までとし、メモリに保持する地物数を抑える
+
+        @param partitions:メッシュコード別のMeshPartition
+        @param step:出力前までの進捗
+        @param total:進捗の総数
+        @param errors:エラーの格納先
+        """
+        context = spawnContext()
+
+        remaining = iter(partitions.values())
+        done = 0
+        pending = set()
+        with ProcessPoolExecutor(max_workers=self.worker_count, mp_context=context) as executor:
+            while True:
+                # 中止またはエラーがなければワーカーにメッシュを渡す
+                while not self.was_canceled and len(errors) == 0 and len(pending) < self.worker_count * 2:
+                    partition = next(remaining, None)
+                    if partition is None:
+                        break
+                    pending.add(executor.submit(serializeMesh, self.makeSerializeJob(partition)))
+
+                if len(pending) == 0:
                     break
 
-                # # ファイル名と地物数を格納
-                # cnt = 0
-                # feature_itr_cnt = self.dst_vlayer.getFeatures(QgsFeatureRequest(expression))
-                # for feature in feature_itr_cnt:
-                #     cnt =+ 1
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    if future.cancelled():
+                        continue
 
-                # print("file_name", file_name)
-                # print("cnt", cnt)
-                    
-                # self.filesInfoList.append([file_name, cnt])
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors.append(f"ワーカープロセスでエラーが発生しました。{e}")
+                        continue
 
-            break
+                    # ワーカープロセスで記録した区間
+                    addTraceEvents(result["trace_events"])
 
-        print(f"エクスポート処理終了")
+                    if result["file_name"] is None:
+                        errors.append(result["error"])
+                        continue
+
+                    self.meshWritten(partitions[result["meshcode"]], result["file_name"])
+                    self.checkWritten(result["file_name"], result["check_results"])
+                    done += 1
+                    self.emitSerializeProgress(step, total, done, len(partitions))
+
+                if self.was_canceled:
+                    # 未着手のメッシュは取り消す
+                    for future in pending:
+                        future.cancel()
+
+    def makeSerializeJob(self, partition) -> dict:
+        """
+        ワーカープロセスに渡す1メッシュ分の出力内容を作成する
+
+        @param partition:MeshPartition
+        """
+        field_names = [self.generator.requiredField(), self.generator.heightFeatureField()]
+        with traceSpan("makeSerializeJob", meshcode=partition.meshcode):
+            features = [CompactFeature.fromFeature(feature, field_names) for feature in self.partitionFeatures(partition)]
+
+        return {
+            "feature_type": self.feature_type,
+            "output_dir_path": self.serializer.outputDirPath(),
+            "streaming": self.serializer.isStreaming(),
+            "use_xlink": self.serializer.useXlink(),
+            "compression": self.serializer.compression(),
+            "coordinate_decimals": self.serializer.coordinateDecimals(),
+            "inline_check": self.serializer.isInlineCheck(),
+            "trace": isTracing(),
+            "required_field": self.generator.requiredField(),
+            "height_field": self.generator.heightFeatureField(),
+            "meshcode": partition.meshcode,
+            "bounded_by": partition.bound(),
+            "features": features,
+        }
+
+    def manifestSettings(self) -> dict:
+        """
+        差分出力で比較する、出力内容に影響する設定
+        """
+        return {
+            "feature_type": self.feature_type,
+            "mesh_level": self.mesh_level,
+            "use_xlink": self.serializer.useXlink(),
+            "compression": self.serializer.compression(),
+            "coordinate_decimals": list(self.serializer.coordinateDecimals()),
+            "required_field": self.generator.requiredField(),
+            "height_field": self.generator.heightFeatureField(),
+        }
+
+    def addFeatureHash(self, content_hash: MeshContentHash, feature: QgsFeature):
+        """
+        出力に使う地物の値をメッシュのハッシュ値に加える
+
+        @param content_hash:メッシュのハッシュ値
+        @param feature:地物
+        """
+        fields = feature.fields()
+
+        # gml:idがなければフィーチャーIDで出力される
+        gml_id = feature.id()
+        if fields.indexFromName(self.generator.requiredField()) >= 0:
+            gml_id = feature.attribute(self.generator.requiredField())
+
+        height = None
+        height_field = self.generator.heightFeatureField()
+        if height_field and fields.indexFromName(height_field) >= 0:
+            height = feature.attribute(height_field)
+
+        content_hash.addFeature(nullToNone(gml_id), nullToNone(height), bytes(feature.geometry().asWkb()))
+
+    def changedPartitions(self, partitions: dict) -> dict:
+        """
+        前回の出力から入力内容が変わったメッシュを求める
+
+        @param partitions:メッシュコード別のMeshPartition
+        @return:出力するメッシュコード別のMeshPartition
+        """
+        dir_path = self.serializer.outputDirPath()
+        self.manifest = ExportManifest.load(dir_path, self.manifestSettings())
+        if self.manifest is None:
+            self.manifest = ExportManifest(self.manifestSettings())
+        self.replaced_files = []
+        self.written_meshcodes = set()
+
+        if self.serializer.compression() == COMPRESSION_ZIP:
+            # zipは1つのファイルにまとめて書き直すため、すべて出力する
+            targets = dict(partitions)
+        else:
+            targets = {meshcode: partition for meshcode, partition in partitions.items()
+                       if not self.manifest.isUnchanged(meshcode, partition.content_hash.hexdigest(), dir_path)}
+
+        self.skipped_count = len(partitions) - len(targets)
+        QgsMessageLog.logMessage(f"差分出力: {len(targets)}メッシュを出力し、{self.skipped_count}メッシュは変更がないため省略します。")
+        return targets
+
+    def meshWritten(self, partition, file_name: str):
+        """
+        出力したメッシュを記録する（差分出力ではマニフェストにも記録する）
+
+        @param partition:MeshPartition
+        @param file_name:出力したファイル名（zipの場合は「zipファイル名/エントリ名」）
+        """
+        self.written_files.append(file_name)
+
+        if self.manifest is None:
+            return
+
+        # マニフェストには出力先ディレクトリ直下のファイル名を記録する
+        file_name = file_name.split("/")[0]
+        old_file_name = self.manifest.fileName(partition.meshcode)
+        if old_file_name is not None and old_file_name != file_name:
+            self.replaced_files.append(old_file_name)
+
+        self.manifest.setMesh(partition.meshcode, partition.content_hash.hexdigest(), file_name)
+        self.written_meshcodes.add(partition.meshcode)
+
+    def checkWritten(self, file_name: str, check_results: dict):
+        """
+        出力しながら検査した結果を記録する
+
+        圧縮したファイルも、検査結果は展開したgmlファイルのものとして扱う
+
+        @param file_name:出力したファイル名（zipの場合は「zipファイル名/エントリ名」）
+        @param check_results:検査結果 検査していない場合はNone
+        """
+        if check_results is None:
+            return
+
+        gml_file_name = file_name.split("/")[-1]
+        if gml_file_name.endswith(".gz"):
+            gml_file_name = gml_file_name[:-len(".gz")]
+
+        self.check_results[self.serializer.outputDirPath() + "/" + gml_file_name] = check_results
+
+    def finishManifest(self, partitions: dict, errors: list):
+        """
+        入力からなくなったメッシュのファイルを削除し、マニフェストを保存する
+
+        @param partitions:今回の入力のメッシュコード別のMeshPartition
+        @param errors:エラーの格納先
+        """
+        dir_path = self.serializer.outputDirPath()
+        removed_files = list(self.replaced_files)
+        for meshcode in self.manifest.meshcodes():
+            if meshcode not in partitions:
+                removed_files.append(self.manifest.fileName(meshcode))
+                self.manifest.removeMesh(meshcode)
+
+        if self.serializer.compression() == COMPRESSION_ZIP:
+            # zipは書き直しているので、今回出力できなかったメッシュは含まれない
+            for meshcode in self.manifest.meshcodes():
+                if meshcode not in self.written_meshcodes:
+                    self.manifest.removeMesh(meshcode)
+
+        # 他のメッシュが参照していないファイルのみ削除する
+        referenced = {self.manifest.fileName(meshcode) for meshcode in self.manifest.meshcodes()}
+        for file_name in set(removed_files):
+            if file_name is None or file_name in referenced:
+                continue
+            path = os.path.join(dir_path, os.path.basename(file_name))
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+            except OSError as e:
+                errors.append(f"{path}を削除できませんでした。{e}")
+
+        try:
+            self.manifest.save(dir_path)
+        except OSError as e:
+            errors.append(f"差分出力のマニフェストを保存できませんでした。{e}")
+
+    def emitSerializeProgress(self, step: int, total: int, done: int, mesh_count: int):
+        """
+        CityGML出力の進捗を通知する（出力処理は進捗の最後の2つ分）
+        """
+        progress_value = round((step + 2 * done / mesh_count) * 100 / total)
+        self.progress.emit(progress_value)
             
+    def addFeatureBatch(self, batch: list, meshcode_field_index: int, partitions: dict, errors: list) -> bool:
+        """
+        地物にまとめてメッシュコードを設定し、メモリレイヤーに追加する
+
+        @param batch:[地物, 経度, 緯度]のリスト
+        @param meshcode_field_index:メッシュコードフィールドのインデックス
+        @param partitions:メッシュコード別のMeshPartition
+        @param errors:エラーの格納先
+        @return:追加できなかった場合はFalse
+        """
+
+        # 緯度経度が取得できた地物のみメッシュコードを設定する
+        located = [index for index, item in enumerate(batch) if item[1] != None and item[2] != None]
+        with traceSpan("encodeMeshcodes", features=len(located)):
+            meshcodes = encodeMeshcodes([batch[index][2] for index in located], [batch[index][1] for index in located], self.mesh_level)
+
+        item_partitions = [None] * len(batch)
+        for index, meshcode in zip(located, meshcodes):
+            dst_feature = batch[index][0]
+            meshcode = str(meshcode)
+
+            # メッシュコードフィールドに値を設定する
+            dst_feature.setAttribute(meshcode_field_index, meshcode)
+
+            partition = partitions.get(meshcode)
+            if partition is None:
+                partition = MeshPartition(meshcode)
+                partitions[meshcode] = partition
+            partition.addBoundingBox(dst_feature.geometry().boundingBox())
+            item_partitions[index] = partition
+
+        # 編集バッファを使わず、まとめてプロバイダーに追加する（一時GeoPackageは1つのトランザクションになる）
+        data_provider = self.dst_vlayer.dataProvider()
+        with traceSpan("addFeatures", features=len(batch)):
+            added, features = data_provider.addFeatures([item[0] for item in batch])
+        if not added:
+            errors.append(f"地物を追加できませんでした。{data_provider.lastError()}")
+            return False
+
+        # 追加した地物のIDはここで確定するので、メッシュに振り分ける
+        # 一時GeoPackageはメッシュコードの索引で読み込むため、地物IDは保持しない
+        if self.staging_type == STAGING_MEMORY:
+            for feature, partition in zip(features, item_partitions):
+                if partition is not None:
+                    partition.feature_ids.append(feature.id())
+
+        return True
+
+    def createDstLayer(self, attribute_fields: QgsFields, src_vlayers: list, output_type) -> QgsVectorLayer:
+        """
+        取り込んだ地物の保持先のレイヤーを作成する
+
+        一時GeoPackageのフィールドの型は、同じ名前のベースデータのフィールドに合わせる
+        （メモリレイヤーと同じく、ベースデータの値をそのまま出力する）
+
+        @param attribute_fields:出力するフィールド
+        @param src_vlayers:ベースデータのレイヤー
+        @param output_type:ジオメトリのタイプ
+        """
+        if self.staging_type == STAGING_MEMORY:
+            return self.generator.createMemoryLayerForDst(output_type)
+
+        fields = QgsFields()
+        for field in attribute_fields:
+            field = QgsField(field.name(), QVariant.String)
+            for src_vlayer in src_vlayers:
+                src_index = src_vlayer.fields().indexFromName(field.name())
+                if src_index >= 0:
+                    field = QgsField(src_vlayer.fields().at(src_index))
+                    break
+            fields.append(field)
+
+        self.removeStaging()
+        self.staging_dir = tempfile.mkdtemp(prefix="citygml_staging_")
+        return self.generator.createStagingLayerForDst(os.path.join(self.staging_dir, "staging.gpkg"), fields, output_type)
+
+    def partitionFeatures(self, partition):
+        """
+        メッシュの地物を地物IDの順に返す
+
+        @param partition:MeshPartition
+        """
+        if self.staging_type == STAGING_GPKG:
+            return featuresByMeshcode(self.dst_vlayer, self.generator.meshcodeFieldName(), partition.meshcode)
+        return featuresByIds(self.dst_vlayer, partition.feature_ids)
+
     def make_meshcode(self, lat, lon):
         """
         メッシュコード作成
@@ -247,63 +804,102 @@ class Exporter(QThread):
         @param lat:緯度
         @param lon:経度
         """
+        return encodeMeshcode(lat, lon, self.mesh_level)
+
+
+class MeshPartition:
+    """
+    メッシュコード単位の地物IDと範囲
+    """
+
+    def __init__(self, meshcode: str):
+        self.meshcode = meshcode
+        self.feature_ids = []
 
-        #[1次メッシュコード上2桁]
-        #緯度×60分÷40分＝p　余り　a
-        p,a = divmod(lat*60,40)
-        #[1次メッシュコード下2桁]
-        #経度ー100度＝u　余り　f
-        u = lon - 100
-        f = math.modf(lon)[0]
-        #[2次メッシュコード上1桁]
-        #a÷5分＝q　余り　b
-        q,b = divmod(a,5)
-        #[2次メッシュコード下1桁]
-        #f×60分÷7分30秒＝v　余り　g
-        v,g = divmod(f*60,7.5)
-        #[3次メッシュコード上1桁]
-        #b×60秒÷30秒＝r　余り　c
-        r,c = divmod(b*60,30)
-        #[3次メッシュコード下1桁]
-        #g×60秒÷45秒＝w　余り　h
-        w,h = divmod(g*60,45) 
-        #基準地域メッシュコード
-        #pu　qv　rw
-        return(str(int(p)) 
-            + str(int(u)) 
-            + str(int(q)) 
-            + str(int(v))
-            + str(int(r)) 
-            + str(int(w))) 
-    
-    
-    def getBound(self, feature_itr: QgsFeatureIterator):
-        x_min = None
-        y_min = None
-        x_max = None
-        y_max = None
-        for feature in feature_itr:
-            rect = feature.geometry().boundingBox()
-            xMax = rect.xMaximum()
-            xMin = rect.xMinimum()
-            yMax = rect.yMaximum()
-            yMin = rect.yMinimum()
-
-            if x_max == None:
-                x_max = xMax
-                x_min = xMin
-                y_max = yMax
-                y_min = yMin
-
-            if xMax > x_max:
-                x_max = xMax
-            if xMin < x_min:
-                x_min = xMin
-            if yMax > y_max:
-                y_max = yMax
-            if yMin < y_min:
-                y_min = yMin
-
-        # return [str(x_min), str(y_min), str(x_max), str(y_max)]
-        return [str(y_min), str(x_min), str(y_max), str(x_max)]    
+        # 差分出力用の入力内容のハッシュ値
+        self.content_hash = None
 
+        self.x_min = None
+        self.y_min = None
+        self.x_max = None
+        self.y_max = None
+
+    def addBoundingBox(self, rect: QgsRectangle):
+        """
+        地物の範囲をメッシュの範囲に含める
+        """
+        xMax = rect.xMaximum()
+        xMin = rect.xMinimum()
+        yMax = rect.yMaximum()
+        yMin = rect.yMinimum()
+
+        if self.x_max == None:
+            self.x_max = xMax
+            self.x_min = xMin
+            self.y_max = yMax
+            self.y_min = yMin
+
+        if xMax > self.x_max:
+            self.x_max = xMax
+        if xMin < self.x_min:
+            self.x_min = xMin
+        if yMax > self.y_max:
+            self.y_max = yMax
+        if yMin < self.y_min:
+            self.y_min = yMin
+
+    def bound(self) -> list:
+        """
+        gml:boundedByの数値（緯度経度の順）
+        """
+        return [self.y_min, self.x_min, self.y_max, self.x_max]
+
+
+def nullToNone(value):
+    """
+    属性値のNULLをNoneにする
+    """
+    if isinstance(value, QVariant) and value.isNull():
+        return None
+    return value
+
+
+def transformErrorMessage(layer_name: str, feature_ids: list) -> str:
+    """
+    座標変換できなかった地物のエラーメッセージ（地物IDは先頭の10件まで）
+    """
+    ids = ", ".join(str(feature_id) for feature_id in feature_ids[:10])
+    if len(feature_ids) > 10:
+        ids += ", ..."
+    return f"{layer_name}の{len(feature_ids)}件の地物を座標変換できませんでした。（地物ID: {ids}）"
+
+
+def featuresByIds(vlayer: QgsVectorLayer, feature_ids: list):
+    """
+    指定した地物IDの地物を地物IDの順に返す
+
+    地物ごとに読み込まず、メッシュの地物を1回の読み込みでまとめて取得する
+    （読み込みの順序は決まっていないので、地物IDの順に並べ直す）
+
+    @param vlayer:レイヤー
+    @param feature_ids:地物IDのリスト
+    """
+    request = QgsFeatureRequest()
+    request.setFilterFids(feature_ids)
+    features = list(vlayer.getFeatures(request))
+    features.sort(key=lambda feature: feature.id())
+    return iter(features)
+
+
+def featuresByMeshcode(vlayer: QgsVectorLayer, field_name: str, meshcode: str):
+    """
+    指定したメッシュコードの地物を返す（メッシュコードの索引を使って読み込む）
+
+    @param vlayer:一時GeoPackageのレイヤー
+    @param field_name:メッシュコードのフィールド名
+    @param meshcode:メッシュコード
+    """
+    expression = f"{QgsExpression.quotedColumnRef(field_name)} = {QgsExpression.quotedValue(meshcode)}"
+    request = QgsFeatureRequest(QgsExpression(expression))
+    request.addOrderBy("$id")
+    return vlayer.getFeatures(request)
@@ -27,6 +27,9 @@ class BasedataRead:
         # 属性設定情報
         self.attribute_setting = []
 
+        # 座標変換を設定済みの座標参照系の組 (変換元, 変換先)
+        self.compensated_crs = set()
+
     def setDirectory(self, dir_path: str):
         """ディレクトリ指定"""
         self.dir_path = dir_path
@@ -163,6 +166,32 @@ class BasedataRead:
         """
         return QgsMemoryProviderUtils.createMemoryLayer("memory_layer", self.featureFields(), type, QgsCoordinateReferenceSystem("EPSG:6668"))
 
+    def createStagingLayerForDst(self, file_path: str, fields: QgsFields, type=QgsWkbTypes.Polygon) -> QgsVectorLayer:
+        """
+        指定したフィールド情報の一時GeoPackageのレイヤを生成する
+        メッシュごとに読み込むため、メッシュコードフィールドに索引を作成する
+
+        @param file_path: 作成するGeoPackageのパス
+        @param fields: フィールド（メッシュコードフィールドを含む）
+        """
+        # 取り込み中は空間索引を更新しない
+        warnings.simplefilter("ignore")
+        writer = QgsVectorFileWriter(file_path, "UTF-8", fields, type, QgsCoordinateReferenceSystem("EPSG:6668"), "GPKG", [], ["SPATIAL_INDEX=NO"])
+        warnings.resetwarnings()
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            QgsMessageLog.logMessage(f"一時GeoPackageを作成できませんでした。{writer.errorMessage()}")
+            return None
+        del writer
+
+        # 画面は出力後にmemory_layerのレイヤを削除するので、メモリレイヤと同じ名前にする
+        vlayer = QgsVectorLayer(file_path, "memory_layer", "ogr")
+        if not vlayer.isValid():
+            return None
+
+        meshcode_field_index = vlayer.fields().indexFromName(self.meshcodeFieldName())
+        vlayer.dataProvider().createAttributeIndex(meshcode_field_index)
+        return vlayer
+
     def createVectorLayerForSrc(self, file_path, layer_name):
         """
         指定したファイルのベクタレイヤを生成する
@@ -172,8 +201,14 @@ class BasedataRead:
     def compensateCRS(self, src_crs, dst_crs):
         """
         座標参照系を変換する
+        同じ座標参照系の組は、resetCompensatedCRSを呼び出すまで1度だけ設定する
         """
 
+        key = (crsKey(src_crs), crsKey(dst_crs))
+        if key in self.compensated_crs:
+            return
+        self.compensated_crs.add(key)
+
         if QgsProject.instance().transformContext().hasTransform(src_crs, dst_crs) == False:
             transform_context = QgsCoordinateTransformContext(QgsProject.instance().transformContext())
 
@@ -195,4 +230,17 @@ class BasedataRead:
             if len(operations) > 0:
                 transform_context.addCoordinateOperation(src_crs, dst_crs, operations[0].proj)
 
-            QgsProject.instance().setTransformContext(transform_context)
\ No newline at end of file
+            QgsProject.instance().setTransformContext(transform_context)
+
+    def resetCompensatedCRS(self):
+        """
+        座標変換を設定済みの座標参照系の組を破棄する（次の呼び出しで設定し直す）
+        """
+        self.compensated_crs.clear()
+
+
+def crsKey(crs: QgsCoordinateReferenceSystem) -> str:
+    """
+    座標参照系を区別するキー（EPSGコードなど、ない場合はWKT）
+    """
+    return crs.authid() or crs.toWkt()
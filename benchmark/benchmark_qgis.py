@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ benchmark_qgis  ベンチマークでのQGISの初期化とプラグインの読み込み
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import importlib
+
+# プラグインのフォルダ（このフォルダの親）
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+qgs_app = None
+
+
+def startQgis():
+    """
+    QGISを画面なしで初期化する（1度だけ）
+
+    QGISのインストール先は環境変数QGIS_PREFIX_PATHで指定する
+    """
+    global qgs_app
+    if qgs_app is not None:
+        return qgs_app
+
+    from qgis.core import QgsApplication
+
+    prefix_path = os.environ.get("QGIS_PREFIX_PATH")
+    if prefix_path:
+        QgsApplication.setPrefixPath(prefix_path, True)
+    qgs_app = QgsApplication([], False)
+    qgs_app.initQgis()
+    return qgs_app
+
+
+def importPlugin(name: str):
+    """
+    プラグインのモジュールを読み込む
+
+    プラグインは相対importを使うため、プラグインのフォルダをパッケージとして読み込む
+
+    @param name: モジュール名（"citygml_pipeline"など）
+    """
+    parent_dir, package_name = os.path.split(PLUGIN_DIR)
+    if parent_dir not in sys.path:
+        sys.path.insert(0, parent_dir)
+    return importlib.import_module(f"{package_name}.{name}")
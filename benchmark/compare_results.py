@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ compare_results  2つの計測結果（run_benchmark.pyのJSON）の比較
+
+    python compare_results.py before.json after.json --threshold 1.2
+
+ 同じ条件の合成データの段階ごとの処理時間の比（後/前）を表示し、
+ thresholdを超えて遅くなった段階があれば終了コード1を返す
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import sys
+import json
+import argparse
+
+# 同じ条件とみなす合成データの項目
+DATASET_KEYS = ["format", "kind", "count", "vertices", "spread", "crs", "mesh_level", "workers", "staging"]
+
+# 項目がない計測結果（項目を追加する前のもの）の値
+DATASET_DEFAULTS = {"staging": "memory"}
+
+
+def loadRuns(path: str) -> tuple:
+    """
+    計測結果を読み込む
+
+    @return: (計測環境, 合成データの条件 -> 計測結果)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        result = json.load(f)
+
+    runs = {}
+    for run in result.get("runs", []):
+        runs[datasetKey(run["dataset"])] = run
+    return result.get("environment", {}), runs
+
+
+def datasetKey(dataset: dict) -> tuple:
+    return tuple(dataset.get(key, DATASET_DEFAULTS.get(key)) for key in DATASET_KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2つの計測結果を比較する")
+    parser.add_argument("before", help="比較元の計測結果")
+    parser.add_argument("after", help="比較先の計測結果")
+    parser.add_argument("--threshold", type=float, default=1.2, help="遅くなったとみなす処理時間の比")
+    args = parser.parse_args()
+
+    before_env, before_runs = loadRuns(args.before)
+    after_env, after_runs = loadRuns(args.after)
+
+    print(f"比較元: {before_env.get('commit')} {before_env.get('timestamp')}")
+    print(f"比較先: {after_env.get('commit')} {after_env.get('timestamp')}")
+    for key in ("platform", "cpu_count", "qgis", "python"):
+        if before_env.get(key) != after_env.get(key):
+            print(f"注意: 計測環境の{key}が異なります（{before_env.get(key)} / {after_env.get(key)}）")
+
+    regressions = []
+    for key, after in after_runs.items():
+        before = before_runs.get(key)
+        if before is None:
+            continue
+
+        name = " ".join(str(value) for value in key)
+        print(f"\n{name}")
+        for stage, after_seconds in after["seconds"].items():
+            before_seconds = before["seconds"].get(stage)
+            if before_seconds is None:
+                continue
+
+            ratio = after_seconds / before_seconds if before_seconds > 0 else float("inf")
+            mark = ""
+            if ratio > args.threshold:
+                mark = " *"
+                regressions.append(f"{name} {stage}")
+            print(f"  {stage:<16}{before_seconds:>10.3f}s{after_seconds:>10.3f}s{ratio:>8.2f}x{mark}")
+
+    if len(regressions) > 0:
+        print(f"\n{len(regressions)}件の段階が{args.threshold}倍を超えて遅くなりました。")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ run_benchmark  合成データでの処理段階ごとの計測
+
+ 読み込み、座標変換、メッシュコード計算、メッシュ分割、CityGML出力、検査の
+ 処理時間を計測し、JSONに出力する
+ 各段階は出力処理（Exporter）と同じプラグインの関数を呼び出して計測する
+
+    python run_benchmark.py --sizes 1000,10000 --kinds building,road --output result.json
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from benchmark_qgis import PLUGIN_DIR, importPlugin, startQgis
+from synthetic_data import FORMAT_BASEMAP, FORMAT_SHAPE, FORMATS, KINDS, datasetName, generateDataset
+
+# 計測する段階（この順に実行する）
+STAGES = ["read", "transform", "meshcode", "partition", "serialize", "check", "export", "check_pipeline"]
+
+# 地物の種類ごとの出力する地物のタイプ
+FEATURE_TYPES = {
+    "building": "bldg:Building",
+    "road": "tran:Road",
+    "landuse": "luse:LandUse",
+}
+
+
+class StageTimer:
+    """
+    段階ごとの処理時間の記録
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+
+
+class BenchmarkFeature:
+    """
+    CityGML出力に渡す地物（座標変換済みのジオメトリをそのまま返す）
+    """
+
+    def __init__(self, feature_id: int, attributes: dict, geometry):
+        self.__id = feature_id
+        self.__attributes = attributes
+        self.__geometry = geometry
+
+    def id(self) -> int:
+        return self.__id
+
+    def attribute(self, name):
+        return self.__attributes.get(name)
+
+    def geometry(self):
+        return self.__geometry
+
+
+def benchmarkDataset(dataset_dir: str, kind: str, stages: list, args) -> dict:
+    """
+    合成データ1つ分の計測
+
+    @param dataset_dir: 合成データのフォルダ
+    @param kind: 地物の種類
+    @param stages: 計測する段階
+    @return: 段階ごとの処理時間と件数
+    """
+    from qgis.core import QgsCoordinateReferenceSystem, QgsFeatureRequest, QgsProject, QgsVectorLayer
+
+    pipeline_module = importPlugin("citygml_pipeline")
+    meshcode_module = importPlugin("meshcode")
+    export_module = importPlugin("basedata_export")
+    serializer_module = importPlugin("citygml_serializer")
+    check_module = importPlugin("citygml_data_check_process")
+    codelist_module = importPlugin("codelist_index")
+
+    feature_type = FEATURE_TYPES[kind]
+    height_field = "height" if os.path.basename(dataset_dir).startswith(FORMAT_SHAPE) else ""
+    timer = StageTimer()
+    counts = {}
+    work_dir = tempfile.mkdtemp(prefix="citygml_benchmark_")
+
+    try:
+        generator = pipeline_module.createBasedataRead(dataset_dir)
+        generator.setRequiredField("gml_id")
+        generator.setHeightFeatureField(height_field)
+        generator.setUseCsv(False)
+
+        # 読み込み
+        src_vlayers = []
+        features = []
+        with timer.stage("read"):
+            for file_path in generator.filePaths():
+                layer_name = os.path.splitext(os.path.basename(file_path))[0]
+                src_vlayer = generator.createVectorLayerForSrc(file_path, layer_name)
+                src_vlayers.append(src_vlayer)
+                features.extend(src_vlayer.getFeatures())
+        counts["features"] = len(features)
+
+        # 座標変換（EPSG:6668へ）
+        # 出力処理と同じく読み込みと同時に変換するので、readとの差が変換の処理時間になる
+        dst_crs = QgsCoordinateReferenceSystem("EPSG:6668")
+        geometries = []
+        with timer.stage("transform"):
+            for src_vlayer in src_vlayers:
+                request = QgsFeatureRequest()
+                request.setNoAttributes()
+                if src_vlayer.crs() != dst_crs:
+                    request.setDestinationCrs(dst_crs, QgsProject.instance().transformContext())
+                    generator.compensateCRS(src_vlayer.crs(), dst_crs)
+                geometries.extend(feature.geometry() for feature in src_vlayer.getFeatures(request))
+
+        attributes = []
+        for feature in features:
+            values = {"gml_id": feature.attribute("gml_id") if feature.fields().indexFromName("gml_id") >= 0 else None}
+            if height_field:
+                values[height_field] = feature.attribute(height_field)
+            attributes.append(values)
+        del features
+
+        # メッシュコード計算（重心）
+        with timer.stage("meshcode"):
+            lats = []
+            lons = []
+            for g in geometries:
+                centroid = g.centroid().asPoint()
+                lats.append(centroid.y())
+                lons.append(centroid.x())
+            meshcodes = meshcode_module.encodeMeshcodes(lats, lons, args.mesh_level)
+
+        # メッシュ分割
+        partitions = {}
+        with timer.stage("partition"):
+            for index, meshcode in enumerate(meshcodes):
+                meshcode = str(meshcode)
+                partition = partitions.get(meshcode)
+                if partition is None:
+                    partition = export_module.MeshPartition(meshcode)
+                    partitions[meshcode] = partition
+                partition.feature_ids.append(index)
+                partition.addBoundingBox(geometries[index].boundingBox())
+        counts["meshes"] = len(partitions)
+
+        # CityGML出力（メッシュごとに順に出力）
+        gml_dir = os.path.join(work_dir, "serialize")
+        gml_paths = []
+        if "serialize" in stages or "check" in stages:
+            os.makedirs(gml_dir)
+            serializer = serializer_module.CityGMLSerializer(generator, feature_type, gml_dir)
+            with timer.stage("serialize"):
+                for meshcode, partition in partitions.items():
+                    feature_itr = (BenchmarkFeature(i, attributes[i], geometries[i]) for i in partition.feature_ids)
+                    file_name = serializer.exec(feature_itr, partition.bound(), meshcode)
+                    if file_name is None:
+                        raise RuntimeError(serializer.lastError())
+                    gml_paths.append(os.path.join(gml_dir, file_name))
+                serializer.close()
+            counts["files"] = len(gml_paths)
+            counts["bytes"] = sum(os.path.getsize(path) for path in gml_paths)
+        del geometries
+
+        # 検査（ファイルごとに順に検査）
+        if "check" in stages:
+            with timer.stage("check"):
+                codelist_index = codelist_module.CodelistIndex()
+                for codelist_dir in codelist_module.findCodelistDirs(gml_paths):
+                    codelist_index.preload(codelist_dir)
+                checker = check_module.CityGMLFileChecker(codelist_index)
+                for path in gml_paths:
+                    layer = QgsVectorLayer(path, os.path.basename(path), "ogr")
+                    checker.checkFile(path, layer)
+
+        # 画面の出力・検査と同じ処理（ワーカープロセス数などの出力設定を含む）
+        if "export" in stages or "check_pipeline" in stages:
+            export_dir = os.path.join(work_dir, "export")
+            os.makedirs(export_dir)
+            pipeline = pipeline_module.CityGMLPipeline()
+            pipeline.read(dataset_dir)
+            pipeline.configure(required_field="gml_id", height_field=height_field, feature_type=feature_type,
+                               mesh_level=args.mesh_level, workers=args.workers, compression="none",
+                               incremental=False, inline_check=args.inline_check, staging=args.staging)
+
+            with timer.stage("export"):
+                export_result = pipeline.export(export_dir)
+            if not export_result.succeeded():
+                raise RuntimeError("\n".join(export_result.errors) or "出力が中止されました。")
+
+            if "check_pipeline" in stages:
+                with timer.stage("check_pipeline"):
+                    pipeline.check(export_dir, os.path.join(work_dir, "report"), workers=args.workers)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    seconds = {name: round(value, 4) for name, value in timer.seconds.items() if name in stages}
+    throughput = {name: round(counts["features"] / value, 1) for name, value in seconds.items() if value > 0}
+    return {"seconds": seconds, "features_per_second": throughput, "counts": counts}
+
+
+def environment() -> dict:
+    """
+    計測環境（比較の際に条件が同じか確認する）
+    """
+    from qgis.core import Qgis
+
+    commit = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PLUGIN_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "qgis": Qgis.QGIS_VERSION,
+    }
+
+
+def splitList(value: str) -> list:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データでCityGMLの出力と検査の処理時間を計測する")
+    parser.add_argument("--sizes", default="1000,10000", help="地物数（カンマ区切り 例: 1000,10000,100000,1000000）")
+    parser.add_argument("--kinds", default="building", help=f"地物の種類（カンマ区切り {','.join(KINDS)}）")
+    parser.add_argument("--formats", default=FORMAT_SHAPE, help=f"ベースデータの形式（カンマ区切り {','.join(FORMATS)}）")
+    parser.add_argument("--vertices", default="6", help="外周の頂点数（カンマ区切り）")
+    parser.add_argument("--spread", type=int, default=4, help="配置する範囲の一辺の3次メッシュ数")
+    parser.add_argument("--crs", default="EPSG:6668", help="Shapeファイルの座標参照系（カンマ区切り 例: EPSG:6668,EPSG:6677）")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"計測する段階（カンマ区切り {','.join(STAGES)}）")
+    parser.add_argument("--mesh-level", type=int, default=3, help="メッシュの次数")
+    parser.add_argument("--workers", type=int, default=1, help="export、check_pipelineのワーカープロセス数")
+    parser.add_argument("--inline-check", action="store_true", help="exportで出力しながら検査する")
+    parser.add_argument("--staging", default="memory", help="exportで取り込んだ地物の保持先（memory、gpkg）")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "citygml_benchmark_data"), help="合成データの作成先（作成済みのものは再利用する）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="出力したCityGMLを削除しない")
+    parser.add_argument("--output", default="benchmark_result.json", help="計測結果のJSON")
+    args = parser.parse_args()
+
+    stages = splitList(args.stages)
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"不明な段階です: {stage}")
+
+    startQgis()
+
+    result = {"environment": environment(), "runs": []}
+    for fmt in splitList(args.formats):
+        kinds = ["building"] if fmt == FORMAT_BASEMAP else splitList(args.kinds)
+        crs_list = ["EPSG:6668"] if fmt == FORMAT_BASEMAP else splitList(args.crs)
+        for kind in kinds:
+            for crs in crs_list:
+                for vertices in [int(value) for value in splitList(args.vertices)]:
+                    for size in [int(value) for value in splitList(args.sizes)]:
+                        dataset = {"format": fmt, "kind": kind, "count": size, "vertices": vertices,
+                                   "spread": args.spread, "crs": crs, "mesh_level": args.mesh_level, "workers": args.workers,
+                                   "staging": args.staging}
+                        name = datasetName(fmt, kind, size, vertices, args.spread, crs)
+                        print(f"{name}: 合成データ作成", flush=True)
+                        dataset_dir = generateDataset(args.data_dir, fmt, kind, size, vertices, args.spread, crs, args.seed)
+
+                        measured = benchmarkDataset(dataset_dir, kind, stages, args)
+                        result["runs"].append(dict(dataset=dataset, **measured))
+                        print(f"{name}: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in measured["seconds"].items()), flush=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f"計測結果を出力しました: {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
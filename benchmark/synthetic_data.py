@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ synthetic_data  ベンチマーク用の合成データ（Shapeファイル、基盤地図情報）の生成
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import math
+import random
+import argparse
+
+# 合成データを配置する範囲の南西端（3次メッシュ 53394611 の南西端）
+ORIGIN_LAT = 35.675
+ORIGIN_LON = 139.7625
+
+# 3次メッシュの大きさ（緯度30秒、経度45秒）
+MESH_LAT = 30 / 3600
+MESH_LON = 45 / 3600
+
+# 地物の種類ごとの大きさ（m） (東西の半径, 南北の半径)
+KINDS = {
+    "building": (8.0, 6.0),     # 建物
+    "road": (60.0, 4.0),        # 道路（細長い）
+    "landuse": (40.0, 30.0),    # 土地利用
+}
+
+# 出力形式
+FORMAT_SHAPE = "shape"
+FORMAT_BASEMAP = "basemap"
+FORMATS = [FORMAT_SHAPE, FORMAT_BASEMAP]
+
+# 基盤地図情報の1ファイルの地物数
+BASEMAP_FEATURES_PER_FILE = 50000
+
+# Shapeファイルに追加する地物数（まとめて追加する）
+SHAPE_BATCH_SIZE = 10000
+
+# 緯度1度あたりの距離（m）
+METERS_PER_DEGREE = 111320.0
+
+
+def datasetName(fmt: str, kind: str, count: int, vertices: int, spread: int, crs: str) -> str:
+    """ 合成データのフォルダ名 """
+    return f"{fmt}_{kind}_{count}_v{vertices}_s{spread}_{crs.replace(':', '')}"
+
+
+def featureRings(kind: str, count: int, vertices: int, spread: int, seed: int = 0):
+    """
+    地物の外周（緯度経度）を順に生成する
+
+    地物の中心は spread x spread 個の3次メッシュの範囲に一様に配置する
+    外周は中心の周りの角度順に頂点を並べるので、自己交差しない
+
+    @param kind: 地物の種類（KINDS）
+    @param count: 地物数
+    @param vertices: 外周の頂点数（閉じる点を除く）
+    @param spread: 配置する範囲の一辺のメッシュ数
+    @return: (gml_id, 高さ, [(緯度, 経度)]) 外周は始点と終点が同じ
+    """
+    rng = random.Random(seed)
+    radius_x, radius_y = KINDS[kind]
+    vertices = max(3, vertices)
+
+    for index in range(count):
+        lat = ORIGIN_LAT + rng.random() * MESH_LAT * spread
+        lon = ORIGIN_LON + rng.random() * MESH_LON * spread
+
+        # m -> 度
+        scale_lat = 1.0 / METERS_PER_DEGREE
+        scale_lon = 1.0 / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+        rotation = rng.random() * math.pi
+
+        angles = sorted(rng.random() * 2 * math.pi for _ in range(vertices))
+        ring = []
+        for angle in angles:
+            # 半径は±10%ずらす
+            jitter = 0.9 + rng.random() * 0.2
+            x = math.cos(angle) * radius_x * jitter
+            y = math.sin(angle) * radius_y * jitter
+            rx = x * math.cos(rotation) - y * math.sin(rotation)
+            ry = x * math.sin(rotation) + y * math.cos(rotation)
+            ring.append((lat + ry * scale_lat, lon + rx * scale_lon))
+        ring.append(ring[0])
+
+        height = round(3.0 + rng.random() * 60.0, 1)
+        yield f"{kind}_{index + 1}", height, ring
+
+
+def writeShapefile(dir_path: str, kind: str, count: int, vertices: int, spread: int, crs: str = "EPSG:6668", seed: int = 0) -> str:
+    """
+    合成データをShapeファイルに出力する（QGISが必要）
+
+    @param crs: 出力する座標参照系（EPSG:6668 または平面直角座標系 EPSG:6669～6687）
+    @return: 出力したファイルのパス
+    """
+    from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsFeature, QgsField, QgsFields,
+                           QgsGeometry, QgsPointXY, QgsProject, QgsVectorFileWriter, QgsWkbTypes)
+    from qgis.PyQt.QtCore import QVariant
+
+    os.makedirs(dir_path, exist_ok=True)
+    path = os.path.join(dir_path, f"{kind}.shp")
+
+    fields = QgsFields()
+    fields.append(QgsField("gml_id", QVariant.String))
+    fields.append(QgsField("height", QVariant.Double))
+
+    dst_crs = QgsCoordinateReferenceSystem(crs)
+    transformer = None
+    if dst_crs.authid() != "EPSG:6668":
+        transformer = QgsCoordinateTransform(QgsCoordinateReferenceSystem("EPSG:6668"), dst_crs, QgsProject.instance())
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "ESRI Shapefile"
+    options.fileEncoding = "UTF-8"
+    writer = QgsVectorFileWriter.create(path, fields, QgsWkbTypes.Polygon, dst_crs, QgsProject.instance().transformContext(), options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise RuntimeError(writer.errorMessage())
+
+    batch = []
+    for gml_id, height, ring in featureRings(kind, count, vertices, spread, seed):
+        feature = QgsFeature(fields)
+        feature.setAttributes([gml_id, height])
+        geometry = QgsGeometry.fromPolygonXY([[QgsPointXY(lon, lat) for lat, lon in ring]])
+        if transformer is not None:
+            geometry.transform(transformer)
+        feature.setGeometry(geometry)
+        batch.append(feature)
+
+        if len(batch) >= SHAPE_BATCH_SIZE:
+            writer.addFeatures(batch)
+            batch = []
+
+    if len(batch) > 0:
+        writer.addFeatures(batch)
+    del writer
+
+    return path
+
+
+def writeBasemap(dir_path: str, count: int, vertices: int, spread: int, seed: int = 0) -> list:
+    """
+    合成データを基盤地図情報（FG-GML、建築物の外周線 BldA）の形式で出力する
+
+    BASEMAP_FEATURES_PER_FILE件ごとにファイルを分ける
+
+    @return: 出力したファイルのパス
+    """
+    os.makedirs(dir_path, exist_ok=True)
+
+    paths = []
+    writer = None
+    for index, (gml_id, _, ring) in enumerate(featureRings("building", count, vertices, spread, seed)):
+        if index % BASEMAP_FEATURES_PER_FILE == 0:
+            if writer is not None:
+                writer.write(BASEMAP_FOOTER)
+                writer.close()
+            path = os.path.join(dir_path, f"FG-GML-533946-BldA-20230101-{len(paths) + 1:04d}.xml")
+            paths.append(path)
+            writer = open(path, "w", encoding="utf-8")
+            writer.write(BASEMAP_HEADER)
+
+        pos_list = " ".join(f"{lat:.9f} {lon:.9f}" for lat, lon in ring)
+        writer.write(BASEMAP_FEATURE.format(id=index + 1, pos_list=pos_list))
+
+    if writer is not None:
+        writer.write(BASEMAP_FOOTER)
+        writer.close()
+
+    return paths
+
+
+def generateDataset(root_dir: str, fmt: str, kind: str, count: int, vertices: int, spread: int,
+                    crs: str = "EPSG:6668", seed: int = 0) -> str:
+    """
+    合成データのフォルダを作成する（同じ条件のフォルダがあれば作成しない）
+
+    @return: 合成データのフォルダ
+    """
+    if fmt == FORMAT_BASEMAP:
+        # 基盤地図情報は緯度経度の建物のみ
+        kind = "building"
+        crs = "EPSG:6668"
+
+    dir_path = os.path.join(root_dir, datasetName(fmt, kind, count, vertices, spread, crs))
+    done_path = os.path.join(dir_path, ".done")
+    if os.path.isfile(done_path):
+        return dir_path
+
+    if fmt == FORMAT_SHAPE:
+        writeShapefile(dir_path, kind, count, vertices, spread, crs, seed)
+    elif fmt == FORMAT_BASEMAP:
+        writeBasemap(dir_path, count, vertices, spread, seed)
+    else:
+        raise ValueError(f"対応していない形式です: {fmt}")
+
+    with open(done_path, "w") as f:
+        f.write("")
+
+    return dir_path
+
+
+BASEMAP_HEADER = """<?xml version="1.0" encoding="utf-8" ?>
+<Dataset xsi:schemaLocation="http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema FGD_GMLSchema.xsd"
+ xmlns:gml="http://www.opengis.net/gml/3.2"
+ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+ xmlns:xlink="http://www.w3.org/1999/xlink"
+ xmlns="http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema"
+ gml:id="Dataset1">
+<description>ベンチマーク用の合成データ</description>
+"""
+
+BASEMAP_FEATURE = """<BldA gml:id="K{id}">
+<fid>synthetic-{id}</fid>
+<lfSpanFr gml:id="K{id}-1"><gml:timePosition>2023-01-01</gml:timePosition></lfSpanFr>
+<devDate gml:id="K{id}-2"><gml:timePosition>2023-01-01</gml:timePosition></devDate>
+<orgGILvl>2500</orgGILvl>
+<vis>表示</vis>
+<area><gml:Surface gml:id="K{id}-3" srsName="fguuid:jgd2011.bl"><gml:patches><gml:PolygonPatch><gml:exterior><gml:Ring><gml:curveMember><gml:Curve gml:id="K{id}-4"><gml:segments><gml:LineStringSegment><gml:posList>{pos_list}</gml:posList></gml:LineStringSegment></gml:segments></gml:Curve></gml:curveMember></gml:Ring></gml:exterior></gml:PolygonPatch></gml:patches></gml:Surface></area>
+<type>普通建物</type>
+</BldA>
+"""
+
+BASEMAP_FOOTER = "</Dataset>\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成データを作成する")
+    parser.add_argument("root_dir", help="作成先のフォルダ")
+    parser.add_argument("--format", choices=FORMATS, default=FORMAT_SHAPE)
+    parser.add_argument("--kind", choices=list(KINDS), default="building")
+    parser.add_argument("--count", type=int, default=1000, help="地物数")
+    parser.add_argument("--vertices", type=int, default=6, help="外周の頂点数")
+    parser.add_argument("--spread", type=int, default=4, help="配置する範囲の一辺の3次メッシュ数")
+    parser.add_argument("--crs", default="EPSG:6668", help="Shapeファイルの座標参照系")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.format == FORMAT_SHAPE:
+        from benchmark_qgis import startQgis
+        startQgis()
+
+    print(generateDataset(args.root_dir, args.format, args.kind, args.count, args.vertices, args.spread, args.crs, args.seed))
+
+
+if __name__ == "__main__":
+    main()
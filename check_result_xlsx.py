@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ CheckResultXlsx  検査結果のExcelファイル出力
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# 検査結果を書き込むシート（テンプレートの1枚目）
+SHEET_PATH = "xl/worksheets/sheet1.xml"
+
+# セルに書き込める最大文字数
+CELL_MAX_LENGTH = 32767
+
+# XML 1.0で使えない制御文字
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class CheckResultTemplate:
+    """
+    検査結果テンプレート（xlsx）
+
+    テンプレートは1度だけ読み込み、指定したセルの値のみ書き換えたxlsxを出力する
+    セルの書式はテンプレートのものをそのまま使う
+    """
+
+    def __init__(self, template_path: str, cell_refs: list):
+        """
+        @param template_path: テンプレートのパス
+        @param cell_refs: 書き込むセルの位置（"C1"など）
+        """
+        with zipfile.ZipFile(template_path, "r") as template:
+            self.__entries = [(info, template.read(info.filename)) for info in template.infolist()]
+
+        sheet_xml = dict((info.filename, data) for info, data in self.__entries)[SHEET_PATH].decode("utf-8")
+
+        # シートを書き込むセルの前後で分割しておく
+        cells = []
+        for cell_ref in cell_refs:
+            match = re.search(r'<c r="%s"(?P<attrs>[^>]*?)(/>|>.*?</c>)' % cell_ref, sheet_xml)
+            if match is None:
+                raise ValueError(f"検査結果テンプレートにセル{cell_ref}がありません。")
+            style = re.search(r'\bs="(\d+)"', match.group("attrs"))
+            cells.append((match.start(), match.end(), cell_ref, style.group(1) if style else None))
+        cells.sort()
+
+        self.__parts = []
+        self.__cells = []
+        position = 0
+        for start, end, cell_ref, style in cells:
+            self.__parts.append(sheet_xml[position:start])
+            self.__cells.append((cell_ref, style))
+            position = end
+        self.__parts.append(sheet_xml[position:])
+
+    def write(self, path: str, values: dict):
+        """
+        セルに値を書き込んだxlsxを出力する
+
+        @param path: 出力先のパス
+        @param values: セルの位置と値（文字列） 指定しないセルはテンプレートのまま空にする
+        """
+        sheet_xml = [self.__parts[0]]
+        for (cell_ref, style), part in zip(self.__cells, self.__parts[1:]):
+            sheet_xml.append(makeCell(cell_ref, style, values.get(cell_ref)))
+            sheet_xml.append(part)
+        sheet_data = "".join(sheet_xml).encode("utf-8")
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as xlsx:
+            for info, data in self.__entries:
+                if info.filename == SHEET_PATH:
+                    data = sheet_data
+                xlsx.writestr(info, data, zipfile.ZIP_DEFLATED)
+
+
+def makeCell(cell_ref: str, style: str, value) -> str:
+    """
+    セルの要素（文字列はインライン文字列）を作成する
+
+    @param cell_ref: セルの位置
+    @param style: 書式の番号
+    @param value: 値 Noneは空のセル
+    """
+    style_attr = f' s="{style}"' if style is not None else ""
+    if value is None:
+        return f'<c r="{cell_ref}"{style_attr}/>'
+
+    text = INVALID_XML_CHARS.sub("", str(value))[:CELL_MAX_LENGTH]
+    return f'<c r="{cell_ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
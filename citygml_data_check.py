@@ -5,13 +5,12 @@
  ***************************************************************************/
 """
 import os
-import datetime
 
 from PyQt5.QtWidgets import QProgressDialog, QWidget, QFileDialog, QMessageBox
 from qgis.PyQt.QtCore import Qt, QObject
 from qgis.core import Qgis,QgsMessageLog
 
-from .citygml_data_check_process import CityGMLDataCheckProcess
+from .citygml_pipeline import createCheckProcess, createReportDir
 
 class CityGMLDataCheck(QObject):
 
@@ -20,10 +19,13 @@ class CityGMLDataCheck(QObject):
         self.iface = iface
         self.__progress_dialog = None
 
-    def gmlCheck_resultOutput(self, selectedFiles, parent_widget: QWidget):
+    def gmlCheck_resultOutput(self, selectedFiles, parent_widget: QWidget, check_results=None):
         '''
         /***************************************************************************
         検査と結果出力
+
+        @param check_results : 出力しながら検査した結果（gmlファイルのパス -> 検査結果）
+                               結果があるgmlファイルは検査せず、結果のみ出力する
         ***************************************************************************/
         '''
 
@@ -43,7 +45,7 @@ class CityGMLDataCheck(QObject):
 
         ###########################################################
         # スレッドインスタンスの生成と単独のコネクション設定
-        self.process = CityGMLDataCheckProcess(selectedFiles, self.out_dir)
+        self.process = createCheckProcess(selectedFiles, self.out_dir, check_results=check_results)
         self.process.started.connect(self.__progress_dialog.show)
         self.process.finished.connect(self.completed)
 
@@ -84,16 +86,8 @@ class CityGMLDataCheck(QObject):
                 break
 
         # さらに日時分のディレクトリを作成
-        dt_now = datetime.datetime.now()
-        self.out_dir = _out_dir + '/検査結果_' + dt_now.strftime('%Y%m%d_%H%M')
-
         try:
-            if os.path.isdir(self.out_dir) :
-                # もし、同一ディレクトリがあれば、秒を付与
-                self.out_dir = self.out_dir + dt_now.strftime('%S')
-
-            os.makedirs(self.out_dir)
-            os.makedirs(self.out_dir + "/合格")
+            self.out_dir = createReportDir(_out_dir)
         except Exception as e:
             self.iface.messageBar().pushMessage("検査結果", "フォルダ作成時にエラーが発生しました。", Qgis.Warning)
             QgsMessageLog.logMessage("フォルダ作成時にエラーが発生しました。", e)
@@ -139,5 +133,3 @@ class CityGMLDataCheck(QObject):
         # 終了の諸処理2
         self.__progress_dialog = None
         self.process = None
-
-
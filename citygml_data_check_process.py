@@ -9,11 +9,26 @@ import os
 import shutil
 
 import xml.etree.ElementTree as ET 
-import win32com.client
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
 from PyQt5.QtGui import QPolygonF
 from qgis.PyQt.QtCore import QThread, QLineF, QPointF, pyqtSignal
-from qgis.core import QgsGeometry, QgsPointXY, QgsRectangle, QgsMessageLog
+from qgis.core import QgsApplication, QgsGeometry, QgsPointXY, QgsRectangle, QgsMessageLog, QgsSpatialIndex, QgsVectorLayer
+
+from .check_result_xlsx import CheckResultTemplate
+from .codelist_index import CodelistIndex, findCodelistDirs
+from .process_pool import spawnContext
+from .tracing import addTraceEvents, isTracing, startTracing, stopTracing, traceSession, traceSpan
+
+# 検査結果を書き込むセル
+RESULT_CELLS = ["C1"] + [column + row for row in ["3", "4", "9", "10", "11", "12", "13", "14", "20", "24", "28"] for column in ["G", "H"]]
+
+# 検査結果のExcelファイルを並行して書き込む数
+REPORT_WORKERS = 4
+
+# 自己交差チェックで平面走査を使う線分数（少ない場合は総当たりの方が速い）
+SWEEP_MIN_SEGMENTS = 32
 
 class CityGMLDataCheckProcess(QThread):
 
@@ -26,15 +41,20 @@ class CityGMLDataCheckProcess(QThread):
 
         self.was_canceled = False
         self.dir_check_flg = True
-        self.excel_app = None
+        self.worker_count = 1
+        self.check_results = None
+        self.file_results = {}
+        self.report_template = None
+        self.report_executor = None
+        self.report_futures = []
+        self.progress_step = 0
 
-        # 応用スキーマの名称
-        self.appli_schemas = ['Building', 'BuildingPart', 'RoofSurface', 'WallSurface', 'GroundSurface', 'OuterCeilingSurface', 'OuterFloorSurface', 'ClosureSurface', 'OuterBuildingInstallation', 'Relief', 'TINRelief', 'Road', 'UrbanPlan', 'AreaClassification', 'DistrictAndZones', 'LandUse', 'GenericCityObject', 'WaterBody']
+        # トレースファイルの出力先（空の場合は記録しない）
+        self.trace_dir = ""
 
         # 検査結果テンプレートのパス
         self.template_xlsx = os.path.join(os.path.dirname(__file__), 'check_result', 'Result_List.xlsx')
 
-
     def run(self):
         '''
         /***************************************************************************
@@ -42,214 +62,682 @@ class CityGMLDataCheckProcess(QThread):
         ***************************************************************************/
         '''
 
-        # 外部XML(コードリスト)の検査結果
-        self.parsed_codelists = {}
+        with traceSession(self.trace_dir, "check"):
+            self.checkFiles()
+
+
+    def checkFiles(self):
+        '''
+        /***************************************************************************
+        ファイル単位の検査と結果出力
+        ***************************************************************************/
+        '''
 
         ######################################################
-        # Excelを開いておく
-        try:
-            self.excel_app = win32com.client.GetObject(Class="Excel.Application")
-        except:
-            self.excel_app = win32com.client.Dispatch("Excel.Application")        
+        # 検査結果テンプレートは1度だけ読み込んでおく
+        self.report_template = CheckResultTemplate(self.template_xlsx, RESULT_CELLS)
+        self.report_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS)
+        self.report_futures = []
 
         ################################################################
         # ファイル単位でループ
-        # selectedFiles = self.selectedFiles
         self.dir_check_flg = True
 
-        # 進捗バー表示の変数
-        step = 0
-        total_file_cnt = len(self.selectedFiles) # 出力ファイル数
-
         # プロセスダイアログに0%を明記
+        self.progress_step = 0
         self.progress_signal.emit(0)
 
-        for fileInfo in self.selectedFiles:
+        # 外部XML(コードリスト)のフォルダ
+        # gmlファイルから参照されるcodelistsフォルダは先にまとめて解析しておく
+        codelist_dirs = findCodelistDirs([fileInfo[0] for fileInfo in self.selectedFiles])
+
+        try:
+            check_files = self.selectedFiles
+            if self.check_results is not None:
+                # 出力しながら検査した結果があるファイルは結果のみ出力し、
+                # 結果がないファイル（差分出力で出力しなかったメッシュなど）はgmlファイルを検査する
+                self.outputCheckResults()
+                check_files = [fileInfo for fileInfo in self.selectedFiles if fileInfo[0] not in self.check_results]
+
+            if self.was_canceled or len(check_files) == 0:
+                pass
+            elif self.worker_count > 1 and len(check_files) > 1:
+                self.checkInParallel(codelist_dirs, check_files)
+            else:
+                self.checkInOrder(codelist_dirs, check_files)
+
+            # 検査結果出力の終了
+            self.waitResultReports()
+        finally:
+            self.report_executor.shutdown()
+
+
+    def checkInOrder(self, codelist_dirs, check_files):
+        '''
+        /***************************************************************************
+        ファイルを1つずつ検査して結果出力
+
+        @param codelist_dirs : 先に解析しておくcodelistsフォルダ
+        @param check_files   : 検査するファイル（selectedFilesと同じ形式）
+        ***************************************************************************/
+        '''
+
+        # 外部XML(コードリスト)の値の索引
+        codelist_index = CodelistIndex()
+        for codelist_dir in codelist_dirs:
+            codelist_index.preload(codelist_dir)
+
+        checker = CityGMLFileChecker(codelist_index, self.wasCanceled)
+
+        for fileInfo in check_files:
 
             if self.was_canceled:
                 break
 
             # ファイルパスを取得
             gml_file_path = fileInfo[0]
-            # VectorLayerを取得
+            # VectorLayerを取得（作成していない場合はgmlファイルから作成）
             layer = fileInfo[1]
+            if layer is None:
+                layer = QgsVectorLayer(gml_file_path, os.path.basename(gml_file_path), "ogr")
 
-            v_feature_count = layer.featureCount() # レイヤの地物数
-            gml_bld_count = 0 # gmlファイルの地物数
+            results = checker.checkFile(gml_file_path, layer)
 
-            # ファイル単位の初期処理
-            self.init_on_file()
+            if self.was_canceled:
+                # ファイル単位のループを抜ける
+                break
 
             ################################################################
-            # XML解析
-            try:
-                # 読み込みと解析
-                tree = ET.parse(gml_file_path) 
-            except Exception as e:
-                # parseエラーがあればここでメッセージ格納
-                #【2.1】整形式（Well-Formed XML)
-                self.check_msg_building_2_1 = e
-                tree = None
+            # 検査結果出力（ファイル単位）
+            ################################################################
+            self.result_out_put(gml_file_path, results)
+
+            ################################################################
+            # プロセスカウントアップ（ファイル単位）
+            self.countUpProgress()
+
+            # end file loop
+
+
+    def outputCheckResults(self):
+        '''
+        /***************************************************************************
+        出力しながら検査した結果を出力（結果があるgmlファイルは検査しない）
+        ***************************************************************************/
+        '''
+
+        for fileInfo in self.selectedFiles:
+
+            if self.was_canceled:
+                break
+
+            gml_file_path = fileInfo[0]
+            if gml_file_path not in self.check_results:
+                continue
 
             ################################################################
-            #【2.2】妥当なXML文書
-            if not layer.isValid():
-                self.check_msg_building_2_2 = "VectorLayerとして有効ではない"
+            # 検査結果出力（ファイル単位）
+            self.result_out_put(gml_file_path, self.check_results[gml_file_path])
 
-            if tree :
-                layer_rect = None
-                root = tree.getroot()
+            ################################################################
+            # プロセスカウントアップ（ファイル単位）
+            self.countUpProgress()
 
-                # 要素のデータを1つずつ取得
-                for child in root:
 
-                    if self.was_canceled:
-                        # 子要素単位のループを抜ける
+    def checkInParallel(self, codelist_dirs, check_files):
+        '''
+        /***************************************************************************
+        ファイルをワーカープロセスで並列に検査して結果出力
+        ワーカープロセスではgmlファイルからVectorLayerを作成し直す
+        進捗は検査が終わったファイル数で通知する
+        検査できなかったファイルは不合格とし、ワーカープロセスが異常終了した場合は
+        残りのファイルをこのプロセスで検査する
+
+        @param codelist_dirs : 先に解析しておくcodelistsフォルダ
+        @param check_files   : 検査するファイル（selectedFilesと同じ形式）
+        ***************************************************************************/
+        '''
+
+        context = spawnContext()
+
+        remaining = iter(check_files)
+        pending = {}
+        unchecked_files = [] # ワーカープロセスの異常終了で検査できなかったファイル
+        broken = False
+        with ProcessPoolExecutor(max_workers=self.worker_count, mp_context=context,
+                                 initializer=initCheckWorker, initargs=(QgsApplication.prefixPath(), codelist_dirs, isTracing())) as executor:
+            while True:
+                # 中止されていなければワーカーにファイルを渡す（ワーカー数の2倍まで）
+                while not self.was_canceled and not broken and len(pending) < self.worker_count * 2:
+                    fileInfo = next(remaining, None)
+                    if fileInfo is None:
                         break
+                    try:
+                        pending[executor.submit(checkFileInWorker, fileInfo[0])] = fileInfo
+                    except BrokenProcessPool:
+                        broken = True
+                        unchecked_files.append(fileInfo)
+
+                if len(pending) == 0:
+                    break
+
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    fileInfo = pending.pop(future)
+                    gml_file_path = fileInfo[0]
+                    if future.cancelled() or self.was_canceled:
+                        continue
+
+                    try:
+                        # ワーカープロセスで記録した区間
+                        results, trace_events = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        unchecked_files.append(fileInfo)
+                        continue
+                    except Exception as e:
+                        # 検査できなかったファイルは不合格として続ける
+                        QgsMessageLog.logMessage(f"{gml_file_path}を検査できませんでした。{e}")
+                        self.dir_check_flg = False
+                        self.countUpProgress()
+                        continue
+                    addTraceEvents(trace_events)
 
                     ################################################################
-                    if child.tag.endswith("boundedBy"): # gml:boundedBy (１ファイル１つ前提)
+                    # 検査結果出力（ファイル単位）
+                    self.result_out_put(gml_file_path, results)
 
-                        layer_extent = []
-                        for envelop in child:
-                            # EPSGのチェック
-                            crs = envelop.attrib['srsName']
+                    ################################################################
+                    # プロセスカウントアップ（ファイル単位）
+                    self.countUpProgress()
 
-                            #【2.5】CityGMLファイルのEPSGコード"
-                            if not crs.endswith("6697"):
-                                self.check_msg_building_2_5.append(str(crs)) 
+                if self.was_canceled:
+                    # 未着手のファイルは取り消す
+                    for future in pending:
+                        future.cancel()
 
-                            # CityGMLファイル上で記載された領域を取得
-                            for point in envelop:
-                                temp_array = point.text.split(" ")
-                                layer_extent.append(float(temp_array[0]))
-                                layer_extent.append(float(temp_array[1]))
+        if broken and not self.was_canceled:
+            QgsMessageLog.logMessage("検査のワーカープロセスが異常終了したため、残りのファイルは並列にせず検査します。")
+            self.checkInOrder(codelist_dirs, unchecked_files + list(remaining))
 
-                        layer_rect = QgsRectangle(layer_extent[0], layer_extent[1], layer_extent[2], layer_extent[3])
 
-                    ################################################################
-                    elif child.tag.endswith("cityObjectMember"):
-                        for building in child:
-                            ################################################################
-                            # 建物の単位の処理
-                            bld_index = str(building.attrib).index("id':") + 5
-                            building_id = str(building.attrib)[bld_index:].replace("\'", "").replace("}", "")
-
-                            coodscape_array = []
-
-                            ################################################################
-                            # タグのチェック
-                            schema_flg = False
-                            for schema in self.appli_schemas:
-                                if building.tag.endswith(schema):
-                                    schema_flg = True
-                                    break
-
-                            if not schema_flg:
-                                self.check_msg_building_2_3.append("gml_id:" + building_id + " [" + building.tag + "]")
-                                break
-
-                            for element in building:
-                                # 各建物の立体情報
-                                if(element.tag.endswith("lod1Solid")) :
-                                    polygon_array = []
-                                    self.isSelfIntersect = []       # 自己交差
-                                    self.isPolygonIntersect = []    # 境界面交差
-                                    self.isNotClosed = []           # 境界面自身が閉じている（検査項目外）
-
-                                    # Polygon(側面)単位での処理
-                                    surface_polygon_array = getPosListArray(element) # posListを配列にしたPolygon単位の配列
-                                    surface_idx = 0 # ログ出力のため
-                                    for postlist in surface_polygon_array:
-                                        # start surface
-                                        line_array = []
-
-                                        ################################################################
-                                        # チェックのための準備
-                                        # 点のリストを作成
-                                        points = getPoints(postlist)
-
-                                        if (len(points) < 3):
-                                            continue
-
-                                        # ポリゴンと線作成
-                                        polygon = QPolygonF()
-                                        polygon.append(points[0]) # 1,2番目はここで追加
-                                        polygon.append(points[1])
-                                        for ip in range(2, len(points)):
-                                            # ポリゴンに点を追加
-                                            polygon.append(points[ip])
-                                            # 点のリストから順に線分を生成
-                                            line_array.append(QLineF(points[ip-2],points[ip-1]))
-                                            ip = ip + 1
-
-                                        ################################################################
-                                        # ポリゴン判定
-                                        if self.checkPolygon(surface_idx, polygon, line_array):
-                                            polygon_array.append(polygon)
-
-                                        surface_idx = surface_idx + 1
-                                        # end surface
-
-                                    ################################################################
-                                    # 【12.5】ポリゴン間の交差（重複）判定
-                                    self.checkPolygon2Polygon(surface_idx, polygon_array)
-
-                                else:
-                                    # codeSpaceチェック
-                                    coodscape_array.append(getCodeSpaces(element))
-                            
-                            # gmlの地物数カウントアップ
-                            gml_bld_count = gml_bld_count + 1
-
-                            ################################################################
-                            # ファイル単位のメッセージ配列に格納
-                            for coods in coodscape_array:
-                                for cood in coods:
-                                    #【2.4】codeSpaceにより指定された辞書に定義されていない値となっている箇所数
-                                    # codelistsフォルダの階層は規定で決まっている
-                                    ret_flg = self.checkCodeOnCodeList(gml_file_path + "/../" + cood[0], cood[1])
-                                    if not ret_flg:
-                                        self.check_msg_building_2_4.append("gml_id : " + building_id + " [xml:" + cood[0] + " code:" + str(cood[1]) + "]")
-
-                            if self.isSelfIntersect:
-                                for selfIntersect in self.isSelfIntersect:
-                                    self.check_msg_building_2_12_1.append("gml_id : " + building_id + " surfaceMember@:" + str(selfIntersect))
-
-                            if self.isPolygonIntersect:
-                                for intersect in self.isPolygonIntersect:
-                                    self.check_msg_building_2_12_5.append("gml_id : " + building_id + " surfaceMember@:" + str(intersect))
-
-                ################################################################
-                # レイヤ内の地物チェック
+    def countUpProgress(self):
+        '''
+        /***************************************************************************
+        結果を出力したファイル数で進捗を通知
+        ***************************************************************************/
+        '''
+        self.progress_step += 1
+        progress_value = round(self.progress_step * 100 / len(self.selectedFiles))
+        self.progress_signal.emit(progress_value)
+
+
+    def result_out_put(self, gml_file_path, results):
+        '''
+        /***************************************************************************
+        gmlファイル単位の検査結果出力処理
+
+        @param gml_file_path     : gmlファイルパス
+        @param results           : 検査結果（CityGMLFileChecker.results）
+        ***************************************************************************/
+        '''
+
+        url_temp = gml_file_path.split("/")
+        org_fileName = url_temp[len(url_temp)-1]
+        fileName = org_fileName.replace(".gml", ".xlsx")
+
+        # ファイル単位のチェックフラグ
+        file_check_flg = True
+        self.file_results[gml_file_path] = results
+
+        # セルにファイル名を記載
+        values = {"C1": "対象ファイル：" + org_fileName}
+
+        # 検査結果配列とセルの位置マッピング
+        check_arrays = [
+            [results["1_1"], "3"],
+            [results["1_2"], "4"],
+            [results["2_1"], "9"],
+            [results["2_2"], "10"],
+            [results["2_3"], "11"],
+            [results["2_4"], "12"],
+            [results["2_5"], "13"],
+            [results["2_6"], "14"],
+            [results["2_12_1"], "20"],
+            [results["2_12_5"], "24"],
+            [results["2_16"], "28"],
+        ]
+
+        ######################################################
+        # 検査結果を該当セルに書き込み
+        for ck in check_arrays:
+            if not ck[0] :
+                values["G" + ck[1]] = "合格"
+            else :
+                if file_check_flg: # １度FalseになったらそのままFalseを保持
+                    file_check_flg = False
+
+                values["G" + ck[1]] = "不合格"
+                values["H" + ck[1]] = str(ck[0]).replace("[","").replace("]","")  # 詳細
+
+        ######################################################
+        # NG発生時の処理
+        if file_check_flg == False:
+            # 処理共通のチェックフラグをNGにする
+            self.dir_check_flg = False
+
+        ######################################################
+        # 保存実行（Excelファイルの書き込みは並行して行う）
+        self.report_futures.append(
+            self.report_executor.submit(writeResultReport, self.report_template, values, self.out_dir, fileName, file_check_flg))
+
+
+    def waitResultReports(self):
+        '''
+        /***************************************************************************
+        検査結果出力の完了待ち
+        ***************************************************************************/
+        '''
+
+        try:
+            for future in self.report_futures:
+                future.result()
+        except Exception as e:
+            QgsMessageLog.logMessage(f"出力に失敗しました。{e}")
+            raise
+        finally:
+            self.report_futures = []
+
+    def cancel(self):
+        '''
+        /***************************************************************************
+        検査および出力処理をキャンセル
+        ***************************************************************************/
+        '''
+        # self.wait()
+        # ret = QMessageBox.question(None, "CityGML検査", "検査途中ですが、キャンセルしてよろしいですか？", QMessageBox.Yes, QMessageBox.No)
+        # if ret == QMessageBox.Yes:
+        #     self.was_canceled = True
+        self.was_canceled = True
+
+
+    def wasCanceled(self):
+        '''
+        /***************************************************************************
+        本インスタンスのwas_canceledを取得
+        ***************************************************************************/
+        '''
+        return self.was_canceled
+
+
+    def dirCheckFlg(self):
+        '''
+        /***************************************************************************
+        本インスタンスのdirCheckFlgを取得
+        ***************************************************************************/
+        '''
+        return self.dir_check_flg
+
+
+    def fileResults(self):
+        '''
+        /***************************************************************************
+        ファイル単位の検査結果（gmlファイルパス -> 検査結果）を取得
+        ***************************************************************************/
+        '''
+        return self.file_results
+
+
+    def workerCount(self):
+        '''
+        /***************************************************************************
+        ファイルを並列に検査するワーカープロセス数を取得
+        ***************************************************************************/
+        '''
+        return self.worker_count
+
+
+    def setWorkerCount(self, count):
+        '''
+        /***************************************************************************
+        ファイルを並列に検査するワーカープロセス数を設定（1以下は並列にしない）
+        ***************************************************************************/
+        '''
+        self.worker_count = max(1, count)
+
+
+    def traceDir(self):
+        '''
+        /***************************************************************************
+        トレースファイルの出力先を取得
+        ***************************************************************************/
+        '''
+        return self.trace_dir
+
+
+    def setTraceDir(self, trace_dir):
+        '''
+        /***************************************************************************
+        トレースファイルの出力先を設定（処理段階ごとの処理時間を記録する 空の場合は記録しない）
+        ***************************************************************************/
+        '''
+        self.trace_dir = trace_dir or ""
+
+
+    def setCheckResults(self, check_results):
+        '''
+        /***************************************************************************
+        出力しながら検査した結果を設定（結果があるgmlファイルは検査しない）
+
+        @param check_results : gmlファイルのパス -> 検査結果（CityGMLFileChecker.results）
+        ***************************************************************************/
+        '''
+        self.check_results = check_results
+
+
+class CityGMLFileChecker:
+    '''
+    /***************************************************************************
+    gmlファイル単位の検査処理
+    スレッドやワーカープロセスから使えるよう、検査結果のみを返す
+    ***************************************************************************/
+    '''
+
+    def __init__(self, codelist_index, is_canceled=None):
+        '''
+        @param codelist_index : 外部XML(コードリスト)の値の索引
+        @param is_canceled    : キャンセルされたかを返す関数
+        '''
+        self.codelist_index = codelist_index
+        self.is_canceled = is_canceled if is_canceled is not None else (lambda: False)
+
+        # 応用スキーマの名称
+        self.appli_schemas = ['Building', 'BuildingPart', 'RoofSurface', 'WallSurface', 'GroundSurface', 'OuterCeilingSurface', 'OuterFloorSurface', 'ClosureSurface', 'OuterBuildingInstallation', 'Relief', 'TINRelief', 'Road', 'UrbanPlan', 'AreaClassification', 'DistrictAndZones', 'LandUse', 'GenericCityObject', 'WaterBody']
+
+        # 地物単位のポリゴンの検査結果
+        self.isSelfIntersect = []       # 自己交差
+        self.isPolygonIntersect = []    # 境界面交差
+        self.isNotClosed = []           # 境界面自身が閉じている（検査項目外）
+
+        self.init_on_file()
+
+
+    def checkFile(self, gml_file_path, layer):
+        '''
+        /***************************************************************************
+        gmlファイル単位の検査
+
+        @param gml_file_path : gmlファイルパス
+        @param layer         : gmlファイルのVectorLayer
+        @return              : 検査結果（results）
+        ***************************************************************************/
+        '''
+
+        with traceSpan("checkFile", file=os.path.basename(gml_file_path)):
+            return self.checkFileContents(gml_file_path, layer)
+
+
+    def checkFileContents(self, gml_file_path, layer):
+        '''
+        /***************************************************************************
+        gmlファイルの要素とVectorLayerの地物の検査
+
+        @param gml_file_path : gmlファイルパス
+        @param layer         : gmlファイルのVectorLayer
+        @return              : 検査結果（results）
+        ***************************************************************************/
+        '''
+
+        v_feature_count = layer.featureCount() # レイヤの地物数
+        gml_bld_count = 0 # gmlファイルの地物数
+
+        # ファイル単位の初期処理
+        self.init_on_file()
+
+        ################################################################
+        # XML解析
+        # ルート直下の要素ごとに読み込み、検査が済んだ要素は破棄する（ファイル全体を保持しない）
+        layer_rect = None
+        parse_error = None
+        children = iterRootChildren(gml_file_path)
+        while True:
+            try:
+                # 読み込みと解析
+                child = next(children, None)
+            except Exception as e:
+                parse_error = e
+                break
+
+            if child is None:
+                break
+
+            if self.is_canceled():
+                # 子要素単位のループを抜ける
+                break
+
+            ################################################################
+            if child.tag.endswith("boundedBy"): # gml:boundedBy (１ファイル１つ前提)
+                with traceSpan("checkBoundedBy【2.5】"):
+                    layer_rect = self.checkBoundedBy(child)
+
+            ################################################################
+            elif child.tag.endswith("cityObjectMember"):
+                gml_bld_count = gml_bld_count + self.checkCityObjectMember(child, gml_file_path)
+
+        if parse_error is not None:
+            # parseエラーがあればそれまでの検査結果は破棄してここでメッセージ格納
+            #【2.1】整形式（Well-Formed XML)
+            self.init_on_file()
+            self.check_msg_building_2_1 = parse_error
+
+        ################################################################
+        #【2.2】妥当なXML文書
+        if not layer.isValid():
+            self.check_msg_building_2_2 = "VectorLayerとして有効ではない"
+
+        if parse_error is None:
+            ################################################################
+            # レイヤ内の地物チェック
+            with traceSpan("checkFeature【1.1】【2.6】【2.16】"):
                 self.checkFeature(layer, layer_rect)
 
-                # ベースデータとの確認
-                if gml_bld_count != v_feature_count:
-                    self.check_msg_building_1_2 = "地物数 参照データ:" + str(v_feature_count) + ", インスタンス:" + str(gml_bld_count)
+            # ベースデータとの確認
+            if gml_bld_count != v_feature_count:
+                self.check_msg_building_1_2 = "地物数 参照データ:" + str(v_feature_count) + ", インスタンス:" + str(gml_bld_count)
 
+        return self.results()
 
-            if self.was_canceled:
-                # ファイル単位のループを抜ける
+
+    def results(self):
+        '''
+        /***************************************************************************
+        ファイル単位の検査結果
+        ***************************************************************************/
+        '''
+        return {
+            "1_1": self.check_msg_building_1_1,
+            "1_2": self.check_msg_building_1_2,
+            "2_1": self.check_msg_building_2_1,
+            "2_2": self.check_msg_building_2_2,
+            "2_3": self.check_msg_building_2_3,
+            "2_4": self.check_msg_building_2_4,
+            "2_5": self.check_msg_building_2_5,
+            "2_6": self.check_msg_building_2_6,
+            "2_12_1": self.check_msg_building_2_12_1,
+            "2_12_5": self.check_msg_building_2_12_5,
+            "2_16": self.check_msg_building_2_16,
+        }
+
+
+    def checkBoundedBy(self, child):
+        '''
+        /***************************************************************************
+        gml:boundedByのチェック
+
+        @param child : gml:boundedBy要素
+        @return      : CityGMLファイル上で記載された領域
+        ***************************************************************************/
+        '''
+
+        layer_extent = []
+        for envelop in child:
+            # EPSGのチェック
+            crs = envelop.attrib['srsName']
+
+            #【2.5】CityGMLファイルのEPSGコード"
+            if not crs.endswith("6697"):
+                self.check_msg_building_2_5.append(str(crs)) 
+
+            # CityGMLファイル上で記載された領域を取得
+            for point in envelop:
+                temp_array = point.text.split(" ")
+                layer_extent.append(float(temp_array[0]))
+                layer_extent.append(float(temp_array[1]))
+
+        layer_rect = QgsRectangle(layer_extent[0], layer_extent[1], layer_extent[2], layer_extent[3])
+        return layer_rect
+
+
+    def checkCityObjectMember(self, child, gml_file_path):
+        '''
+        /***************************************************************************
+        core:cityObjectMember（地物）単位のチェック
+
+        @param child         : core:cityObjectMember要素
+        @param gml_file_path : gmlファイルパス
+        @return              : 地物数
+        ***************************************************************************/
+        '''
+
+        gml_bld_count = 0
+        for building in child:
+            ################################################################
+            # 建物の単位の処理
+            bld_index = str(building.attrib).index("id':") + 5
+            building_id = str(building.attrib)[bld_index:].replace("\'", "").replace("}", "")
+
+            coodscape_array = []
+
+            ################################################################
+            # タグのチェック
+            if not self.isAppliSchema(building.tag):
+                self.check_msg_building_2_3.append("gml_id:" + building_id + " [" + building.tag + "]")
                 break
 
+            for element in building:
+                # 各建物の立体情報
+                if(element.tag.endswith("lod1Solid")) :
+                    # Polygon(側面)単位での処理
+                    with traceSpan("checkSolid【2.12】", gml_id=building_id):
+                        self.checkSolid(getPosListArray(element)) # posListを配列にしたPolygon単位の配列
+
+                else:
+                    # codeSpaceチェック
+                    coodscape_array.append(getCodeSpaces(element))
+            
+            # gmlの地物数カウントアップ
+            gml_bld_count = gml_bld_count + 1
+
             ################################################################
-            # 検査結果出力（ファイル単位）
+            # ファイル単位のメッセージ配列に格納
+            with traceSpan("checkCodeOnCodeList【2.4】", gml_id=building_id):
+                for coods in coodscape_array:
+                    for cood in coods:
+                        #【2.4】codeSpaceにより指定された辞書に定義されていない値となっている箇所数
+                        # codelistsフォルダの階層は規定で決まっている
+                        ret_flg = self.checkCodeOnCodeList(gml_file_path + "/../" + cood[0], cood[1])
+                        if not ret_flg:
+                            self.check_msg_building_2_4.append("gml_id : " + building_id + " [xml:" + cood[0] + " code:" + str(cood[1]) + "]")
+
+            self.appendSurfaceMessages(building_id)
+
+        return gml_bld_count
+
+
+    def checkSolid(self, surface_polygon_array):
+        '''
+        /***************************************************************************
+        立体（lod1Solid）の境界面のチェック（自己交差、境界面交差）
+
+        @param surface_polygon_array : posListを配列にしたPolygon単位の配列
+        ***************************************************************************/
+        '''
+
+        polygon_array = []
+        self.isSelfIntersect = []       # 自己交差
+        self.isPolygonIntersect = []    # 境界面交差
+        self.isNotClosed = []           # 境界面自身が閉じている（検査項目外）
+
+        surface_idx = 0 # ログ出力のため
+        for postlist in surface_polygon_array:
+            # start surface
+            line_array = []
+
             ################################################################
-            self.result_out_put(gml_file_path)
+            # チェックのための準備
+            # 点のリストを作成
+            points = getPoints(postlist)
+
+            if (len(points) < 3):
+                continue
+
+            # ポリゴンと線作成
+            polygon = QPolygonF()
+            polygon.append(points[0]) # 1,2番目はここで追加
+            polygon.append(points[1])
+            for ip in range(2, len(points)):
+                # ポリゴンに点を追加
+                polygon.append(points[ip])
+                # 点のリストから順に線分を生成
+                line_array.append(QLineF(points[ip-2],points[ip-1]))
+                ip = ip + 1
 
             ################################################################
-            # プロセスカウントアップ（ファイル単位）
-            step += 1
-            progress_value = round(step * 100 / total_file_cnt)
-            self.progress_signal.emit(progress_value)
+            # ポリゴン判定
+            if self.checkPolygon(surface_idx, polygon, line_array):
+                polygon_array.append(polygon)
 
-            # end file loop
+            surface_idx = surface_idx + 1
+            # end surface
+
+        ################################################################
+        # 【12.5】ポリゴン間の交差（重複）判定
+        self.checkPolygon2Polygon(surface_idx, polygon_array)
+
+
+    def appendSurfaceMessages(self, building_id):
+        '''
+        /***************************************************************************
+        立体の境界面のチェック結果をファイル単位のメッセージ配列に格納
+
+        @param building_id : gml_id
+        ***************************************************************************/
+        '''
+
+        if self.isSelfIntersect:
+            for selfIntersect in self.isSelfIntersect:
+                self.check_msg_building_2_12_1.append("gml_id : " + building_id + " surfaceMember@:" + str(selfIntersect))
+
+        if self.isPolygonIntersect:
+            for intersect in self.isPolygonIntersect:
+                self.check_msg_building_2_12_5.append("gml_id : " + building_id + " surfaceMember@:" + str(intersect))
+
+
+    def isAppliSchema(self, tag):
+        '''
+        /***************************************************************************
+        タグが応用スキーマのものかチェック
+
+        @param tag : タグ名
+        ***************************************************************************/
+        '''
+
+        for schema in self.appli_schemas:
+            if tag.endswith(schema):
+                return True
+
+        return False
 
-        # Excel処理終了
-        if self.excel_app:
-            self.excel_app.Quit()
-                
 
     def init_on_file(self):
         '''
@@ -287,10 +775,16 @@ class CityGMLDataCheckProcess(QThread):
 
         ################################################################
         # ２．自己交差チェック（ポリゴン内の線分同士の交差） (No.12-1)
+        # 線分が多い場合は、範囲が重なる線分のみを平面走査で求めて判定する（判定の順番は総当たりと同じ）
+        candidates = None
+        if len(line_array) >= SWEEP_MIN_SEGMENTS:
+            candidates = overlappingSegments(line_array, len(line_array)-1)
+
         m = 0
         for org_line in line_array:
             m = m + 1
-            for n in range(0, len(line_array)-1):
+            targets = range(0, len(line_array)-1) if candidates is None else candidates[m-1]
+            for n in targets:
                 intersect_point = QPointF()
                 intersect_type  = org_line.intersect(line_array[n], intersect_point)
                 if intersect_type == QLineF.BoundedIntersection:
@@ -336,6 +830,20 @@ class CityGMLDataCheckProcess(QThread):
         ***************************************************************************/
         '''
 
+        features = ((feature.attribute('gml_id'), feature.geometry()) for feature in layer.getFeatures())
+        self.checkFeatures(features, layer_rect)
+
+
+    def checkFeatures(self, features, layer_rect):
+        '''
+        /***************************************************************************
+        地物のgml_idとジオメトリをチェック
+
+        @param features   : (gml_id, ジオメトリ)の並び
+        @param layer_rect : CityGMLファイル上で記載された領域
+        ***************************************************************************/
+        '''
+
         # xmlファイルに記載された領域
         # xy取得(xy反転)(数ミリバッファー)
         x1 = layer_rect.yMinimum() - 0.0001
@@ -347,26 +855,25 @@ class CityGMLDataCheckProcess(QThread):
         extent_geom  = QgsGeometry().fromRect(rect) 
         # extent_geom  = QgsGeometry().fromRect(layer_rect)
 
-        # 存在したgml_idの配列
-        layer_gml_ids = []
+        # 存在したgml_idの集合
+        layer_gml_ids = set()
         feature_geom_array = []
         feature_geom_id_array = [] # 上記配列の順番と同一に格納するgml_id
 
         # Feature
-        for feature in layer.getFeatures():
-            gml_id = feature.attribute('gml_id')
+        for gml_id, geometry in features:
             if gml_id:
 
                 #【1.1】すでに存在するかチェック 
                 if gml_id in layer_gml_ids:
                     self.check_msg_building_1_1.append("gml_id:" +  str(gml_id))
                 else:
-                    layer_gml_ids.append(gml_id)
+                    layer_gml_ids.add(gml_id)
 
                 #【2.6】GeometoryがExtent内
-                isExtent = extent_geom.contains(feature.geometry())
+                isExtent = extent_geom.contains(geometry)
                 if not isExtent:
-                    f_rect = feature.geometry().asGeometryCollection()[0].asQPolygonF().boundingRect()
+                    f_rect = geometry.asGeometryCollection()[0].asQPolygonF().boundingRect()
                     f_lower = f_rect.topLeft()
                     f_upper = f_rect.bottomRight()
                     self.check_msg_building_2_6.append(
@@ -374,187 +881,315 @@ class CityGMLDataCheckProcess(QThread):
                          + "but feature is (" + str(f_lower.x()) + "," + str(f_lower.y()) + "), (" + str(f_upper.x()) + "," + str(f_upper.y()) + "). ]")
 
                 # 地物同士の重さなりのため格納（LOD1なので、２次元で確認）
-                collection = feature.geometry().asGeometryCollection()
+                collection = geometry.asGeometryCollection()
                 feature_geom_array.append(QgsGeometry.fromQPolygonF(collection[len(collection)-1].asQPolygonF()))
                 feature_geom_id_array.append(gml_id)
 
         #【2.16】地物同士の重さなり
-        for i in range(0, len(feature_geom_array)-1):
-            for j in range(i+1, len(feature_geom_array)-1):
-                isOver = feature_geom_array[i].contains(feature_geom_array[j]) # 壁がくっついていてもNG
+        # 空間インデックスで範囲が重なる地物のみを求め、番号順に判定する（判定の順番は総当たりと同じ）
+        target_count = len(feature_geom_array)-1
+        spatial_index = QgsSpatialIndex()
+        for j in range(0, target_count):
+            if not feature_geom_array[j].isEmpty():
+                spatial_index.addFeature(j, feature_geom_array[j].boundingBox())
+
+        for i in range(0, target_count):
+            geom = feature_geom_array[i]
+            if geom.isEmpty():
+                continue
+
+            # 含む地物の範囲は自分の範囲内にある
+            rect = geom.boundingBox()
+            candidates = sorted(j for j in spatial_index.intersects(rect)
+                                if j > i and rect.contains(feature_geom_array[j].boundingBox()))
+            if len(candidates) == 0:
+                continue
+
+            # 判定が複数ある場合は準備済みジオメトリで判定する
+            engine = None
+            if len(candidates) > 1:
+                engine = QgsGeometry.createGeometryEngine(geom.constGet())
+                engine.prepareGeometry()
+
+            for j in candidates:
+                if engine is None:
+                    isOver = geom.contains(feature_geom_array[j]) # 壁がくっついていてもNG
+                else:
+                    isOver = engine.contains(feature_geom_array[j].constGet())
                 if isOver:
                     self.check_msg_building_2_16.append(str(feature_geom_id_array[i]) + "," + str(feature_geom_id_array[j]))
                     break
 
 
-    def result_out_put(self, gml_file_path):
+    def checkCodeOnCodeList(self, path, code):
         '''
         /***************************************************************************
-        gmlファイル単位の検査結果出力処理
-
-        @param gml_file_path     : gmlファイルパス
+        コードリストに値が存在するかを確認する
+        コードリストをXML解析するが、値の集合を保存して、同一コードリストの場合に参照
+        
+        @param path     : コードリストのファイルパス（gmlファイルからの相対パス）
+        @param code     : 値
         ***************************************************************************/
         '''
 
-        url_temp = gml_file_path.split("/")
-        org_fileName = url_temp[len(url_temp)-1]
-        fileName = org_fileName.replace(".gml", ".xlsx")
+        # コードリストは1度だけ解析し、値の集合を参照する
+        return self.codelist_index.contains(path, code)
 
-        # ファイル単位のチェックフラグ
-        file_check_flg = True
 
-        ######################################################
-        # Excel操作開始
-        try:
-            # 検査結果テンプレートを開く
-            wb = self.excel_app.Workbooks.Open(self.template_xlsx)
-            self.excel_app.Visible = False
-            wb.Activate
-
-            #初期シート選択
-            ws = wb.Worksheets(1)
-
-            # セルにファイル名を記載
-            ws.Range("C1").Value = "対象ファイル：" + org_fileName
-
-            # 検査結果配列とセルの位置マッピング
-            check_arrays = [
-                [self.check_msg_building_1_1, "3"],
-                [self.check_msg_building_1_2, "4"],
-                [self.check_msg_building_2_1, "9"],
-                [self.check_msg_building_2_2, "10"],
-                [self.check_msg_building_2_3, "11"],
-                [self.check_msg_building_2_4, "12"],
-                [self.check_msg_building_2_5, "13"],
-                [self.check_msg_building_2_6, "14"],
-                [self.check_msg_building_2_12_1, "20"],
-                [self.check_msg_building_2_12_5, "24"],
-                [self.check_msg_building_2_16, "28"],
-            ]
-
-            ######################################################
-            # 検査結果を該当セルに書き込み
-            for ck in check_arrays:
-                if not ck[0] :
-                    ws.Range("G" + ck[1]).Value = "合格"
-                else :
-                    if file_check_flg: # １度FalseになったらそのままFalseを保持
-                        file_check_flg = False
-
-                    ws.Range("G" + ck[1]).Value = "不合格"
-                    ws.Range("H" + ck[1]).Value = str(ck[0]).replace("[","").replace("]","")  # 詳細
-
-            ######################################################
-            # 保存実行
-            out_fileName_path = os.path.join(self.out_dir, "合格", fileName)
-            wb.SaveCopyAs(out_fileName_path)
-
-            # 閉じる(保存しているので警告はないはずだが、念のため警告なしにする)
-            self.excel_app.DisplayAlerts = False
-            wb.Close(SaveChanges=False)
-            self.excel_app.DisplayAlerts = True
+class CityGMLInlineCheck:
+    '''
+    /***************************************************************************
+    CityGML出力中の地物単位の検査
+    出力したファイルを解析し直さず、出力する内容（タグ名、境界面のposList）と
+    メモリ上のジオメトリでCityGMLFileCheckerと同じ検査を行う
 
-        except Exception as e:
-            QgsMessageLog.logMessage("出力に失敗しました。", e)
-            # 処理終了
-            self.excel_app.Quit()
-            raise
+    整形式・妥当性（2.1、2.2）、EPSGコード（2.5）、地物数（1.2）、
+    codeSpace（2.4、出力しない）は出力の仕組み上合格となる
+    ***************************************************************************/
+    '''
 
-        ######################################################
-        # NG発生時の処理
-        if file_check_flg == False:
-            # 処理共通のチェックフラグをNGにする
-            self.dir_check_flg = False
+    def __init__(self):
+        self.checker = CityGMLFileChecker(None)
+        self.layer_rect = None
+        self.features = []
 
-            # NGフォルダに移動
-            NG_dir = os.path.join(self.out_dir, "不合格")
-            if not os.path.exists(NG_dir):
-                os.makedirs(NG_dir)
-            shutil.move(out_fileName_path, NG_dir)
+        # 出力中の地物
+        self.gml_id = None
+        self.schema_ok = True
+        self.bottom_pos_list = None
 
 
-    def checkCodeOnCodeList(self, path, code):
+    def setEnvelope(self, lower_corner, upper_corner):
         '''
         /***************************************************************************
-        コードリストに値が存在するかを確認する
-        コードリストをXML解析するが、解析結果は保存して、同一コードリストの場合に参照
-        
-        @param path     : コードリストのファイルパス（gmlファイルからの相対パス）
-        @param code     : 値
+        gml:boundedByの領域を設定
+
+        @param lower_corner : lowerCornerの文字列（緯度 経度 標高）
+        @param upper_corner : upperCornerの文字列（緯度 経度 標高）
         ***************************************************************************/
         '''
+        lower = lower_corner.split(" ")
+        upper = upper_corner.split(" ")
+        self.layer_rect = QgsRectangle(float(lower[0]), float(lower[1]), float(upper[0]), float(upper[1]))
 
-        if not os.path.isfile(path):
-            print("checkCodeOnCodeList : codelists is not exists.", path)
-            return False
 
-        tree = None
-        # 一度解析していたらそれを参照
-        if path in self.parsed_codelists:
-            tree =self.parsed_codelists[path]
-        else:
-            # XML解析
-            try:
-                # 読み込みと解析
-                tree = ET.parse(path) 
+    def beginFeature(self, tag, gml_id):
+        '''
+        /***************************************************************************
+        地物の出力開始
 
-                # selfの解析済み配列に格納
-                self.parsed_codelists[path] = tree
-            except:
-                print("checkCodeOnCodeList : codelists is not parsed.", path)
-                return False
-        
-        # スキーマにそって該当タグを参照して、値を確認
-        root = tree.getroot()
-        for child in root:
-            if child.tag.endswith("dictionaryEntry"):
-                for definition in child:
-                    for element in definition:
-                        if element.tag.endswith("name"):
-                            if code == element.text:
-                                # 該当する値がある（合格）
-                                return True
+        @param tag    : 名前空間のURI付きのタグ名（{URI}ローカル名）
+        @param gml_id : gml_id
+        ***************************************************************************/
+        '''
+        self.gml_id = gml_id
+        self.bottom_pos_list = None
 
-        
-        # 該当する値がなかった（不合格）
-        return False
+        #【2.3】応用スキーマのタグか
+        self.schema_ok = self.checker.isAppliSchema(tag)
+        if not self.schema_ok:
+            self.checker.check_msg_building_2_3.append("gml_id:" + str(gml_id) + " [" + tag + "]")
 
 
-    def cancel(self):
+    def addSolid(self, pos_lists):
         '''
         /***************************************************************************
-        検査および出力処理をキャンセル
+        出力した立体（lod1Solid）の境界面のチェック
+
+        @param pos_lists : 境界面（側面、底面の順）のposListの文字列
         ***************************************************************************/
         '''
-        # self.wait()
-        # ret = QMessageBox.question(None, "CityGML検査", "検査途中ですが、キャンセルしてよろしいですか？", QMessageBox.Yes, QMessageBox.No)
-        # if ret == QMessageBox.Yes:
-        #     self.was_canceled = True
-        self.was_canceled = True
+        if len(pos_lists) > 0:
+            self.bottom_pos_list = pos_lists[-1]
 
+        if self.schema_ok:
+            self.checker.checkSolid([pos_list.split(" ") for pos_list in pos_lists])
 
-    def wasCanceled(self):
+
+    def endFeature(self, geometry):
         '''
         /***************************************************************************
-        本インスタンスのwas_canceledを取得
+        地物の出力終了
+        立体を出力した場合は、gmlファイルから読み込むのと同じ底面のジオメトリで検査する
+
+        @param geometry : 出力した地物のジオメトリ
         ***************************************************************************/
         '''
-        return self.was_canceled
+        if self.bottom_pos_list is not None:
+            # posListは緯度、経度の順
+            points = getPoints(self.bottom_pos_list.split(" "))
+            geometry = QgsGeometry.fromPolygonXY([[QgsPointXY(point.y(), point.x()) for point in points]])
 
+        # タグが応用スキーマのものでなくても地物としては出力している
+        self.features.append((self.gml_id, geometry))
+        if self.schema_ok:
+            self.checker.appendSurfaceMessages(str(self.gml_id))
 
-    def dirCheckFlg(self):
+
+    def results(self):
         '''
         /***************************************************************************
-        本インスタンスのdirCheckFlgを取得
+        ファイル単位の検査結果（CityGMLFileChecker.results）
         ***************************************************************************/
         '''
-        return self.dir_check_flg
+        if self.layer_rect is not None:
+            self.checker.checkFeatures(self.features, self.layer_rect)
+
+        return self.checker.results()
+
+
+############################################################
+# ワーカープロセス
+############################################################
+
+# ワーカープロセスごとのQGISと検査処理
+worker_qgs_app = None
+worker_checker = None
+worker_trace = False
+
+def initCheckWorker(prefix_path, codelist_dirs, trace=False):
+    '''
+    /***************************************************************************
+    ワーカープロセスの初期処理
+    gmlファイルをVectorLayerとして開くため、QGISを初期化する
+
+    @param prefix_path   : QGISのインストール先
+    @param codelist_dirs : 先に解析しておくcodelistsフォルダ
+    @param trace         : ファイルごとの検査の区間を記録する
+    ***************************************************************************/
+    '''
+    global worker_qgs_app, worker_checker, worker_trace
+
+    worker_trace = trace
+
+    QgsApplication.setPrefixPath(prefix_path, True)
+    worker_qgs_app = QgsApplication([], False)
+    worker_qgs_app.initQgis()
+
+    codelist_index = CodelistIndex()
+    for codelist_dir in codelist_dirs:
+        codelist_index.preload(codelist_dir)
+    worker_checker = CityGMLFileChecker(codelist_index)
+
+
+def checkFileInWorker(gml_file_path):
+    '''
+    /***************************************************************************
+    ワーカープロセスでのgmlファイル単位の検査
+
+    @param gml_file_path : gmlファイルパス
+    @return              : (検査結果, 記録した区間 記録しない場合はNone)
+    ***************************************************************************/
+    '''
+    tracing = worker_trace and startTracing()
+
+    # 検査で例外が発生しても記録を終了する（次のファイルで記録を開始できるようにする）
+    trace_events = None
+    try:
+        layer = QgsVectorLayer(gml_file_path, os.path.basename(gml_file_path), "ogr")
+        results = worker_checker.checkFile(gml_file_path, layer)
+    finally:
+        if tracing:
+            trace_events = stopTracing().events()
+    return results, trace_events
 
 
 ############################################################
 # ユーティリティ
 ############################################################
 
+def iterRootChildren(path):
+    '''
+    /***************************************************************************
+    XMLファイルを逐次解析し、ルート直下の要素を1つずつ取得
+    取得した要素は次の要素の解析前にルートから取り除く（メモリを解放する）
+
+    @param path : XMLファイルのパス
+    ***************************************************************************/
+    '''
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth = depth + 1
+        else:
+            depth = depth - 1
+            if depth == 1:
+                # ルート直下の要素（子孫も含めて解析済み）
+                yield element
+                root.remove(element)
+
+
+def writeResultReport(template, values, out_dir, fileName, file_check_flg):
+    '''
+    /***************************************************************************
+    検査結果のExcelファイルを書き込む
+    合格フォルダに保存し、不合格の場合は不合格フォルダに移動する
+
+    @param template       : 検査結果テンプレート
+    @param values         : セルの位置と値
+    @param out_dir        : 検査結果の出力先
+    @param fileName       : 検査結果のファイル名
+    @param file_check_flg : ファイル単位のチェックフラグ
+    ***************************************************************************/
+    '''
+    out_fileName_path = os.path.join(out_dir, "合格", fileName)
+    with traceSpan("writeResultReport", file=fileName):
+        template.write(out_fileName_path, values)
+
+    if file_check_flg == False:
+        # NGフォルダに移動
+        NG_dir = os.path.join(out_dir, "不合格")
+        os.makedirs(NG_dir, exist_ok=True)
+        shutil.move(out_fileName_path, NG_dir)
+
+
+def overlappingSegments(line_array, target_count):
+    '''
+    /***************************************************************************
+    線分ごとに範囲（外接矩形）が重なる線分を取得
+    x方向に平面走査し、重なる組み合わせのみを判定する
+
+    QLineF.intersectの誤差で交差とされる組み合わせを落とさないよう、範囲は僅かに広げる
+
+    @param line_array   : 線分の配列
+    @param target_count : 判定相手とする線分数（先頭からの数）
+    @return             : 線分ごとの、範囲が重なる判定相手の番号の昇順の配列
+    ***************************************************************************/
+    '''
+    boxes = []
+    max_abs = 1.0
+    for line in line_array:
+        x1, y1, x2, y2 = line.x1(), line.y1(), line.x2(), line.y2()
+        boxes.append((min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)))
+        max_abs = max(max_abs, abs(x1), abs(y1), abs(x2), abs(y2))
+    margin = max_abs * 1e-9
+
+    candidates = [[] for _ in line_array]
+
+    # x方向の開始位置順に走査し、走査位置を過ぎた線分は対象から外す
+    active = []
+    for index in sorted(range(len(boxes)), key=lambda i: boxes[i][0]):
+        x_min, x_max, y_min, y_max = boxes[index]
+        active = [i for i in active if boxes[i][1] + margin >= x_min - margin]
+        for other in active:
+            other_box = boxes[other]
+            if other_box[2] - margin > y_max + margin or other_box[3] + margin < y_min - margin:
+                continue
+            if other < target_count:
+                candidates[index].append(other)
+            if index < target_count:
+                candidates[other].append(index)
+        active.append(index)
+
+    for targets in candidates:
+        targets.sort()
+
+    return candidates
+
+
 def getPosListArray(element):
     '''
     /***************************************************************************
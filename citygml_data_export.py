@@ -5,20 +5,16 @@
  ***************************************************************************/
 """
 
-import os
-import glob
-
 from qgis.PyQt.QtCore import QObject, pyqtSignal, Qt
 from qgis.PyQt.QtWidgets import QProgressDialog, QWidget, QDialog
 
 from qgis.core import *
 from qgis.gui import QgisInterface
 
-from .basedata_read_basemap import BasedataReadFromBasemap, extractBasemapFiles
-from .basedata_read_shape import BasedataReadFromShape
 from .attribute_setting_csv import AttributeSettingByCsv
-from .basedata_export import Exporter
 from .citygml_feature_type_dialog import CityGMLFeatureTypeDialog
+from .basedata_export import Exporter
+from .citygml_pipeline import EXPORT_SETTING_KEYS, CityGMLPipeline, PipelineError
 
 class CityGMLDataExport(QObject):
 
@@ -28,13 +24,16 @@ class CityGMLDataExport(QObject):
     def __init__(self, iface: QgisInterface, parent: QObject = None):
         super().__init__(parent)
         self.__iface = iface
-        self.__generator = None # 生成元データ
+        self.__pipeline = CityGMLPipeline() # 読み込みと出力設定
         self.__exporter = None
         self.__progress_dialog = None
 
         self.__attribute_setting_by_csv = None
         self.__last_error = ""
 
+        # 出力しながら検査した結果（出力したgmlファイルのパス -> 検査結果）
+        self.__check_results = {}
+
     def getFieldsOfData(self, dir_path: str):
         '''
         /***************************************************************************
@@ -43,40 +42,15 @@ class CityGMLDataExport(QObject):
         '''
 
         self.__last_error = ""
-        self.__generator = None
 
-        # 指定のディレクトリが存在するか確認
-        if os.path.exists(dir_path) == False:
-            self.__last_error = f"存在しないディレクトリです"
+        try:
+            # 生成クラスからフィールドリストを取得
+            return self.__pipeline.read(dir_path)
+        except PipelineError as e:
+            print(e)
+            self.__last_error = str(e)
             return []
 
-        # Shapeファイルか基盤地図ファイルの存在確認
-        cwd = os.path.abspath(os.getcwd())
-        os.chdir(dir_path)
-        shape_files = glob.glob("*.shp")
-        os.chdir(cwd)
-        
-        if len(shape_files) > 0:
-            # ShapeファイルからCityGMLを生成
-            self.__generator = BasedataReadFromShape()
-        else:
-            # Shapeファイルがないので基盤地図情報ファイルを探す
-            basemap_files = extractBasemapFiles(dir_path)
-            if len(basemap_files) == 0:
-                print("Shapeファイルおよび基盤地図情報データファイルが存在しません")
-                # 基盤地図情報ファイルなし
-                self.__last_error = f"Shapeファイルおよび基盤地図情報データファイルが存在しません"
-                self.__generator = None
-                return []
-
-            # 基盤地図ファイルからCityGMLを生成
-            self.__generator = BasedataReadFromBasemap()
-            
-        self.__generator.setDirectory(dir_path)
-
-        # 生成クラスからフィールドリストを取得
-        return self.__generator.fieldList()
-
 
     def getFieldsOfCsv(self, file_path: str):
         '''
@@ -91,6 +65,15 @@ class CityGMLDataExport(QObject):
             return self.__attribute_setting_by_csv.fieldList()
 
 
+    def checkResults(self) -> dict:
+        '''
+        /***************************************************************************
+        出力しながら検査した結果（出力したgmlファイルのパス -> 検査結果）
+        出力しながら検査していない場合は空
+        ***************************************************************************/
+        '''
+        return self.__check_results
+
     def lastError(self):
         return self.__last_error
 
@@ -101,24 +84,11 @@ class CityGMLDataExport(QObject):
         ***************************************************************************/
         '''
         self.__last_error = ""
+        self.__check_results = {}
 
-        # ベースデータが設定されていないときはエラー
-        if self.__generator is None:
-            return False
-
-        # 出力先のディレクトリが存在するか確認
-        if len(dest_dir_path) == 0:
-            self.__last_error = "出力先ディレクトリが設定されていません。"
-            return False
-        if os.path.exists(dest_dir_path) == False:
-            self.__last_error = "出力先ディレクトリは存在しません。"
-            return False
-        if os.path.isdir(dest_dir_path) == False:
-            self.__last_error = "出力先に指定されているのはディレクトリではありません。"
-            return False
-        existing_files = [f for f in os.listdir(dest_dir_path) if os.path.isfile(os.path.join(dest_dir_path, f))]
-        if len(existing_files) > 0:
-            self.__last_error = "出力先に既にファイルがあります。"
+        # 出力設定の確認
+        prepare_items = self.checkExportSettings(dest_dir_path, prepare_items)
+        if prepare_items is None:
             return False
 
         # 地物のタイプ
@@ -128,38 +98,12 @@ class CityGMLDataExport(QObject):
 
         feature_type = dlg.featureType()
 
-        # 設定項目の取得
-        # 必須項目
-        self.__generator.setRequiredField(prepare_items.get("required_field", "gml_id"))
-
-        # 地物データの属性を使用する or 外部CSVの属性使用する
-        self.__generator.setUseCsv(False)
-        # 地物データの高さフィールド
-        self.__generator.setHeightFeatureField(prepare_items.get("measured_height"))
-
-        # if "height_feature" in prepare_items:
-        #     self.__generator.setUseCsv(False)
-        #     # 地物データの高さフィールド
-        #     self.__generator.setHeightFeatureField(prepare_items.get("height_feature"))
-        # else:
-        #     self.__generator.setUseCsv(True)
-
-        #     # 外部CSVの高さフィールド
-        #     self.__generator.setHeightCsvField(prepare_items.get("height_csv"))
-        #     # 外部CSVのリンクキー
-        #     self.__generator.setLinkkeyCsvField(prepare_items.get("linkkey_csv"))
-
-        # 属性設定
-            #TODO:開発中 属性設定画面で設定する
-        # attribute_setting = ["color", "type"]
-        # self.__generator.setAttributes(attribute_setting)
-
         # 処理中ダイアログ表示
         self.__progress_dialog = QProgressDialog("CityGML出力中...","キャンセル",0, 100, parent_widget)
         self.__progress_dialog.setWindowModality(Qt.WindowModal)
 
         # エクスポート処理
-        self.__exporter = Exporter(self.__generator, feature_type, dest_dir_path)
+        self.__exporter = self.createExporter(dest_dir_path, prepare_items, feature_type)
 
         # connect
         self.__progress_dialog.canceled.connect(self.__exporter.cancel)
@@ -170,6 +114,55 @@ class CityGMLDataExport(QObject):
         # エクスポート開始
         self.__exporter.start()
 
+    def checkExportSettings(self, dest_dir_path: str, prepare_items: dict):
+        '''
+        /***************************************************************************
+        出力先と出力設定の確認
+
+        @param dest_dir_path : 出力先ディレクトリ
+        @param prepare_items : 画面などで指定した設定項目（config.iniの出力設定に上書きする）
+        @return              : 確認済みの設定項目 エラーの場合はNone（lastErrorで内容を取得する）
+        ***************************************************************************/
+        '''
+        self.__last_error = ""
+
+        # ベースデータが設定されていないときはエラー
+        if self.__pipeline.generator() is None:
+            return None
+
+        try:
+            self.configurePipeline(prepare_items)
+            return self.__pipeline.checkSettings(dest_dir_path)
+        except PipelineError as e:
+            self.__last_error = str(e)
+            return None
+
+    def createExporter(self, dest_dir_path: str, prepare_items: dict, feature_type: str) -> Exporter:
+        '''
+        /***************************************************************************
+        出力処理（Exporter）の生成
+
+        @param dest_dir_path : 出力先ディレクトリ
+        @param prepare_items : 確認済みの設定項目（checkExportSettings）
+        @param feature_type  : 地物のタイプ
+        ***************************************************************************/
+        '''
+        self.configurePipeline(prepare_items)
+        self.__pipeline.configure(feature_type=feature_type)
+        return self.__pipeline.createExporter(dest_dir_path)
+
+    def configurePipeline(self, prepare_items: dict):
+        '''
+        /***************************************************************************
+        画面などで指定した設定項目をパイプラインの出力設定にする
+
+        @param prepare_items : 設定項目（必須項目、高さ、config.iniのEXPORTセクションの項目）
+        ***************************************************************************/
+        '''
+        items = {key: value for key, value in prepare_items.items() if key in EXPORT_SETTING_KEYS}
+        self.__pipeline.configure(required_field=prepare_items.get("required_field", "gml_id"),
+                                  height_field=prepare_items.get("measured_height"), **items)
+
     def generateCompleted(self):
         '''
         /***************************************************************************
@@ -178,18 +171,21 @@ class CityGMLDataExport(QObject):
         '''
 
         canceled = False
+        exporter = self.__exporter
 
         if self.__progress_dialog is not None:
             self.__progress_dialog.hide()
 
-        if self.__exporter is not None:
-            self.__exporter.wait()
+        if exporter is not None:
+            exporter.wait()
 
-            vlayer = self.__exporter.dstVLayer(self.thread())
+            vlayer = exporter.dstVLayer(self.thread())
             QgsProject.instance().addMapLayer(vlayer)
 
-            canceled = self.__exporter.wasCanceled()
-            # filesInfo = self.__exporter.filesInfo()
+            canceled = exporter.wasCanceled()
+            # filesInfo = exporter.filesInfo()
+            if not canceled:
+                self.__check_results = exporter.checkResults()
 
         self.__progress_dialog = None
         self.__exporter = None
@@ -202,5 +198,9 @@ class CityGMLDataExport(QObject):
         _layers = QgsProject.instance().mapLayersByName("memory_layer")
         for memorylayer in _layers:
             QgsProject.instance().removeMapLayer(memorylayer.id())
+
+        # 一時GeoPackageを削除
+        if exporter is not None:
+            exporter.removeStaging()
         
-        self.__iface.mapCanvas().refresh()
\ No newline at end of file
+        self.__iface.mapCanvas().refresh()
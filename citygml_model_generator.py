@@ -12,11 +12,13 @@
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction
+from qgis.core import QgsApplication
 
 # Initialize Qt resources from file resources.py
 from .resources import *
 # Import the code for the dialog
 from .citygml_model_generator_dialog import CityGMLModelGeneratorDialog
+from .citygml_processing_provider import CityGMLModelGeneratorProvider
 import os.path
 
 
@@ -54,6 +56,7 @@ class CityGMLModelGenerator:
         # Check if plugin was started the first time in current QGIS session
         # Must be set in initGui() to survive plugin reloads
         self.first_start = None
+        self.provider = None
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -145,8 +148,15 @@ class CityGMLModelGenerator:
 
         return action
 
+    def initProcessing(self):
+        """Register the processing provider (also used by qgis_process)."""
+        self.provider = CityGMLModelGeneratorProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
+
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
+        self.initProcessing()
 
         icon_path = ':/plugins/citygml_model_generator/icon.png'
         self.add_action(
@@ -167,6 +177,10 @@ class CityGMLModelGenerator:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+
 
     def run(self):
         """Run method that performs all the real work"""
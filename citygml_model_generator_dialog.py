@@ -16,6 +16,7 @@ from .attribute_setting_dialog import AttributeSettingDialog
 from .citygml_data_export import CityGMLDataExport
 from .citygml_data_import import CityGMLDataImport
 from .citygml_data_check import CityGMLDataCheck
+from .citygml_pipeline import checkTargets
 
 # This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
@@ -295,6 +296,18 @@ class CityGMLModelGeneratorDialog(QtWidgets.QDialog, FORM_CLASS):
             QtWidgets.QMessageBox.information(self, self.windowTitle(), message)
 
         # 検査実行
+        # 出力しながら検査した場合はgmlファイルを読み込み直さず、検査結果のみ出力する
+        check_results = self.data_export.checkResults()
+        # 差分出力では今回出力しなかったgmlファイルも対象にし、結果がないファイルは検査する
+        if len(check_results) > 0:
+            gml_file_paths, check_results = checkTargets(self.citygml_export_folder_name.text(), check_results)
+            self.selectedFiles = [[gml_file_path, None] for gml_file_path in gml_file_paths]
+            self.citygml_data_check.gmlCheck_resultOutput(self.selectedFiles, self, check_results)
+
+            # 終了後にクリア
+            self.citygml_export_folder_name.clear()
+            return
+
         #  確認のためgmlファイルからVectorLayer再作成
         if not self.citygml_data_import.generatVectorLayer(self):
             print("generatVectorLayer is False")
@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ CityGMLPipeline  画面を使わないCityGMLの生成と検査
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import glob
+import time
+import datetime
+import threading
+
+from qgis.PyQt.QtCore import QSettings, Qt
+from qgis.core import QgsMessageLog
+
+from .basedata_read import BasedataRead
+from .basedata_read_basemap import BasedataReadFromBasemap, extractBasemapFiles
+from .basedata_read_shape import BasedataReadFromShape
+from .basedata_export import STAGINGS, Exporter
+from .citygml_data_check_process import CityGMLDataCheckProcess
+from .citygml_serializer import COMPRESSION_NONE, COMPRESSIONS
+from .export_manifest import MANIFEST_FILE_NAME
+from .meshcode import MESH_LEVEL_3, checkMeshLevel
+from .wkb_coordinates import checkDecimals
+
+# 出力できる地物のタイプ（地物設定ダイアログと同じ）
+FEATURE_TYPES = ["bldg:Building", "luse:LandUse", "tran:Road"]
+
+# configureで指定できる出力設定（config.iniのEXPORTセクションの項目）
+EXPORT_SETTING_KEYS = ["mesh_level", "workers", "roof_edge_xlink", "compression",
+                       "latlon_decimals", "height_decimals", "incremental", "inline_check", "staging"]
+
+
+class PipelineError(Exception):
+    """入力や出力設定の誤り"""
+    pass
+
+
+class ExportResult:
+    """
+    CityGML出力の結果
+    """
+
+    def __init__(self, output_dir: str, feature_type: str):
+        self.output_dir = output_dir
+        self.feature_type = feature_type
+        self.file_names = []        # 出力したファイル名（出力先ディレクトリからの相対パス）
+        self.errors = []
+        self.skipped_count = 0      # 差分出力で省略したメッシュ数
+        self.check_results = {}     # 出力しながら検査した結果（gmlファイルのパス -> 検査結果）
+        self.canceled = False
+        self.elapsed = 0.0          # 処理時間（秒）
+
+    def succeeded(self) -> bool:
+        return not self.canceled and len(self.errors) == 0
+
+
+class CheckResult:
+    """
+    CityGML検査の結果
+    """
+
+    def __init__(self, report_dir: str, gml_file_paths: list):
+        self.report_dir = report_dir
+        self.gml_file_paths = gml_file_paths
+        self.file_results = {}      # gmlファイルのパス -> 検査結果（CityGMLFileChecker.results）
+        self.passed = False
+        self.canceled = False
+        self.elapsed = 0.0          # 処理時間（秒）
+
+
+class CityGMLPipeline:
+    """
+    ベースデータの読み込み、CityGML出力、検査を画面なしで行う
+
+    画面（CityGMLDataExport、CityGMLDataCheck）やプロセッシングはこのクラスで処理を組み立てる
+    export、checkは呼び出し元のスレッドで実行し、進捗はコールバック（0～100）で通知する
+
+        pipeline = CityGMLPipeline()
+        fields = pipeline.read(basedata_dir)
+        pipeline.configure(required_field="gml_id", height_field="height", feature_type="bldg:Building")
+        export_result = pipeline.export(out_dir, workers=4, progress=print)
+        check_result = pipeline.check(out_dir)
+    """
+
+    def __init__(self):
+        self.__generator = None # 生成元データ
+        self.__feature_type = FEATURE_TYPES[0]
+
+        # configureで指定した出力設定（config.iniの出力設定に上書きする）
+        self.__items = {}
+
+        self.__was_canceled = False
+        self.__cancel = None
+        self.__cancel_lock = threading.Lock()
+        self.__last_export = None
+
+    def read(self, dir_path: str) -> list:
+        """
+        ベースデータのディレクトリを読み込む
+
+        @param dir_path: Shapeファイルまたは基盤地図情報のディレクトリ
+        @return: ベースデータのフィールド名のリスト
+        """
+        self.__generator = None
+
+        # 指定のディレクトリが存在するか確認
+        if not os.path.isdir(dir_path):
+            raise PipelineError("存在しないディレクトリです")
+
+        # Shapeファイルか基盤地図ファイルの存在確認
+        generator = createBasedataRead(dir_path)
+        if generator is None:
+            raise PipelineError("Shapeファイルおよび基盤地図情報データファイルが存在しません")
+
+        self.__generator = generator
+        return generator.fieldList()
+
+    def generator(self) -> BasedataRead:
+        """読み込んだベースデータ（読み込んでいない場合はNone）"""
+        return self.__generator
+
+    def featureType(self) -> str:
+        return self.__feature_type
+
+    def settings(self) -> dict:
+        """出力設定（config.iniの出力設定にconfigureの指定を上書きしたもの）"""
+        # config.iniは実行のたびに読み込む
+        items = {"required_field": "gml_id", "measured_height": ""}
+        items.update(exportSettings())
+        items.update(self.__items)
+        return items
+
+    def configure(self, required_field: str = None, height_field: str = None, feature_type: str = None, **items) -> "CityGMLPipeline":
+        """
+        出力設定
+
+        @param required_field: 必須項目（gml:id）のフィールド名
+        @param height_field: 高さのフィールド名
+        @param feature_type: 地物のタイプ（FEATURE_TYPES）
+        @param items: config.iniのEXPORTセクションと同じ名前の出力設定（EXPORT_SETTING_KEYS）
+        @return: 自身（続けて呼び出せる）
+        """
+        if required_field is not None:
+            self.__items["required_field"] = required_field
+        if height_field is not None:
+            self.__items["measured_height"] = height_field
+        if feature_type is not None:
+            if feature_type not in FEATURE_TYPES:
+                raise PipelineError(f"出力できない地物のタイプです: {feature_type}")
+            self.__feature_type = feature_type
+
+        for key, value in items.items():
+            if key not in EXPORT_SETTING_KEYS:
+                raise PipelineError(f"不明な出力設定です: {key}")
+            self.__items[key] = value
+
+        return self
+
+    def checkSettings(self, out_dir: str, workers: int = None) -> dict:
+        """
+        出力先と出力設定の確認
+
+        @param out_dir: 出力先ディレクトリ
+        @param workers: ワーカープロセス数（省略時は出力設定のもの）
+        @return: 確認済みの出力設定
+        """
+        if self.__generator is None:
+            raise PipelineError("ベースデータが読み込まれていません。")
+
+        items = self.settings()
+        if workers is not None:
+            items["workers"] = workers
+        return checkExportSettings(out_dir, items)
+
+    def createExporter(self, out_dir: str, workers: int = None) -> Exporter:
+        """
+        出力処理（Exporter）の生成
+
+        画面から非同期に実行する場合はこれをstartする
+
+        @param out_dir: 出力先ディレクトリ
+        @param workers: ワーカープロセス数（省略時は出力設定のもの）
+        """
+        items = self.checkSettings(out_dir, workers)
+
+        # 必須項目
+        self.__generator.setRequiredField(items.get("required_field", "gml_id"))
+
+        # 地物データの属性を使用する or 外部CSVの属性使用する
+        self.__generator.setUseCsv(False)
+        # 地物データの高さフィールド
+        self.__generator.setHeightFeatureField(items.get("measured_height"))
+
+        exporter = Exporter(self.__generator, self.__feature_type, out_dir)
+        exporter.setMeshLevel(items["mesh_level"])
+        exporter.setWorkerCount(items["workers"])
+        exporter.setIncremental(items["incremental"])
+        exporter.setInlineCheck(settingFlag(items.get("inline_check", False)))
+        exporter.setStagingType(items["staging"])
+        exporter.setTraceDir(traceDir())
+        exporter.serializer.setUseXlink(settingFlag(items.get("roof_edge_xlink", False)))
+        exporter.serializer.setCompression(items["compression"])
+        exporter.serializer.setCoordinateDecimals(items["latlon_decimals"], items["height_decimals"])
+
+        return exporter
+
+    def export(self, out_dir: str, workers: int = None, progress=None) -> ExportResult:
+        """
+        CityGML出力
+
+        @param out_dir: 出力先ディレクトリ（空か、差分出力では前回の出力先）
+        @param workers: ワーカープロセス数（省略時は出力設定のもの）
+        @param progress: 進捗（0～100）を受け取る関数
+        """
+        exporter = self.createExporter(out_dir, workers)
+        result = ExportResult(out_dir, self.__feature_type)
+
+        started = time.perf_counter()
+        try:
+            ran = self.runThread(exporter, exporter.progress, exporter.cancel, progress)
+        finally:
+            exporter.removeStaging()
+        result.elapsed = time.perf_counter() - started
+
+        result.canceled = not ran or exporter.wasCanceled()
+        if ran:
+            result.file_names = list(exporter.writtenFiles())
+            result.errors = list(exporter.lastErrors())
+            result.skipped_count = exporter.skippedCount()
+            result.check_results = dict(exporter.checkResults())
+
+        self.__last_export = result
+        return result
+
+    def check(self, gml_dir: str = None, report_dir: str = None, workers: int = None, progress=None) -> CheckResult:
+        """
+        CityGML検査
+
+        直前のexportで出力しながら検査した場合は、gmlファイルを読み込み直さずにその結果を出力する
+
+        @param gml_dir: gmlファイルのディレクトリ（省略時は直前のexportの出力先）
+        @param report_dir: 検査結果の出力先（省略時はgml_dirに「検査結果_日時」フォルダを作成する）
+        @param workers: ワーカープロセス数（省略時はconfig.iniのCHECKセクションのもの）
+        @param progress: 進捗（0～100）を受け取る関数
+        """
+        if gml_dir is None:
+            if self.__last_export is None:
+                raise PipelineError("検査するフォルダが指定されていません。")
+            gml_dir = self.__last_export.output_dir
+
+        # 直前のexportで出力しながら検査した結果は、出力先のgmlファイルのうち結果があるものに使う
+        check_results = {}
+        last_export = self.__last_export
+        if (last_export is not None
+                and os.path.normcase(os.path.abspath(last_export.output_dir)) == os.path.normcase(os.path.abspath(gml_dir))):
+            check_results = last_export.check_results
+        gml_file_paths, check_results = checkTargets(gml_dir, check_results)
+
+        if len(gml_file_paths) == 0:
+            raise PipelineError("該当するCityGMLファイルがありませんでした。")
+
+        if report_dir is None:
+            report_dir = createReportDir(gml_dir)
+        else:
+            os.makedirs(os.path.join(report_dir, "合格"), exist_ok=True)
+
+        # VectorLayerは検査するgmlファイルのみ検査時に作成する
+        selected_files = [[path, None, 0] for path in gml_file_paths]
+
+        process = createCheckProcess(selected_files, report_dir, workers, check_results or None)
+        result = CheckResult(report_dir, gml_file_paths)
+
+        started = time.perf_counter()
+        ran = self.runThread(process, process.progress_signal, process.cancel, progress)
+        result.elapsed = time.perf_counter() - started
+
+        result.canceled = not ran or process.wasCanceled()
+        result.file_results = dict(process.fileResults())
+        result.passed = not result.canceled and process.dirCheckFlg()
+        return result
+
+    def cancel(self):
+        """
+        実行中（または次に実行する）出力・検査のキャンセル（別のスレッドから呼び出せる）
+        """
+        with self.__cancel_lock:
+            self.__was_canceled = True
+            cancel = self.__cancel
+        if cancel is not None:
+            cancel()
+
+    def runThread(self, thread, progress_signal, cancel, progress) -> bool:
+        """
+        QThreadの処理を呼び出し元のスレッドで実行する
+
+        @param thread: 実行するQThread（Exporter、CityGMLDataCheckProcess）
+        @param progress_signal: 進捗のシグナル
+        @param cancel: キャンセルする関数
+        @param progress: 進捗を受け取る関数
+        @return: 実行前にキャンセルされた場合はFalse
+        """
+        # キャンセルする関数を設定してからキャンセル済みか確認する
+        # （確認の後に呼び出されたcancelは、設定した関数で処理をキャンセルする）
+        with self.__cancel_lock:
+            if self.__was_canceled:
+                self.__was_canceled = False
+                return False
+            self.__cancel = cancel
+
+        if progress is not None:
+            progress_signal.connect(progress, Qt.DirectConnection)
+        try:
+            thread.run()
+        finally:
+            with self.__cancel_lock:
+                self.__cancel = None
+                self.__was_canceled = False
+            if progress is not None:
+                progress_signal.disconnect(progress)
+
+        return True
+
+
+def createBasedataRead(dir_path: str) -> BasedataRead:
+    """
+    ディレクトリ内のファイルに合わせた読み込み処理を生成する
+
+    Shapeファイルがあればshape、なければ基盤地図情報ファイルから読み込む
+    どちらもない場合はNone
+    """
+    shape_files = glob.glob(os.path.join(glob.escape(dir_path), "*.shp"))
+
+    if len(shape_files) > 0:
+        # ShapeファイルからCityGMLを生成
+        generator = BasedataReadFromShape()
+    else:
+        # Shapeファイルがないので基盤地図情報ファイルを探す
+        basemap_files = extractBasemapFiles(dir_path)
+        if len(basemap_files) == 0:
+            return None
+
+        # 基盤地図ファイルからCityGMLを生成
+        generator = BasedataReadFromBasemap()
+
+    generator.setDirectory(dir_path)
+    return generator
+
+
+def checkExportSettings(dest_dir_path: str, items: dict) -> dict:
+    """
+    出力先と出力設定の確認
+
+    @param dest_dir_path: 出力先ディレクトリ
+    @param items: 出力設定
+    @return: 値を確認・変換した出力設定
+    """
+    items = dict(items)
+
+    # 出力先のディレクトリが存在するか確認
+    if len(dest_dir_path) == 0:
+        raise PipelineError("出力先ディレクトリが設定されていません。")
+    if os.path.exists(dest_dir_path) == False:
+        raise PipelineError("出力先ディレクトリは存在しません。")
+    if os.path.isdir(dest_dir_path) == False:
+        raise PipelineError("出力先に指定されているのはディレクトリではありません。")
+    # 差分出力では前回のマニフェストがある出力先に上書きする
+    incremental = settingFlag(items.get("incremental", False))
+    existing_files = [f for f in os.listdir(dest_dir_path) if os.path.isfile(os.path.join(dest_dir_path, f))]
+    if len(existing_files) > 0 and not (incremental and MANIFEST_FILE_NAME in existing_files):
+        raise PipelineError("出力先に既にファイルがあります。")
+    items["incremental"] = incremental
+
+    # ファイルを分割するメッシュの次数
+    try:
+        mesh_level = int(items.get("mesh_level", MESH_LEVEL_3))
+        checkMeshLevel(mesh_level)
+    except ValueError as e:
+        raise PipelineError(str(e))
+    items["mesh_level"] = mesh_level
+
+    # メッシュを並列に出力するワーカープロセス数（0はCPUのコア数）
+    try:
+        worker_count = int(items.get("workers", 1))
+    except (TypeError, ValueError):
+        raise PipelineError("ワーカープロセス数は数値で指定してください。")
+    if worker_count == 0:
+        worker_count = os.cpu_count() or 1
+    items["workers"] = worker_count
+
+    # 出力ファイルの圧縮形式
+    compression = str(items.get("compression", COMPRESSION_NONE)).lower()
+    if compression not in COMPRESSIONS:
+        raise PipelineError(f"対応していない圧縮形式です: {compression}")
+    items["compression"] = compression
+
+    # 取り込んだ地物の保持先
+    staging = str(items.get("staging") or STAGINGS[0]).lower()
+    if staging not in STAGINGS:
+        raise PipelineError(f"対応していない地物の保持先です: {staging}")
+    items["staging"] = staging
+
+    # 座標値の小数点以下の桁数（空は全桁）
+    try:
+        items["latlon_decimals"] = settingDecimals(items.get("latlon_decimals"))
+        items["height_decimals"] = settingDecimals(items.get("height_decimals"))
+    except ValueError as e:
+        raise PipelineError(f"座標値の桁数が正しくありません。{e}")
+
+    return items
+
+
+def createCheckProcess(selected_files: list, report_dir: str, workers: int = None, check_results: dict = None) -> CityGMLDataCheckProcess:
+    """
+    検査処理（CityGMLDataCheckProcess）の生成
+
+    @param selected_files: [gmlファイルパス, VectorLayer, 地物数]のリスト
+    @param report_dir: 検査結果の出力先
+    @param workers: ワーカープロセス数（省略時はconfig.iniのCHECKセクションのもの）
+    @param check_results: 出力しながら検査した結果（結果があるgmlファイルは検査しない）
+    """
+    process = CityGMLDataCheckProcess(selected_files, report_dir)
+    process.setWorkerCount(workers if workers is not None else checkWorkerCount())
+    process.setTraceDir(traceDir())
+    if check_results is not None:
+        process.setCheckResults(check_results)
+    return process
+
+
+def checkTargets(gml_dir: str, check_results: dict) -> tuple:
+    """
+    検査するgmlファイルと、そのうち出力しながら検査した結果があるものの結果
+
+    差分出力では今回出力したメッシュの結果しかないため、出力先のgmlファイルをすべて対象にし、
+    結果がないファイルはgmlファイルを検査する
+    圧縮して出力したファイルは、出力しながら検査した結果があるもののみ対象にする
+
+    @param gml_dir: gmlファイルのディレクトリ
+    @param check_results: 出力しながら検査した結果（gmlファイルのパス -> 検査結果）
+    @return: (gmlファイルパスのリスト, gmlファイルパス -> 検査結果)
+    """
+    results_by_name = {os.path.basename(path): (path, results) for path, results in check_results.items()}
+
+    targets = {}
+    for path in glob.glob(os.path.join(glob.escape(gml_dir), "*.gml")):
+        path = path.replace('\\', '/')
+        targets[os.path.basename(path)] = path
+
+    target_results = {}
+    for name, (path, results) in results_by_name.items():
+        path = targets.setdefault(name, path)
+        target_results[path] = results
+
+    return sorted(targets.values()), target_results
+
+
+def createReportDir(parent_dir: str) -> str:
+    """
+    検査結果の出力先（「検査結果_日時」フォルダとその下の合格フォルダ）を作成する
+
+    @param parent_dir: 作成先のフォルダ
+    @return: 作成した検査結果の出力先
+    """
+    # さらに日時分のディレクトリを作成
+    dt_now = datetime.datetime.now()
+    report_dir = parent_dir + '/検査結果_' + dt_now.strftime('%Y%m%d_%H%M')
+
+    if os.path.isdir(report_dir):
+        # もし、同一ディレクトリがあれば、秒を付与
+        report_dir = report_dir + dt_now.strftime('%S')
+
+    os.makedirs(report_dir)
+    os.makedirs(report_dir + "/合格")
+    return report_dir
+
+
+def configSettings() -> QSettings:
+    """
+    config.iniの設定
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "config.ini")
+    settings = QSettings(config_path, QSettings.IniFormat)
+    settings.setIniCodec("utf-8")
+    return settings
+
+
+def exportSettings() -> dict:
+    """
+    config.iniの出力設定（EXPORTセクション）を取得する
+    """
+    settings = configSettings()
+
+    settings.beginGroup("EXPORT")
+    items = {key: settings.value(key) for key in settings.childKeys()}
+    settings.endGroup()
+
+    return items
+
+
+def checkWorkerCount() -> int:
+    """
+    config.iniの検査設定（CHECKセクション）からワーカープロセス数を取得する
+
+    0はCPUのコア数、設定がない・数値でない場合は並列にしない
+    """
+    settings = configSettings()
+
+    try:
+        worker_count = int(settings.value("CHECK/workers", 1))
+    except (TypeError, ValueError):
+        QgsMessageLog.logMessage("検査のワーカープロセス数が数値ではないため、並列にせず検査します。")
+        return 1
+
+    if worker_count == 0:
+        worker_count = os.cpu_count() or 1
+    return worker_count
+
+
+def traceDir() -> str:
+    """
+    config.iniのトレース設定（TRACEセクション）からトレースファイルの出力先を取得する
+
+    空の場合は記録しない
+    """
+    settings = configSettings()
+    return str(settings.value("TRACE/dir", "") or "").strip()
+
+
+def settingFlag(value) -> bool:
+    """
+    設定値（文字列または真偽値）を真偽値にする
+    """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("true", "1", "yes", "on")
+
+
+def settingDecimals(value):
+    """
+    設定値を小数点以下の桁数にする（未設定や空はNone）
+    """
+    if value is None or str(value).strip() == "":
+        return None
+    return checkDecimals(value)
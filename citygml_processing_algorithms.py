@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ CityGMLProcessingAlgorithms  CityGMLの生成と検査のプロセッシングアルゴリズム
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+
+from qgis.core import (QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingOutputBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterString)
+
+from .citygml_pipeline import FEATURE_TYPES, CityGMLPipeline, PipelineError
+
+
+class CityGMLGenerateAlgorithm(QgsProcessingAlgorithm):
+    """
+    ベースデータ（Shapeファイル、基盤地図情報）からCityGMLを生成する
+
+    画面の出力処理と同じく、指定しない出力設定はconfig.iniのEXPORTセクションのものを使う
+    """
+
+    INPUT = "INPUT"
+    REQUIRED_FIELD = "REQUIRED_FIELD"
+    HEIGHT_FIELD = "HEIGHT_FIELD"
+    FEATURE_TYPE = "FEATURE_TYPE"
+    OUTPUT = "OUTPUT"
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(self.INPUT, "ベースデータのフォルダ", behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterString(self.REQUIRED_FIELD, "必須項目（gml:id）のフィールド", defaultValue="gml_id"))
+        self.addParameter(QgsProcessingParameterString(self.HEIGHT_FIELD, "高さのフィールド", optional=True))
+        self.addParameter(QgsProcessingParameterEnum(self.FEATURE_TYPE, "地物のタイプ", options=FEATURE_TYPES, defaultValue=0))
+        self.addParameter(QgsProcessingParameterFolderDestination(self.OUTPUT, "CityGMLの出力先フォルダ"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        input_dir = self.parameterAsFile(parameters, self.INPUT, context)
+        output_dir = self.parameterAsString(parameters, self.OUTPUT, context)
+        feature_type = FEATURE_TYPES[self.parameterAsEnum(parameters, self.FEATURE_TYPE, context)]
+        required_field = self.parameterAsString(parameters, self.REQUIRED_FIELD, context)
+        height_field = self.parameterAsString(parameters, self.HEIGHT_FIELD, context)
+
+        pipeline = CityGMLPipeline()
+        try:
+            # ベースデータの読み込み
+            fields = pipeline.read(input_dir)
+            for field_name in (required_field, height_field):
+                if field_name and field_name not in fields:
+                    raise PipelineError(f"ベースデータにフィールド{field_name}がありません。")
+
+            pipeline.configure(required_field=required_field, height_field=height_field, feature_type=feature_type)
+
+            # エクスポート処理（このスレッドで実行する）
+            os.makedirs(output_dir, exist_ok=True)
+            result = runWithFeedback(feedback, pipeline, lambda: pipeline.export(output_dir, progress=feedback.setProgress))
+        except PipelineError as e:
+            raise QgsProcessingException(str(e))
+
+        for error in result.errors:
+            feedback.reportError(error)
+
+        feedback.pushInfo(f"{len(result.file_names)}ファイルを出力しました。")
+        if result.skipped_count > 0:
+            feedback.pushInfo(f"差分出力で{result.skipped_count}メッシュの出力を省略しました。")
+
+        return {self.OUTPUT: output_dir}
+
+    def flags(self):
+        # 出力処理はプロジェクトの座標変換の設定を書き換えるため、メインスレッドで実行する
+        return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
+
+    def name(self) -> str:
+        return "generate_citygml"
+
+    def displayName(self) -> str:
+        return "CityGML生成"
+
+    def group(self) -> str:
+        return "CityGML"
+
+    def groupId(self) -> str:
+        return "citygml"
+
+    def shortHelpString(self) -> str:
+        return ("ベースデータのフォルダ（Shapeファイルまたは基盤地図情報）から、メッシュ単位のCityGMLファイルを出力します。"
+                "メッシュの次数、ワーカープロセス数、圧縮形式などはconfig.iniのEXPORTセクションの設定を使います。")
+
+    def createInstance(self):
+        return CityGMLGenerateAlgorithm()
+
+
+class CityGMLCheckAlgorithm(QgsProcessingAlgorithm):
+    """
+    フォルダ内のCityGMLファイルを検査し、ファイルごとの検査結果（xlsx）を出力する
+
+    ワーカープロセス数はconfig.iniのCHECKセクションのものを使う
+    """
+
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+    PASSED = "PASSED"
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(self.INPUT, "CityGMLのフォルダ", behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterFolderDestination(self.OUTPUT, "検査結果の出力先フォルダ"))
+        self.addOutput(QgsProcessingOutputBoolean(self.PASSED, "合格"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        input_dir = self.parameterAsFile(parameters, self.INPUT, context)
+        output_dir = self.parameterAsString(parameters, self.OUTPUT, context)
+
+        # 検査結果は合格フォルダに出力し、不合格のものは不合格フォルダに移動する
+        pipeline = CityGMLPipeline()
+        try:
+            result = runWithFeedback(feedback, pipeline, lambda: pipeline.check(input_dir, output_dir, progress=feedback.setProgress))
+        except PipelineError as e:
+            raise QgsProcessingException(str(e))
+
+        if result.canceled:
+            return {self.OUTPUT: output_dir, self.PASSED: False}
+
+        if result.passed:
+            feedback.pushInfo("【合格】")
+        else:
+            feedback.reportError("【不合格】不合格事項の詳細は不合格フォルダの検査結果を参照ください。")
+
+        return {self.OUTPUT: output_dir, self.PASSED: result.passed}
+
+    def name(self) -> str:
+        return "check_citygml"
+
+    def displayName(self) -> str:
+        return "CityGML検査"
+
+    def group(self) -> str:
+        return "CityGML"
+
+    def groupId(self) -> str:
+        return "citygml"
+
+    def shortHelpString(self) -> str:
+        return ("フォルダ内のCityGMLファイル（*.gml）を検査し、ファイルごとの検査結果を"
+                "出力先フォルダの合格・不合格フォルダに出力します。")
+
+    def createInstance(self):
+        return CityGMLCheckAlgorithm()
+
+
+def runWithFeedback(feedback, pipeline: CityGMLPipeline, run):
+    """
+    フィードバックのキャンセルをパイプラインに伝えながら実行する
+
+    @param feedback: プロセッシングのフィードバック
+    @param pipeline: 実行するパイプライン
+    @param run: パイプラインの処理（export、check）を呼び出す関数
+    @return: runの戻り値
+    """
+    feedback.canceled.connect(pipeline.cancel)
+    try:
+        if feedback.isCanceled():
+            pipeline.cancel()
+        return run()
+    finally:
+        feedback.canceled.disconnect(pipeline.cancel)
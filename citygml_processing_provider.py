@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ CityGMLModelGeneratorProvider  プロセッシングのプロバイダー
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from .citygml_processing_algorithms import CityGMLCheckAlgorithm, CityGMLGenerateAlgorithm
+
+
+class CityGMLModelGeneratorProvider(QgsProcessingProvider):
+    """
+    CityGMLの生成と検査をプロセッシング（qgis_process）から実行する
+    """
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(CityGMLGenerateAlgorithm())
+        self.addAlgorithm(CityGMLCheckAlgorithm())
+
+    def id(self) -> str:
+        return "citygml_model_generator"
+
+    def name(self) -> str:
+        return "CityGMLモデル生成ツール"
+
+    def icon(self) -> QIcon:
+        return QIcon(os.path.join(os.path.dirname(__file__), "icon.png"))
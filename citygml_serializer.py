@@ -1,12 +1,39 @@
 import os
+import gzip
+import zipfile
 from typing import List, Union
 
 from qgis.PyQt.QtXml import QDomDocument, QDomNode, QDomElement
-from qgis.PyQt.QtCore import QFile, QTextStream
+from qgis.PyQt.QtCore import QBuffer, QFile, QIODevice, QTextStream, QVariant
 
 from qgis.core import *
 
 from .basedata_read import BasedataRead
+from .citygml_data_check_process import CityGMLInlineCheck
+from .tracing import startTracing, stopTracing, traceSpan
+from .wkb_coordinates import CoordinateFormat, formatPositions, formatPositionTexts, partPositions
+
+# ルート要素で宣言する名前空間（接頭辞とURI）
+NAMESPACES = [
+    ("uro", "http://www.kantei.go.jp/jp/singi/tiiki/toshisaisei/itoshisaisei/iur/uro/1.1"),
+    ("core", "http://www.opengis.net/citygml/2.0"),
+    ("bldg", "http://www.opengis.net/citygml/building/2.0"),
+    ("gen", "http://www.opengis.net/citygml/generics/2.0"),
+    ("luse", "http://www.opengis.net/citygml/landuse/2.0"),
+    ("dem", "http://www.opengis.net/citygml/relief/2.0"),
+    ("tran", "http://www.opengis.net/citygml/transportation/2.0"),
+    ("wtr", "http://www.opengis.net/citygml/waterbody/2.0"),
+    ("gml", "http://www.opengis.net/gml"),
+    ("xAL", "urn:oasis:names:tc:ciq:xsdschema:xAL:2.0"),
+    ("sch", "http://www.ascc.net/xml/schematron"),
+]
+XLINK_NAMESPACE = "http://www.w3.org/1999/xlink"
+
+# 出力ファイルの圧縮形式
+COMPRESSION_NONE = "none"   # 圧縮しない(*.gml)
+COMPRESSION_GZIP = "gzip"   # メッシュごとにgzip圧縮する(*.gml.gz)
+COMPRESSION_ZIP = "zip"     # 全メッシュを1つのzipにまとめる
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZIP)
 
 class CityGMLSerializer:
     def __init__(self, generator: BasedataRead, feature_type: str, output_dir_path: str):
@@ -46,46 +73,320 @@ class CityGMLSerializer:
         else:
             self.__document_factory = None
 
+        # 地物ごとに逐次書き出す（メモリ上に文書全体を構築しない）
+        self.__streaming = True
+        self.__last_error = ""
+
+        # 圧縮形式とzipの書き込み先
+        self.__compression = COMPRESSION_NONE
+        self.__archive = None
+
+        # 出力しながらの検査とその結果
+        self.__inline_check = False
+        self.__last_check_results = None
+
+    def useXlink(self) -> bool:
+        if self.__document_factory is None:
+            return False
+        return self.__document_factory.useXlink()
+
+    def setUseXlink(self, use: bool):
+        """True:同じジオメトリを2度出力せずxlink:hrefで参照する"""
+        if self.__document_factory is not None:
+            self.__document_factory.setUseXlink(use)
+
+    def coordinateDecimals(self) -> tuple:
+        """ 座標値の小数点以下の桁数 (緯度経度, 標高) Noneは全桁 """
+        if self.__document_factory is None:
+            return (None, None)
+        coordinate_format = self.__document_factory.coordinateFormat()
+        return (coordinate_format.latlonDecimals(), coordinate_format.heightDecimals())
+
+    def setCoordinateDecimals(self, latlon_decimals: int = None, height_decimals: int = None):
+        """ 座標値の小数点以下の桁数を緯度経度と標高で指定する（Noneは全桁） """
+        if self.__document_factory is not None:
+            self.__document_factory.setCoordinateFormat(CoordinateFormat(latlon_decimals, height_decimals))
+
     def outputDirPath(self) -> str:
         return self.__output_dir_path
 
     def setOutputDirPath(self, path: str):
         self.__output_dir_path = path
 
+    def isStreaming(self) -> bool:
+        return self.__streaming
+
+    def setStreaming(self, streaming: bool):
+        """True:cityObjectMemberごとに逐次出力する False:DomDocument全体を構築してから出力する"""
+        self.__streaming = streaming
+
+    def compression(self) -> str:
+        return self.__compression
+
+    def setCompression(self, compression: str):
+        """出力ファイルの圧縮形式（none, gzip, zip）"""
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"対応していない圧縮形式です: {compression}")
+        self.__compression = compression
+
+    def isInlineCheck(self) -> bool:
+        return self.__inline_check
+
+    def setInlineCheck(self, inline_check: bool):
+        """True:出力しながら地物を検査する（検査結果はlastCheckResultsで取得する）"""
+        self.__inline_check = inline_check
+
+    def lastCheckResults(self) -> dict:
+        """直前に出力したファイルの検査結果（CityGMLFileChecker.results） 検査していない場合はNone"""
+        return self.__last_check_results
+
+    def archiveName(self) -> str:
+        """zipで出力する場合のファイル名"""
+        prefix = self.__document_factory.prefix() if self.__document_factory is not None else "citygml"
+        return f"{prefix}_6697.zip"
+
     def exec(self, feature_itr: QgsFeatureIterator, boundedBy, meshcode: str) -> str:
         """実行"""
 
+        self.__last_error = ""
+        self.__last_check_results = None
+
         if self.__document_factory is None:
+            self.__last_error = f"{self.feature_type}は出力できない地物のタイプです。"
             return None
 
+        inline_check = CityGMLInlineCheck() if self.__inline_check else None
+        self.__document_factory.setInlineCheck(inline_check)
+        try:
+            with traceSpan("CityGMLSerializer.exec", meshcode=meshcode):
+                output_name = self.writeFile(feature_itr, boundedBy, meshcode)
+        finally:
+            self.__document_factory.setInlineCheck(None)
+
+        if output_name is not None and inline_check is not None:
+            with traceSpan("CityGMLInlineCheck.results", meshcode=meshcode):
+                self.__last_check_results = inline_check.results()
+
+        return output_name
+
+    def writeFile(self, feature_itr: QgsFeatureIterator, boundedBy, meshcode: str) -> str:
+        """メッシュ1つ分のファイルを出力する"""
+
         file_name = f"{meshcode}_{self.__document_factory.prefix()}_6697.gml"
 
         # idと高さフィールド名の設定
         self.__document_factory.boundedBy= boundedBy
         self.__document_factory.setGmlIdFieldName(self.generator.requiredField())
         self.__document_factory.setHeightFieldName(self.generator.heightFeatureField())
-        
-        doc = self.__document_factory.createDocument(feature_itr)
-        if doc is None:
-            return None
+
+        doc = None
+        if not self.__streaming:
+            with traceSpan("createDocument", meshcode=meshcode):
+                doc = self.__document_factory.createDocument(feature_itr)
+            if doc is None:
+                self.__last_error = f"{file_name}の文書を生成できませんでした。"
+                return None
 
         # 既存ファイルがあっても上書きする
-        output_path = os.path.join(self.__output_dir_path, file_name)
-        f = QFile(output_path)
-        if f.open(QFile.WriteOnly | QFile.Text) == False:
+        output_name, device, file = self.openOutput(file_name)
+        if device is None:
             return None
 
-        text_stream = QTextStream(f)
+        text_stream = QTextStream(device)
         text_stream.setCodec("UTF-8")
 
-        doc.save(text_stream, 2, QDomNode.EncodingFromTextStream)
+        # 書き込みに失敗したファイル（途中までのファイル）は出力したものとして扱わない
+        written = False
+        try:
+            if doc is None:
+                # 地物ごとに逐次書き出す
+                with traceSpan("writeDocument", meshcode=meshcode):
+                    self.__document_factory.writeDocument(feature_itr, text_stream)
+            else:
+                with traceSpan("saveDocument", meshcode=meshcode):
+                    doc.save(text_stream, 2, QDomNode.EncodingFromTextStream)
+
+            text_stream.flush()
+            written = text_stream.status() == QTextStream.Ok
+            if not written:
+                self.__last_error = f"{output_name}を書き込めませんでした。{device.errorString()}"
+        finally:
+            device.close()
+            if file is not None:
+                try:
+                    file.close()
+                except OSError as e:
+                    if written:
+                        self.__last_error = f"{output_name}を書き込めませんでした。{e}"
+                    written = False
+
+        if not written:
+            return None
+        return output_name
+
+    def openOutput(self, file_name: str):
+        """
+        圧縮形式に合わせて出力先を開く
+
+        @return: (出力したファイル名, QTextStreamの出力先, 閉じる必要のあるPythonのファイル)
+        """
+        try:
+            if self.__compression == COMPRESSION_GZIP:
+                output_name = file_name + ".gz"
+                file = gzip.open(os.path.join(self.__output_dir_path, output_name), "wb")
+
+            elif self.__compression == COMPRESSION_ZIP:
+                # zipは1回の出力で1つにまとめる（closeで閉じる）
+                if self.__archive is None:
+                    archive_path = os.path.join(self.__output_dir_path, self.archiveName())
+                    self.__archive = zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+                output_name = f"{self.archiveName()}/{file_name}"
+                file = self.__archive.open(file_name, "w", force_zip64=True)
+
+            else:
+                output_path = os.path.join(self.__output_dir_path, file_name)
+                f = QFile(output_path)
+                if f.open(QFile.WriteOnly | QFile.Text) == False:
+                    self.__last_error = f"{output_path}を書き込みで開けませんでした。"
+                    return None, None, None
+                return file_name, f, None
+
+        except (OSError, RuntimeError) as e:
+            self.__last_error = f"{file_name}を書き込みで開けませんでした。{e}"
+            return None, None, None
+
+        # 改行コードなどはQFileに出力する場合と同じにする
+        device = PythonFileDevice(file)
+        device.open(QIODevice.WriteOnly | QIODevice.Text)
+        return output_name, device, file
+
+    def close(self) -> bool:
+        """
+        出力の終了（zipを閉じる）
+
+        @return: zipを閉じられなかった場合はFalse（エラーはlastErrorで取得する）
+        """
+        if self.__archive is None:
+            return True
+
+        archive = self.__archive
+        self.__archive = None
+        try:
+            archive.close()
+        except OSError as e:
+            self.__last_error = f"{self.archiveName()}を書き込めませんでした。{e}"
+            return False
+        return True
 
-        f.close()
+    def lastError(self):
+        return self.__last_error
 
-        return file_name
 
-    def lastError(self):
-        return self.lastError
+class PythonFileDevice(QIODevice):
+    """
+    Pythonのファイルオブジェクトに書き込むQIODevice
+
+    gzipやzipへの書き込みをQTextStreamから行うために使う
+    """
+    def __init__(self, file):
+        super().__init__()
+        self.__file = file
+
+    def isSequential(self) -> bool:
+        return True
+
+    def writeData(self, data) -> int:
+        # 例外はQtの呼び出し元に伝わらないので、エラーとして返す（QTextStreamのstatusがWriteFailedになる）
+        data = bytes(data)
+        try:
+            self.__file.write(data)
+        except OSError as e:
+            self.setErrorString(str(e))
+            return -1
+        return len(data)
+
+    def readData(self, max_size: int) -> bytes:
+        return b""
+
+class CompactFeature:
+    """
+    プロセス間で受け渡すための地物
+
+    出力に使う属性とWKBのみを保持し、QgsFeatureと同じ方法で値を取得できる
+    """
+    def __init__(self, feature_id: int, attributes: dict, wkb: bytes):
+        self.__id = feature_id
+        self.__attributes = attributes
+        self.__wkb = wkb
+
+    @staticmethod
+    def fromFeature(feature: QgsFeature, field_names: List[str]) -> "CompactFeature":
+        """QgsFeatureから指定したフィールドの値とジオメトリを抜き出す"""
+        attributes = {}
+        fields = feature.fields()
+        for field_name in field_names:
+            if field_name is None or fields.indexFromName(field_name) < 0:
+                continue
+
+            value = feature.attribute(field_name)
+            # NULLのQVariantはそのままでは受け渡せないのでNoneにする
+            if isinstance(value, QVariant) and value.isNull():
+                value = None
+            attributes[field_name] = value
+
+        wkb = bytes(feature.geometry().asWkb()) if feature.hasGeometry() else b""
+        return CompactFeature(feature.id(), attributes, wkb)
+
+    def id(self) -> int:
+        return self.__id
+
+    def attribute(self, field_name: str):
+        # フィールドがなければQgsFeatureと同じくKeyError
+        value = self.__attributes[field_name]
+        return NULL if value is None else value
+
+    def geometry(self) -> QgsGeometry:
+        geometry = QgsGeometry()
+        if len(self.__wkb) > 0:
+            geometry.fromWkb(self.__wkb)
+        return geometry
+
+
+def serializeMesh(job: dict) -> dict:
+    """
+    1メッシュ分のCityGMLを出力する（プロセスプールのワーカーで実行）
+
+    @param job: 地物のタイプ、出力先、メッシュコード、boundedBy、フィールド名とCompactFeatureのリスト
+    @return: メッシュコード、出力したファイル名、エラーと検査結果、記録した区間
+    """
+    # 呼び出し元で記録中の場合は、このプロセスでも記録して結果と一緒に返す
+    tracing = job["trace"] and startTracing()
+
+    generator = BasedataRead()
+    generator.setRequiredField(job["required_field"])
+    generator.setHeightFeatureField(job["height_field"])
+
+    serializer = CityGMLSerializer(generator, job["feature_type"], job["output_dir_path"])
+    serializer.setStreaming(job["streaming"])
+    serializer.setUseXlink(job["use_xlink"])
+    serializer.setCompression(job["compression"])
+    serializer.setCoordinateDecimals(*job["coordinate_decimals"])
+    serializer.setInlineCheck(job["inline_check"])
+
+    try:
+        file_name = serializer.exec(job["features"], job["bounded_by"], job["meshcode"])
+        error = serializer.lastError()
+        check_results = serializer.lastCheckResults()
+    except Exception as e:
+        file_name = None
+        error = f"{job['meshcode']}の出力中にエラーが発生しました。{e}"
+        check_results = None
+
+    trace_events = stopTracing().events() if tracing else None
+
+    return {"meshcode": job["meshcode"], "file_name": file_name, "error": error, "check_results": check_results,
+            "trace_events": trace_events}
+
 
 class CityGMLDocumentFactory:
     """DomDocumentファクトリー親クラス"""
@@ -96,6 +397,14 @@ class CityGMLDocumentFactory:
         self.__gml_id_field_name = "gml_id"
         self.__height_field_name = "height"
 
+        # 同じジオメトリをxlink:hrefで参照する
+        self.__use_xlink = False
+
+        # 座標値の桁数
+        self.__coordinate_format = CoordinateFormat()
+
+        # 出力中の地物の検査（CityGMLInlineCheck）
+        self.__inline_check = None
 
     def gmlIdFieldName(self) -> str:
         return self.__gml_id_field_name
@@ -106,27 +415,82 @@ class CityGMLDocumentFactory:
     def heightFieldName(self) -> str:
         return self.__height_field_name
 
+    def useXlink(self) -> bool:
+        return self.__use_xlink
+
+    def setUseXlink(self, use: bool):
+        self.__use_xlink = use
+
+    def coordinateFormat(self) -> CoordinateFormat:
+        return self.__coordinate_format
+
+    def setCoordinateFormat(self, coordinate_format: CoordinateFormat):
+        self.__coordinate_format = coordinate_format
+
+    def inlineCheck(self) -> CityGMLInlineCheck:
+        return self.__inline_check
+
+    def setInlineCheck(self, inline_check: CityGMLInlineCheck):
+        """出力中の地物を検査する場合に設定する（Noneは検査しない）"""
+        self.__inline_check = inline_check
+
+    def geometryPositions(self, geometry: QgsGeometry) -> "GeometryPositions":
+        """ 座標値の桁数を反映した頂点の座標値 """
+        return GeometryPositions(geometry, self.__coordinate_format)
+
     def setHeightFieldName(self, field_name: str):
         self.__height_field_name = field_name
 
     def createDocument(self, feature_itr: QgsFeatureIterator) -> QDomDocument:
         """DomDocument生成処理"""
+        doc, el_city_model = self.createRootDocument()
+
+        # 地物ごとに要素cityObjectMemberを生成する
+        for feature in feature_itr:
+            el_city_object_member = self.makeCityObjectMember(feature, doc)
+            if el_city_object_member is not None:
+                el_city_model.appendChild(el_city_object_member)
+
+        return doc
+
+    def writeDocument(self, feature_itr: QgsFeatureIterator, text_stream: QTextStream):
+        """
+        DomDocumentと同じ内容を地物ごとに逐次ストリームへ書き出す
+
+        ルート要素とgml:boundedByはDOMで保存した文字列をそのまま使い、
+        cityObjectMemberは地物ごとに別のDomDocumentで生成して書き出した後に破棄する
+        """
+        doc, _ = self.createRootDocument()
+        head = documentToString(doc)
+
+        # ルート要素の終了タグは全地物の出力後に書き出す
+        end_tag = f"</{self.root_tag_name}>\n"
+        if head.endswith(end_tag):
+            head = head[:-len(end_tag)]
+        text_stream << head
+
+        for feature in feature_itr:
+            member_doc = QDomDocument()
+            el_city_object_member = self.makeCityObjectMember(feature, member_doc)
+            if el_city_object_member is None:
+                continue
+
+            # QDomNode.saveは深さ1で出力するので、ルート直下のcityObjectMemberと同じインデントになる
+            el_city_object_member.save(text_stream, 2, QDomNode.EncodingFromTextStream)
+
+        text_stream << end_tag
+
+    def createRootDocument(self):
+        """ルート要素とgml:boundedByのみのDomDocument生成処理"""
         doc = QDomDocument()
         el_decl = doc.createProcessingInstruction('xml', 'version="1.0" encoding="utf-8"')
         doc.appendChild(el_decl)
 
         el_city_model = doc.createElement(self.root_tag_name)
-        el_city_model.setAttribute("xmlns:uro","http://www.kantei.go.jp/jp/singi/tiiki/toshisaisei/itoshisaisei/iur/uro/1.1")
-        el_city_model.setAttribute("xmlns:core","http://www.opengis.net/citygml/2.0")
-        el_city_model.setAttribute("xmlns:bldg","http://www.opengis.net/citygml/building/2.0")
-        el_city_model.setAttribute("xmlns:gen","http://www.opengis.net/citygml/generics/2.0")
-        el_city_model.setAttribute("xmlns:luse","http://www.opengis.net/citygml/landuse/2.0")
-        el_city_model.setAttribute("xmlns:dem","http://www.opengis.net/citygml/relief/2.0")
-        el_city_model.setAttribute("xmlns:tran","http://www.opengis.net/citygml/transportation/2.0")
-        el_city_model.setAttribute("xmlns:wtr","http://www.opengis.net/citygml/waterbody/2.0")
-        el_city_model.setAttribute("xmlns:gml","http://www.opengis.net/gml")
-        el_city_model.setAttribute("xmlns:xAL","urn:oasis:names:tc:ciq:xsdschema:xAL:2.0")
-        el_city_model.setAttribute("xmlns:sch","http://www.ascc.net/xml/schematron")
+        for prefix, uri in NAMESPACES:
+            el_city_model.setAttribute("xmlns:" + prefix, uri)
+        if self.__use_xlink:
+            el_city_model.setAttribute("xmlns:xlink", XLINK_NAMESPACE)
         doc.appendChild(el_city_model)
 
         el_bounded_by = doc.createElement("gml:boundedBy")
@@ -138,51 +502,70 @@ class CityGMLDocumentFactory:
 
         el_lower_corner = doc.createElement("gml:lowerCorner")
         el_lower_corner.setAttribute("srsDimension", '3')
-        tx_loser_corner = doc.createTextNode(self.boundedBy[0] + " " + self.boundedBy[1] + " 0.0")
+        lower_corner = self.__coordinate_format.cornerText(self.boundedBy[0], self.boundedBy[1], False)
+        tx_loser_corner = doc.createTextNode(lower_corner)
         el_lower_corner.appendChild(tx_loser_corner)
         el_envelope.appendChild(el_lower_corner)
 
         el_upper_corner = doc.createElement("gml:upperCorner")
         el_upper_corner.setAttribute("srsDimension", '3')
-        tx_upper_corner = doc.createTextNode(self.boundedBy[2] + " " + self.boundedBy[3] + " 0.0")
+        upper_corner = self.__coordinate_format.cornerText(self.boundedBy[2], self.boundedBy[3], True)
+        tx_upper_corner = doc.createTextNode(upper_corner)
         el_upper_corner.appendChild(tx_upper_corner)
         el_envelope.appendChild(el_upper_corner)
 
-        # 地物ごとに要素cityObjectMemberを生成する
-        for feature in feature_itr:
-            # タグ名とid
-            el_member = doc.createElement(self.tagName())
-            try:
-                gml_id = feature.attribute(self.gmlIdFieldName())
-            except KeyError:
-                # なければフィーチャーID
-                gml_id = feature.id()
-
-            el_member.setAttribute("gml:id", gml_id)
-
-            # 属性設定
-            # 開発中
-
-            # 地物全体の高さ取得
-            measured_height = None
-            try:
-                if self.heightFieldName() != None and self.heightFieldName() != "":
-                    measured_height = feature.attribute(self.heightFieldName())
-            except KeyError:
-                pass
-
-            # 各種要素の生成
-            el_geometries = self.makeGeometryElements(feature.geometry(), measured_height, doc)
-            for el_geometry in el_geometries:
-                if el_geometry is not None:
-                    el_member.appendChild(el_geometry)
-
-            if el_member is not None:
-                el_city_object_member = doc.createElement("core:cityObjectMember")
-                el_city_model.appendChild(el_city_object_member)
-                el_city_object_member.appendChild(el_member)
+        if self.__inline_check is not None:
+            self.__inline_check.setEnvelope(lower_corner, upper_corner)
 
-        return doc
+        return doc, el_city_model
+
+    def makeCityObjectMember(self, feature: QgsFeature, doc: QDomDocument) -> QDomElement:
+        """地物1つ分の要素cityObjectMemberを生成する"""
+        # タグ名とid
+        el_member = doc.createElement(self.tagName())
+        try:
+            gml_id = feature.attribute(self.gmlIdFieldName())
+        except KeyError:
+            # なければフィーチャーID
+            gml_id = feature.id()
+
+        el_member.setAttribute("gml:id", gml_id)
+
+        # 属性設定
+        # 開発中
+
+        # 地物全体の高さ取得
+        measured_height = None
+        try:
+            if self.heightFieldName() != None and self.heightFieldName() != "":
+                measured_height = feature.attribute(self.heightFieldName())
+        except KeyError:
+            pass
+
+        # 各種要素の生成
+        geometry = feature.geometry()
+        if self.__inline_check is not None:
+            self.__inline_check.beginFeature(namespaceTagName(self.tagName()), gml_id)
+
+        # ジオメトリのid（屋根外形から参照するフットプリントのidなど）はgml_idから作る
+        # gml_idがNULLや空の地物はidが重複しないようにフィーチャーIDを使う
+        geometry_id = gml_id
+        if gml_id is None or (isinstance(gml_id, QVariant) and gml_id.isNull()) or str(gml_id) == "":
+            geometry_id = feature.id()
+
+        el_geometries = self.makeGeometryElements(geometry, measured_height, doc, geometry_id)
+
+        if self.__inline_check is not None:
+            self.__inline_check.endFeature(geometry)
+
+        for el_geometry in el_geometries:
+            if el_geometry is not None:
+                el_member.appendChild(el_geometry)
+
+        el_city_object_member = doc.createElement("core:cityObjectMember")
+        el_city_object_member.appendChild(el_member)
+
+        return el_city_object_member
 
     def tagName(self) -> str:
         return ""
@@ -190,7 +573,7 @@ class CityGMLDocumentFactory:
     def prefix(self) -> str:
         return ""
 
-    def makeGeometryElements(self, geometry: QgsGeometry, measured_height: float, doc: QDomDocument) -> List[QDomElement]:
+    def makeGeometryElements(self, geometry: QgsGeometry, measured_height: float, doc: QDomDocument, gml_id=None) -> List[QDomElement]:
         # インターフェース
         pass
 
@@ -204,10 +587,14 @@ class CityGMLBuildingDocumentFactory(CityGMLDocumentFactory):
     def prefix(self):
         return "bldg"
 
-    def makeGeometryElements(self, geometry: QgsGeometry, measured_height, doc: QDomDocument) -> List[QDomElement]:
+    def makeGeometryElements(self, geometry: QgsGeometry, measured_height, doc: QDomDocument, gml_id=None) -> List[QDomElement]:
+        # 頂点の座標値とその文字列は1度だけ作成する
+        positions = self.geometryPositions(geometry)
+
         # bldg:lod0FootPrint
         el_lod0_foot_print = doc.createElement("bldg:lod0FootPrint")
-        el_lod0_foot_print.appendChild(makeMultiSurface(geometry, doc))
+        el_foot_print_surface = makeMultiSurface(geometry, doc, positions)
+        el_lod0_foot_print.appendChild(el_foot_print_surface)
 
         # bldg:measuredHeight
         el_measuredHeight = None
@@ -217,12 +604,21 @@ class CityGMLBuildingDocumentFactory(CityGMLDocumentFactory):
             el_measuredHeight.appendChild(doc.createTextNode(str(measured_height)))
 
         # bldg:lod0RoofEdge
+        # 屋根外形はフットプリントと同じジオメトリなので、参照するか生成済みの要素を複製する
         el_lod0_roof_edge = doc.createElement("bldg:lod0RoofEdge")
-        el_lod0_roof_edge.appendChild(makeMultiSurface(geometry, doc))
+        if self.useXlink() and gml_id is not None:
+            surface_id = f"lod0FootPrint_{gml_id}"
+            el_foot_print_surface.setAttribute("gml:id", surface_id)
+            el_lod0_roof_edge.setAttribute("xlink:href", f"#{surface_id}")
+        else:
+            el_lod0_roof_edge.appendChild(el_foot_print_surface.cloneNode(True))
 
         # bldg:lod1Solid
         el_lod1_solid = doc.createElement("bldg:lod1Solid")
-        el_lod1_solid.appendChild(makeSolid(geometry, doc))
+        solid_pos_lists = solidPosLists(positions)
+        el_lod1_solid.appendChild(makeSolid(geometry, doc, positions, solid_pos_lists))
+        if self.inlineCheck() is not None:
+            self.inlineCheck().addSolid(solid_pos_lists)
 
         return [el_lod0_foot_print, el_measuredHeight, el_lod0_roof_edge, el_lod1_solid]
 
@@ -247,9 +643,9 @@ class CityGMLLandUseDocumentFactory(CityGMLDocumentFactory):
     def prefix(self):
         return "luse"
 
-    def makeGeometryElements(self, geometry: QgsGeometry, height: float, doc: QDomDocument) -> List[QDomElement]:
+    def makeGeometryElements(self, geometry: QgsGeometry, height: float, doc: QDomDocument, gml_id=None) -> List[QDomElement]:
         el_lod1_multi_surface = doc.createElement("use:lod1MultiSurface")
-        el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc))
+        el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc, self.geometryPositions(geometry)))
 
         return [el_lod1_multi_surface]
 
@@ -265,9 +661,9 @@ class CityGMLRoadDocumentFactory(CityGMLDocumentFactory):
     def prefix(self):
         return "tran"
 
-    def makeGeometryElements(self, geometry: QgsGeometry, height: float, doc: QDomDocument) -> List[QDomElement]:
+    def makeGeometryElements(self, geometry: QgsGeometry, height: float, doc: QDomDocument, gml_id=None) -> List[QDomElement]:
         el_lod1_multi_surface = doc.createElement("tran:lod1MultiSurface")
-        el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc))
+        el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc, self.geometryPositions(geometry)))
 
         return [el_lod1_multi_surface]
 
@@ -283,9 +679,9 @@ class CityGMLReliefFeatureDocumentFactory(CityGMLDocumentFactory):
     def prefix(self):
         return "dem"
 
-    def makeGeometryElements(self, geometry: QgsGeometry, height: float, doc: QDomDocument) -> List[QDomElement]:
+    def makeGeometryElements(self, geometry: QgsGeometry, height: float, doc: QDomDocument, gml_id=None) -> List[QDomElement]:
         el_lod1_multi_surface = doc.createElement("dem:lod")
-        el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc))
+        el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc, self.geometryPositions(geometry)))
         return [el_lod1_multi_surface]
 
 # class CityGMLTinReliefDocumentFactory(CityGMLDocumentFactory):
@@ -323,8 +719,25 @@ class CityGMLReliefFeatureDocumentFactory(CityGMLDocumentFactory):
 #         el_lod1_multi_surface.appendChild(makeMultiSurface(geometry, doc))
 #         return [el_lod1_multi_surface]
         
-def makeMultiSurface(geom: QgsGeometry, doc: QDomDocument) -> QDomElement:
-    """ 要素MultiSurfaceを生成する """
+def documentToString(doc: QDomDocument) -> str:
+    """ DomDocumentをファイル出力と同じ形式(UTF-8、インデント2)の文字列にする """
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+
+    text_stream = QTextStream(buffer)
+    text_stream.setCodec("UTF-8")
+    doc.save(text_stream, 2, QDomNode.EncodingFromTextStream)
+    text_stream.flush()
+
+    buffer.close()
+    return bytes(buffer.data()).decode("utf-8")
+
+
+def makeMultiSurface(geom: QgsGeometry, doc: QDomDocument, positions: "GeometryPositions" = None) -> QDomElement:
+    """ 要素MultiSurfaceを生成する
+
+    @param positions: 取得済みの頂点の座標値（省略時はgeomから取得する）
+    """
     el_multi_surface = doc.createElement("gml:MultiSurface")
 
     el_surface_member = doc.createElement("gml:surfaceMember")
@@ -333,8 +746,11 @@ def makeMultiSurface(geom: QgsGeometry, doc: QDomDocument) -> QDomElement:
     el_polygon = doc.createElement("gml:Polygon")
     el_surface_member.appendChild(el_polygon)
 
+    if positions is None:
+        positions = GeometryPositions(geom)
+
     part_index = 0
-    for part in geom.parts():
+    for index in range(positions.partCount()):
         element_name = "gml:exterior" if part_index == 0 else "gml:interior"
         el_element = doc.createElement(element_name)
         el_polygon.appendChild(el_element)
@@ -342,40 +758,103 @@ def makeMultiSurface(geom: QgsGeometry, doc: QDomDocument) -> QDomElement:
         el_linear_ring = doc.createElement("gml:LinearRing")
         el_element.appendChild(el_linear_ring)
 
-        vertices = []
-        for v in part.vertices():
-            vertices.append(v.clone())
-
-        # el_point_list = makePosList(vertices, feat_height, doc)
-        el_point_list = makePosList(vertices, doc)
+        el_point_list = makePosListFromText(positions.posList(index), doc)
         el_linear_ring.appendChild(el_point_list)
 
     return el_multi_surface
 
 
-def makePosList(vertices: List[Union[QgsPoint, QgsPointXY]], doc: QDomDocument) -> QDomElement:
-    """ 要素posListを生成する """
-    points = []
+class GeometryPositions:
+    """
+    ジオメトリの頂点の座標値とその文字列
+
+    座標値の文字列化はパーツごとに1度だけ行い、posListや側面の生成で使い回す
+    """
+    def __init__(self, geom: QgsGeometry, coordinate_format: CoordinateFormat = None):
+        self.__parts = geometryPartPositions(geom)
+        self.__coordinate_format = coordinate_format
+        self.__texts = [None] * len(self.__parts)
+        self.__pos_lists = [None] * len(self.__parts)
+
+    def partCount(self) -> int:
+        return len(self.__parts)
+
+    def positions(self, index: int) -> List[float]:
+        """ パーツの座標値（緯度、経度、標高の順） """
+        return self.__parts[index]
+
+    def texts(self, index: int) -> List[str]:
+        """ パーツの座標値の文字列（緯度、経度、標高の順） """
+        if self.__texts[index] is None:
+            self.__texts[index] = formatPositionTexts(self.__parts[index], self.__coordinate_format)
+        return self.__texts[index]
+
+    def posList(self, index: int) -> str:
+        """ パーツのposListの文字列 """
+        if self.__pos_lists[index] is None:
+            self.__pos_lists[index] = " ".join(self.texts(index))
+        return self.__pos_lists[index]
+
+    def zeroText(self) -> str:
+        """ 標高0の文字列 """
+        return formatPositionTexts([0.0, 0.0, 0.0], self.__coordinate_format)[2]
+
+
+def geometryPartPositions(geom: QgsGeometry) -> List[List[float]]:
+    """ パーツごとの頂点の座標値（緯度、経度、標高の順）を取得する """
+    # WKBから座標値をまとめて取得する
+    parts = partPositions(bytes(geom.asWkb()))
+    if parts is None:
+        # WKBから取得できないジオメトリは頂点ごとに取得する
+        parts = [vertexPositions(part.vertices()) for part in geom.parts()]
+
+    return parts
+
+
+def vertexPositions(vertices) -> List[float]:
+    """ 頂点の座標値を緯度、経度、標高の順に並べる """
+    positions = []
     for vertex in vertices:
-        # 緯度、経度の順
-        points.append(f"{vertex.y()}")
-        points.append(f"{vertex.x()}")
+        # 標高がなければ0.0
+        z = vertex.z()
+        if z == None or z != z:
+            z = 0.0
+
+        positions.extend((vertex.y(), vertex.x(), z))
+
+    return positions
 
-        # 標高
-        if vertex.z() != None and f"{vertex.z()}" != "nan":
-            points.append(f"{vertex.z()}")
-        else:
-            points.append("0.0")
 
+def makePosList(vertices: List[Union[QgsPoint, QgsPointXY]], doc: QDomDocument, coordinate_format: CoordinateFormat = None) -> QDomElement:
+    """ 要素posListを生成する
+
+    @param coordinate_format: 座標値の桁数（省略時は全桁）
+    """
+    return makePosListFromText(formatPositions(vertexPositions(vertices), coordinate_format), doc)
+
+
+def makePosListFromText(text: str, doc: QDomDocument) -> QDomElement:
+    """ posListの文字列から要素posListを生成する """
     el_pos_list = doc.createElement("gml:posList")
-    el_pos_list.appendChild(doc.createTextNode(" ".join(points)))
+    el_pos_list.appendChild(doc.createTextNode(text))
 
     return el_pos_list
 
-def makeSolid(geom: QgsGeometry, doc: QDomDocument) -> QDomElement:
-    """ 要素Solidを生成する """
+def makeSolid(geom: QgsGeometry, doc: QDomDocument, positions: GeometryPositions = None, pos_lists: List[str] = None) -> QDomElement:
+    """ 要素Solidを生成する
+
+    @param positions: 取得済みの頂点の座標値（省略時はgeomから取得する）
+    @param pos_lists: 作成済みの境界面のposListの文字列（省略時はpositionsから作成する）
+    """
+    if positions is None:
+        positions = GeometryPositions(geom)
+    if pos_lists is None:
+        pos_lists = solidPosLists(positions)
+
     el_solid = doc.createElement("gml:Solid")
-    for part in geom.parts():
+
+    # exteriorのみ
+    if positions.partCount() > 0:
         el_exterior = doc.createElement("gml:exterior")
         el_solid.appendChild(el_exterior)
 
@@ -383,29 +862,45 @@ def makeSolid(geom: QgsGeometry, doc: QDomDocument) -> QDomElement:
         el_exterior.appendChild(el_composite_surface)
 
         # 個体
-        vertices = []
-        for vertex in part.vertices():
-            if len(vertices) > 0:
-                # 各線分に対して側面を作成する
-                el_surface_member = doc.createElement("gml:surfaceMember")
-                el_composite_surface.appendChild(el_surface_member)
+        # 各線分に対して側面を作成する
+        for pos_list in pos_lists[:-1]:
+            el_surface_member = doc.createElement("gml:surfaceMember")
+            el_composite_surface.appendChild(el_surface_member)
 
-                el_surface_member.appendChild(makeSidePolygon(vertices[-1], vertex, doc))
-
-            vertices.append(vertex.clone())
+            el_surface_member.appendChild(makeSidePolygon(pos_list, doc))
 
         # 底面(el_composite_surface配下)
-        last_polygon = makeBottomSurface(vertices, doc)
+        last_polygon = makeBottomSurface(pos_lists[-1], doc)
         el_composite_surface.appendChild(last_polygon)
 
-        # exteriorのみ
-        break
+    return el_solid
 
 
-    return el_solid
+def solidPosLists(positions: GeometryPositions) -> List[str]:
+    """ 立体の境界面（側面、底面の順）のposListの文字列
+
+    頂点の文字列は1度だけ作成し、隣り合う側面と底面で使い回す
+    立体は先頭のパーツ（exterior）のみから作成する
+    """
+    if positions.partCount() == 0:
+        return []
+
+    texts = positions.texts(0)
+    zero = positions.zeroText()
 
-def makeSidePolygon(start: Union[QgsPointXY, QgsPoint], end: Union[QgsPointXY, QgsPoint], doc: QDomDocument) -> QDomElement:
-    """ 側面の要素Polygonを生成する """
+    # 各線分に対して側面を作成する
+    pos_lists = [sidePosList(texts[offset - 3:offset], texts[offset:offset + 3], zero) for offset in range(3, len(texts), 3)]
+
+    # 底面
+    pos_lists.append(positions.posList(0))
+    return pos_lists
+
+
+def makeSidePolygon(pos_list: str, doc: QDomDocument) -> QDomElement:
+    """ 側面の要素Polygonを生成する
+
+    @param pos_list: 側面のposListの文字列
+    """
 
     el_polygon = doc.createElement("gml:Polygon")
 
@@ -415,48 +910,37 @@ def makeSidePolygon(start: Union[QgsPointXY, QgsPoint], end: Union[QgsPointXY, Q
     el_linear_ring = doc.createElement("gml:LinearRing")
     el_exterior.appendChild(el_linear_ring)
 
-    pos_list = []
-    # 左回り
-    # 座標値の並びは緯度、経度、標高
+    el_linear_ring.appendChild(makePosListFromText(pos_list, doc))
 
-    # 底辺
-    pos_list.append(f"{start.y()}")
-    pos_list.append(f"{start.x()}")
-    pos_list.append("0.0")
-
-    pos_list.append(f"{end.y()}")
-    pos_list.append(f"{end.x()}")
-    pos_list.append("0.0")
-
-    # 左辺
-    pos_list.append(f"{end.y()}")
-    pos_list.append(f"{end.x()}")
-    if end.z() != None and f"{end.z()}" != "nan":
-        pos_list.append(f"{end.z()}")
-    else:
-        pos_list.append("0.0")
-
-    # 上辺
-    pos_list.append(f"{start.y()}")
-    pos_list.append(f"{start.x()}")
-    if start.z() != None and f"{start.z()}" != "nan":
-        pos_list.append(f"{start.z()}")
-    else:
-        pos_list.append("0.0")
-
-    # 右辺
-    pos_list.append(f"{start.y()}")
-    pos_list.append(f"{start.x()}")
-    pos_list.append("0.0")
+    return el_polygon
 
-    el_pos_list = doc.createElement("gml:posList")
-    el_pos_list.appendChild(doc.createTextNode(" ".join(pos_list)))
-    el_linear_ring.appendChild(el_pos_list)
 
-    return el_polygon
+def sidePosList(start: List[str], end: List[str], zero: str) -> str:
+    """ 側面のposListの文字列を作成する
 
+    @param start: 始点の座標値の文字列（緯度、経度、標高）
+    @param end: 終点の座標値の文字列（緯度、経度、標高）
+    @param zero: 標高0の文字列
+    """
+    start_lat, start_lon, start_z = start
+    end_lat, end_lon, end_z = end
 
-def makeBottomSurface(vertices: List[Union[QgsPoint, QgsPointXY]], doc: QDomDocument) -> QDomElement:
+    # 左回り
+    # 座標値の並びは緯度、経度、標高
+    return " ".join((
+        # 底辺
+        start_lat, start_lon, zero,
+        end_lat, end_lon, zero,
+        # 左辺
+        end_lat, end_lon, end_z,
+        # 上辺
+        start_lat, start_lon, start_z,
+        # 右辺
+        start_lat, start_lon, zero,
+    ))
+
+
+def makeBottomSurface(pos_list: str, doc: QDomDocument) -> QDomElement:
     """ 底面の要素surfaceMemberを生成する """    
     el_surface_member = doc.createElement("gml:surfaceMember")
     el_polygon = doc.createElement("gml:Polygon")
@@ -464,8 +948,17 @@ def makeBottomSurface(vertices: List[Union[QgsPoint, QgsPointXY]], doc: QDomDocu
     el_polygon.appendChild(el_exterior)
     el_linear_ring = doc.createElement("gml:LinearRing")
     el_exterior.appendChild(el_linear_ring)
-    el_pos_list = makePosList(vertices, doc)
+    el_pos_list = makePosListFromText(pos_list, doc)
     el_linear_ring.appendChild(el_pos_list)
     el_surface_member.appendChild(el_polygon)
 
-    return el_surface_member
\ No newline at end of file
+    return el_surface_member
+
+
+def namespaceTagName(tag_name: str) -> str:
+    """ 接頭辞付きのタグ名を名前空間のURI付き（{URI}ローカル名）にする """
+    prefix, _, local_name = tag_name.rpartition(":")
+    uri = dict(NAMESPACES).get(prefix)
+    if uri is None:
+        return tag_name
+    return "{" + uri + "}" + local_name
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ CodelistIndex  コードリストの値の索引
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import xml.etree.ElementTree as ET
+
+# 先読みで同時に解析するコードリスト数
+PRELOAD_WORKERS = 4
+
+
+class CodelistIndex:
+    """
+    コードリストごとの値の集合
+
+    コードリストは1度だけ解析し、存在しない・解析できないコードリストも記録する
+    """
+
+    def __init__(self):
+        # 正規化した絶対パス -> 値の集合（存在しない・解析できない場合はNone）
+        self.__codes = {}
+
+    def contains(self, path: str, code) -> bool:
+        """
+        コードリストに値が存在するか
+
+        @param path: コードリストのファイルパス
+        @param code: 値
+        """
+        # gmlファイルからの相対パス（x.gml/../codelists/...）は正規化したパスで開く
+        key = codelistKey(path)
+        if key not in self.__codes:
+            self.__codes[key] = loadCodelist(key)
+
+        codes = self.__codes[key]
+        if codes is None:
+            return False
+        return code in codes
+
+    def preload(self, dir_path: str):
+        """
+        ディレクトリ内のコードリストをまとめて解析しておく
+
+        @param dir_path: コードリストのディレクトリ
+        """
+        paths = [path for path in glob.glob(os.path.join(dir_path, "*.xml")) if codelistKey(path) not in self.__codes]
+        if len(paths) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=PRELOAD_WORKERS) as executor:
+            for path, codes in zip(paths, executor.map(loadCodelist, paths)):
+                self.__codes[codelistKey(path)] = codes
+
+
+def codelistKey(path: str) -> str:
+    """ コードリストのパスを正規化する """
+    return os.path.normcase(os.path.abspath(path))
+
+
+def loadCodelist(path: str):
+    """
+    コードリストを解析し、dictionaryEntry/definition/nameの値の集合を取得する
+
+    @param path: コードリストのファイルパス
+    @return: 値の集合 存在しない・解析できない場合はNone
+    """
+    if not os.path.isfile(path):
+        print("checkCodeOnCodeList : codelists is not exists.", path)
+        return None
+
+    try:
+        tree = ET.parse(path)
+    except Exception:
+        print("checkCodeOnCodeList : codelists is not parsed.", path)
+        return None
+
+    # スキーマにそって該当タグを参照して、値を取得
+    codes = set()
+    for child in tree.getroot():
+        if child.tag.endswith("dictionaryEntry"):
+            for definition in child:
+                for element in definition:
+                    if element.tag.endswith("name"):
+                        codes.add(element.text)
+
+    return codes
+
+
+def findCodelistDirs(gml_file_paths: list) -> list:
+    """
+    gmlファイルから参照されるコードリストのディレクトリを探す
+
+    codelistsフォルダはgmlファイルのあるフォルダか、その上位のフォルダにある
+
+    @param gml_file_paths: gmlファイルパスの配列
+    """
+    dirs = []
+    for gml_file_path in gml_file_paths:
+        dir_path = os.path.dirname(os.path.abspath(gml_file_path))
+        for _ in range(3):
+            codelist_dir = os.path.join(dir_path, "codelists")
+            if os.path.isdir(codelist_dir) and codelist_dir not in dirs:
+                dirs.append(codelist_dir)
+            dir_path = os.path.dirname(dir_path)
+
+    return dirs
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ ExportManifest  差分出力用のメッシュごとの入力内容の記録
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import json
+import hashlib
+
+# 出力先に保存するマニフェストのファイル名
+MANIFEST_FILE_NAME = "citygml_export_manifest.json"
+
+# マニフェストの形式（出力内容が変わる修正をしたら上げる）
+MANIFEST_VERSION = 1
+
+
+class ExportManifest:
+    """
+    メッシュごとの入力地物のハッシュ値と出力ファイル
+
+    ハッシュ値と出力設定が前回と同じメッシュは出力を省略する
+    """
+
+    def __init__(self, settings: dict):
+        """
+        @param settings: 出力内容に影響する出力設定
+        """
+        self.__settings = settingsHash(settings)
+        self.__meshes = {}
+
+    @staticmethod
+    def load(dir_path: str, settings: dict) -> "ExportManifest":
+        """
+        出力先のマニフェストを読み込む
+
+        出力設定が異なる場合は、前回の出力ファイルのみを引き継ぐ（ハッシュ値は比較しない）
+
+        @param dir_path: 出力先ディレクトリ
+        @param settings: 今回の出力設定
+        @return: マニフェストがない場合はNone
+        """
+        path = os.path.join(dir_path, MANIFEST_FILE_NAME)
+        if not os.path.isfile(path):
+            return None
+
+        manifest = ExportManifest(settings)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # 壊れている場合はすべてのメッシュを出力し直す
+            return manifest
+
+        same_settings = data.get("version") == MANIFEST_VERSION and data.get("settings") == manifest.__settings
+        for meshcode, entry in data.get("meshes", {}).items():
+            manifest.__meshes[meshcode] = {
+                "hash": entry.get("hash") if same_settings else None,
+                "file": entry.get("file"),
+            }
+
+        return manifest
+
+    def save(self, dir_path: str):
+        """
+        出力先にマニフェストを保存する
+        """
+        path = os.path.join(dir_path, MANIFEST_FILE_NAME)
+        data = {
+            "version": MANIFEST_VERSION,
+            "settings": self.__settings,
+            "meshes": self.__meshes,
+        }
+
+        # 途中で中断しても壊れないよう一時ファイルから置き換える
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def meshcodes(self) -> list:
+        return list(self.__meshes.keys())
+
+    def fileName(self, meshcode: str) -> str:
+        """ メッシュの出力ファイル名（出力先ディレクトリからの相対パス） """
+        entry = self.__meshes.get(meshcode)
+        return entry["file"] if entry is not None else None
+
+    def isUnchanged(self, meshcode: str, content_hash: str, dir_path: str) -> bool:
+        """
+        前回から入力内容が変わっておらず、出力ファイルも残っているか
+        """
+        entry = self.__meshes.get(meshcode)
+        if entry is None or entry["hash"] is None or entry["hash"] != content_hash:
+            return False
+        return entry["file"] is not None and os.path.isfile(os.path.join(dir_path, entry["file"]))
+
+    def setMesh(self, meshcode: str, content_hash: str, file_name: str):
+        """ 出力したメッシュを記録する """
+        self.__meshes[meshcode] = {"hash": content_hash, "file": file_name}
+
+    def removeMesh(self, meshcode: str):
+        self.__meshes.pop(meshcode, None)
+
+
+class MeshContentHash:
+    """
+    1メッシュ分の入力地物のハッシュ値
+
+    出力に使う値（gml:id、高さ、ジオメトリのWKB）を出力順に積み上げる
+    """
+
+    def __init__(self):
+        self.__hash = hashlib.sha256()
+
+    def addFeature(self, gml_id, height, wkb: bytes):
+        self.__hash.update(repr((str(gml_id), repr(height), len(wkb))).encode("utf-8"))
+        self.__hash.update(wkb)
+
+    def hexdigest(self) -> str:
+        return self.__hash.hexdigest()
+
+
+def settingsHash(settings: dict) -> str:
+    """ 出力設定のハッシュ値 """
+    text = json.dumps(settings, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
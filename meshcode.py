@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ meshcode  地域メッシュコードの生成と解析
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import math
+
+import numpy as np
+
+# メッシュの次数
+MESH_LEVEL_1 = 1        # 1次メッシュ（約80km四方）
+MESH_LEVEL_2 = 2        # 2次メッシュ（約10km四方）
+MESH_LEVEL_3 = 3        # 3次メッシュ・基準地域メッシュ（約1km四方）
+MESH_LEVEL_HALF = 4     # 2分の1地域メッシュ（約500m四方）
+MESH_LEVEL_QUARTER = 5  # 4分の1地域メッシュ（約250m四方）
+
+# メッシュの次数とメッシュコードの桁数
+MESHCODE_LENGTHS = {
+    MESH_LEVEL_1: 4,
+    MESH_LEVEL_2: 6,
+    MESH_LEVEL_3: 8,
+    MESH_LEVEL_HALF: 9,
+    MESH_LEVEL_QUARTER: 10,
+}
+
+
+def encodeMeshcode(lat: float, lon: float, level: int = MESH_LEVEL_3) -> str:
+    """
+    メッシュコード作成（1地点）
+
+    @param lat:緯度
+    @param lon:経度
+    @param level:メッシュの次数
+    """
+    checkMeshLevel(level)
+
+    #[1次メッシュコード上2桁]
+    #緯度×60分÷40分＝p　余り　a
+    p,a = divmod(lat*60,40)
+    #[1次メッシュコード下2桁]
+    #経度ー100度＝u　余り　f
+    u = lon - 100
+    f = math.modf(lon)[0]
+    code = str(int(p)) + str(int(u))
+    if level == MESH_LEVEL_1:
+        return code
+
+    #[2次メッシュコード上1桁]
+    #a÷5分＝q　余り　b
+    q,b = divmod(a,5)
+    #[2次メッシュコード下1桁]
+    #f×60分÷7分30秒＝v　余り　g
+    v,g = divmod(f*60,7.5)
+    code += str(int(q)) + str(int(v))
+    if level == MESH_LEVEL_2:
+        return code
+
+    #[3次メッシュコード上1桁]
+    #b×60秒÷30秒＝r　余り　c
+    r,c = divmod(b*60,30)
+    #[3次メッシュコード下1桁]
+    #g×60秒÷45秒＝w　余り　h
+    w,h = divmod(g*60,45)
+    code += str(int(r)) + str(int(w))
+    if level == MESH_LEVEL_3:
+        return code
+
+    #[2分の1地域メッシュコード]
+    #c÷15秒＝s　余り　d、h÷22.5秒＝t　余り　i
+    #南西1　南東2　北西3　北東4
+    s,d = divmod(c,15)
+    t,i = divmod(h,22.5)
+    code += str(int(s*2 + t + 1))
+    if level == MESH_LEVEL_HALF:
+        return code
+
+    #[4分の1地域メッシュコード]
+    #d÷7.5秒＝s2、i÷11.25秒＝t2
+    s2 = d // 7.5
+    t2 = i // 11.25
+    return code + str(int(s2*2 + t2 + 1))
+
+
+def encodeMeshcodes(lats, lons, level: int = MESH_LEVEL_3) -> np.ndarray:
+    """
+    メッシュコード作成（複数地点を一括で処理）
+
+    encodeMeshcodeと同じ計算を配列で行い、同じメッシュコードの文字列の配列を返す
+
+    @param lats:緯度の配列
+    @param lons:経度の配列
+    @param level:メッシュの次数
+    """
+    checkMeshLevel(level)
+
+    lat = np.asarray(lats, dtype=np.float64)
+    lon = np.asarray(lons, dtype=np.float64)
+    if lat.size == 0:
+        return np.array([], dtype=str)
+
+    # 1次メッシュ
+    p, a = np.divmod(lat * 60, 40)
+    u = np.trunc(lon - 100)
+    f = np.modf(lon)[0]
+    code = p * 100 + u
+
+    if level >= MESH_LEVEL_2:
+        # 2次メッシュ
+        q, b = np.divmod(a, 5)
+        v, g = np.divmod(f * 60, 7.5)
+        code = code * 100 + q * 10 + v
+
+    if level >= MESH_LEVEL_3:
+        # 3次メッシュ
+        r, c = np.divmod(b * 60, 30)
+        w, h = np.divmod(g * 60, 45)
+        code = code * 100 + r * 10 + w
+
+    if level >= MESH_LEVEL_HALF:
+        # 2分の1地域メッシュ
+        s, d = np.divmod(c, 15)
+        t, i = np.divmod(h, 22.5)
+        code = code * 10 + s * 2 + t + 1
+
+    if level >= MESH_LEVEL_QUARTER:
+        # 4分の1地域メッシュ
+        s2 = np.floor_divide(d, 7.5)
+        t2 = np.floor_divide(i, 11.25)
+        code = code * 10 + s2 * 2 + t2 + 1
+
+    # 10桁までなので倍精度浮動小数点数で誤差なく整数にできる
+    return code.astype(np.int64).astype(str)
+
+
+def decodeMeshcode(meshcode: str) -> tuple:
+    """
+    メッシュコードからメッシュの範囲を求める
+
+    @param meshcode:メッシュコード
+    @return (南端の緯度, 西端の経度, 北端の緯度, 東端の経度)
+    """
+    code = str(meshcode)
+    level = meshLevelOf(code)
+
+    # 1次メッシュ 緯度40分、経度1度
+    lat = int(code[0:2]) * 40 / 60
+    lon = float(int(code[2:4]) + 100)
+    lat_size = 40 / 60
+    lon_size = 1.0
+
+    if level >= MESH_LEVEL_2:
+        # 2次メッシュ 緯度5分、経度7分30秒
+        lat_size /= 8
+        lon_size /= 8
+        lat += int(code[4]) * lat_size
+        lon += int(code[5]) * lon_size
+
+    if level >= MESH_LEVEL_3:
+        # 3次メッシュ 緯度30秒、経度45秒
+        lat_size /= 10
+        lon_size /= 10
+        lat += int(code[6]) * lat_size
+        lon += int(code[7]) * lon_size
+
+    for index in range(8, len(code)):
+        # 2分の1、4分の1地域メッシュ 南西1　南東2　北西3　北東4
+        quadrant = int(code[index]) - 1
+        if quadrant < 0 or quadrant > 3:
+            raise ValueError(f"不正なメッシュコードです: {code}")
+        lat_size /= 2
+        lon_size /= 2
+        lat += (quadrant // 2) * lat_size
+        lon += (quadrant % 2) * lon_size
+
+    return (lat, lon, lat + lat_size, lon + lon_size)
+
+
+def meshLevelOf(meshcode: str) -> int:
+    """
+    メッシュコードの桁数からメッシュの次数を求める
+
+    @param meshcode:メッシュコード
+    """
+    code = str(meshcode)
+    for level, length in MESHCODE_LENGTHS.items():
+        if len(code) == length and code.isdigit():
+            return level
+
+    raise ValueError(f"不正なメッシュコードです: {code}")
+
+
+def checkMeshLevel(level: int):
+    """
+    メッシュの次数が対応しているものか確認する
+
+    @param level:メッシュの次数
+    """
+    if level not in MESHCODE_LENGTHS:
+        raise ValueError(f"対応していないメッシュの次数です: {level}")
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ process_pool  ワーカープロセスの起動設定
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import multiprocessing
+
+
+def spawnContext():
+    """
+    ワーカープロセスをspawnで起動するコンテキスト（QGIS上でも同梱のPythonで起動する）
+    """
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(pythonExecutable())
+    return context
+
+
+def pythonExecutable() -> str:
+    """
+    ワーカープロセスを起動するPythonの実行ファイル
+
+    QGIS上ではsys.executableがQGIS本体になるため、同梱のPythonを探す
+    """
+    executable = sys.executable
+    if os.path.basename(executable).lower().startswith("python"):
+        return executable
+
+    for dir_path in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in ("pythonw.exe", "python.exe", "python3"):
+            path = os.path.join(dir_path, name)
+            if os.path.isfile(path):
+                return path
+
+    return executable
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Tracing  処理段階ごとの処理時間の記録（Chrome Trace形式）
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+
+# 1回の記録で保持するイベント数の上限（超えた分は件数のみ記録する）
+MAX_EVENTS = 1000000
+
+
+class Tracer:
+    """
+    区間（span）の開始時刻と処理時間をChrome Trace形式のイベントとして記録する
+
+    出力したファイルはchrome://tracing、Perfetto（https://ui.perfetto.dev）で表示できる
+    """
+
+    def __init__(self):
+        self.__events = []
+        self.__thread_names = {}
+        self.__dropped_count = 0
+        self.__lock = threading.Lock()
+
+    def addSpan(self, name: str, started: int, ended: int, args: dict):
+        """
+        区間を記録する
+
+        @param name: 区間の名前
+        @param started: 開始時刻（ナノ秒 time.perf_counter_ns）
+        @param ended: 終了時刻（ナノ秒）
+        @param args: 区間の付加情報（メッシュコード、ファイル名など）
+        """
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": started // 1000, "dur": (ended - started) // 1000,
+                 "pid": os.getpid(), "tid": thread.ident}
+        if args:
+            event["args"] = args
+
+        with self.__lock:
+            if thread.ident not in self.__thread_names:
+                self.__thread_names[thread.ident] = thread.name
+            if len(self.__events) >= MAX_EVENTS:
+                self.__dropped_count += 1
+                return
+            self.__events.append(event)
+
+    def addEvents(self, events: list):
+        """
+        ワーカープロセスで記録したイベントを加える
+        """
+        with self.__lock:
+            room = MAX_EVENTS - len(self.__events)
+            self.__events.extend(events[:max(0, room)])
+            self.__dropped_count += max(0, len(events) - room)
+
+    def events(self) -> list:
+        """
+        記録したイベント（スレッド名のイベントを含む）
+        """
+        with self.__lock:
+            names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                     for tid, name in self.__thread_names.items()]
+            return names + list(self.__events)
+
+    def save(self, path: str):
+        """
+        Chrome Trace形式のJSONファイルに出力する
+        """
+        trace = {"traceEvents": self.events(), "displayTimeUnit": "ms"}
+        if self.__dropped_count > 0:
+            trace["otherData"] = {"dropped_events": self.__dropped_count}
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False)
+
+
+class NullSpan:
+    """記録しない場合の区間（何もしない）"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Span:
+    """記録する区間"""
+
+    def __init__(self, tracer: Tracer, name: str, args: dict):
+        self.__tracer = tracer
+        self.__name = name
+        self.__args = args
+        self.__started = 0
+
+    def __enter__(self):
+        self.__started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__tracer.addSpan(self.__name, self.__started, time.perf_counter_ns(), self.__args)
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+# 記録中のTracer（記録していない場合はNone）
+active_tracer = None
+
+
+def traceSpan(name: str, **args):
+    """
+    区間を記録する
+
+        with traceSpan("serialize", meshcode=meshcode):
+            ...
+
+    記録していない場合は何もしない区間を返す（区間の名前や付加情報は作らない）
+
+    @param name: 区間の名前
+    @param args: 区間の付加情報
+    """
+    tracer = active_tracer
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, args)
+
+
+def isTracing() -> bool:
+    return active_tracer is not None
+
+
+def startTracing() -> bool:
+    """
+    記録を開始する
+
+    @return: 記録を開始した場合はTrue（記録中の場合はFalse）
+    """
+    global active_tracer
+    if active_tracer is not None:
+        return False
+    active_tracer = Tracer()
+    return True
+
+
+def stopTracing() -> Tracer:
+    """
+    記録を終了する
+
+    @return: 記録したTracer（記録していない場合はNone）
+    """
+    global active_tracer
+    tracer = active_tracer
+    active_tracer = None
+    return tracer
+
+
+def addTraceEvents(events: list):
+    """
+    ワーカープロセスで記録したイベントを記録中のTracerに加える
+    """
+    tracer = active_tracer
+    if tracer is not None and events:
+        tracer.addEvents(events)
+
+
+@contextmanager
+def traceSession(trace_dir: str, name: str):
+    """
+    処理全体の記録
+
+    trace_dirを指定した場合のみ記録し、終了時に「trace_名前_日時.json」を出力する
+    記録中に呼び出した場合（パイプラインの出力の中の出力処理など）は外側の記録に含める
+
+    @param trace_dir: トレースファイルの出力先フォルダ（空の場合は記録しない）
+    @param name: 処理の名前（export、checkなど）
+    """
+    if not trace_dir or not startTracing():
+        yield
+        return
+
+    try:
+        with traceSpan(name):
+            yield
+    finally:
+        tracer = stopTracing()
+        file_name = f"trace_{name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        try:
+            os.makedirs(trace_dir, exist_ok=True)
+            tracer.save(os.path.join(trace_dir, file_name))
+        except OSError as e:
+            print(f"トレースファイルを出力できませんでした。{e}")
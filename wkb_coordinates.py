@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ wkb_coordinates  WKBからの座標値の一括取得
+        copyright            : (C) 2023 by Orbitalnet.inc
+ ***************************************************************************/
+"""
+
+import math
+import struct
+
+# WKBのジオメトリタイプ（2次元の値）
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+# EWKBのフラグ
+EWKB_Z_FLAG = 0x80000000
+EWKB_M_FLAG = 0x40000000
+EWKB_SRID_FLAG = 0x20000000
+
+
+class WkbFormatError(Exception):
+    """対応していないWKB"""
+    pass
+
+
+def partPositions(wkb: bytes) -> list:
+    """
+    WKBからパーツごとの頂点の座標値を取得する
+
+    パーツと頂点の並びはQgsGeometry.parts()とQgsAbstractGeometry.vertices()と同じで、
+    ポリゴンは全リングの頂点を連結する
+    座標値は緯度、経度、標高の順に並べた1次元のリストで、標高がない（NaN）場合は0.0とする
+
+    @param wkb: ISO WKB（QgsGeometry.asWkb()）
+    @return: パーツごとの座標値のリスト 対応していないジオメトリタイプの場合はNone
+    """
+    if len(wkb) == 0:
+        return []
+
+    try:
+        parts, _ = readParts(wkb, 0)
+    except (WkbFormatError, struct.error):
+        return None
+
+    return [toPositions(values, dim, has_z) for values, dim, has_z in parts]
+
+
+def readParts(wkb: bytes, offset: int):
+    """
+    WKBのジオメトリを読み込み、パーツごとの座標値を取得する
+
+    @return: ([(x,y[,z][,m]の並びの座標値, 次元数, 標高の有無)], 次のジオメトリの位置)
+    """
+    endian, geometry_type, dim, has_z, offset = readHeader(wkb, offset)
+
+    if geometry_type == WKB_POINT:
+        values, offset = readCoordinates(wkb, offset, endian, 1, dim)
+        if values[0] != values[0] or values[1] != values[1]:
+            # 空のポイントは頂点を持たないので通常の処理に任せる
+            raise WkbFormatError("empty point")
+        return [(values, dim, has_z)], offset
+
+    if geometry_type == WKB_LINESTRING:
+        (count,) = struct.unpack_from(endian + "I", wkb, offset)
+        values, offset = readCoordinates(wkb, offset + 4, endian, count, dim)
+        return [(values, dim, has_z)], offset
+
+    if geometry_type == WKB_POLYGON:
+        (ring_count,) = struct.unpack_from(endian + "I", wkb, offset)
+        offset += 4
+        values = []
+        for _ in range(ring_count):
+            (count,) = struct.unpack_from(endian + "I", wkb, offset)
+            ring_values, offset = readCoordinates(wkb, offset + 4, endian, count, dim)
+            values.extend(ring_values)
+        return [(values, dim, has_z)], offset
+
+    if geometry_type in (WKB_MULTIPOINT, WKB_MULTILINESTRING, WKB_MULTIPOLYGON):
+        (part_count,) = struct.unpack_from(endian + "I", wkb, offset)
+        offset += 4
+        parts = []
+        for _ in range(part_count):
+            sub_parts, offset = readParts(wkb, offset)
+            parts.extend(sub_parts)
+        return parts, offset
+
+    # 曲線やジオメトリコレクションなど
+    raise WkbFormatError(f"unsupported geometry type {geometry_type}")
+
+
+def readHeader(wkb: bytes, offset: int):
+    """
+    WKBのバイトオーダーとジオメトリタイプを読み込む
+
+    @return: (struct用のバイトオーダー, 2次元のジオメトリタイプ, 次元数, 標高の有無, データの位置)
+    """
+    endian = "<" if wkb[offset] == 1 else ">"
+    (wkb_type,) = struct.unpack_from(endian + "I", wkb, offset + 1)
+    offset += 5
+
+    has_z = False
+    has_m = False
+
+    # EWKB
+    if wkb_type & EWKB_Z_FLAG:
+        has_z = True
+    if wkb_type & EWKB_M_FLAG:
+        has_m = True
+    if wkb_type & EWKB_SRID_FLAG:
+        offset += 4
+    wkb_type &= 0x0FFFFFFF
+
+    # ISO WKB
+    iso_dim, geometry_type = divmod(wkb_type, 1000)
+    if iso_dim in (1, 3):
+        has_z = True
+    if iso_dim in (2, 3):
+        has_m = True
+
+    dim = 2 + (1 if has_z else 0) + (1 if has_m else 0)
+    return endian, geometry_type, dim, has_z, offset
+
+
+def readCoordinates(wkb: bytes, offset: int, endian: str, count: int, dim: int):
+    """
+    連続した座標値をまとめて読み込む
+
+    @return: (座標値のタプル, 次のデータの位置)
+    """
+    size = count * dim
+    values = struct.unpack_from(f"{endian}{size}d", wkb, offset)
+    return values, offset + size * 8
+
+
+def toPositions(values, dim: int, has_z: bool) -> list:
+    """
+    x,y[,z][,m]の並びの座標値を緯度、経度、標高の並びにする
+
+    @param values: 座標値
+    @param dim: 次元数
+    @param has_z: 標高の有無
+    """
+    count = len(values) // dim
+    positions = [0.0] * (count * 3)
+
+    # 緯度、経度の順
+    positions[0::3] = values[1::dim]
+    positions[1::3] = values[0::dim]
+
+    # 標高（NaNは0.0）
+    if has_z:
+        positions[2::3] = [0.0 if z != z else z for z in values[2::dim]]
+
+    return positions
+
+
+def formatPositions(positions: list, coordinate_format: "CoordinateFormat" = None) -> str:
+    """
+    座標値をposListの文字列にする
+
+    @param positions: 緯度、経度、標高の順に並べた座標値
+    @param coordinate_format: 座標値の桁数（省略時は全桁）
+    """
+    return " ".join(formatPositionTexts(positions, coordinate_format))
+
+
+def formatPositionTexts(positions: list, coordinate_format: "CoordinateFormat" = None) -> list:
+    """
+    座標値をそれぞれ文字列にする
+
+    @param positions: 緯度、経度、標高の順に並べた座標値
+    @param coordinate_format: 座標値の桁数（省略時は全桁）
+    """
+    if coordinate_format is None:
+        return list(map(repr, positions))
+
+    return coordinate_format.texts(positions)
+
+
+class CoordinateFormat:
+    """
+    座標値の文字列化の桁数
+
+    小数点以下の桁数を緯度経度と標高で別に指定する Noneの場合は全桁（repr）
+    """
+    def __init__(self, latlon_decimals: int = None, height_decimals: int = None):
+        self.__latlon_decimals = checkDecimals(latlon_decimals)
+        self.__height_decimals = checkDecimals(height_decimals)
+
+        # 1値ずつの書式化はmapで行う
+        self.__latlon = decimalsFormatter(self.__latlon_decimals)
+        self.__height = decimalsFormatter(self.__height_decimals)
+
+    def latlonDecimals(self) -> int:
+        return self.__latlon_decimals
+
+    def heightDecimals(self) -> int:
+        return self.__height_decimals
+
+    def isFullPrecision(self) -> bool:
+        return self.__latlon_decimals is None and self.__height_decimals is None
+
+    def texts(self, positions: list) -> list:
+        """
+        座標値をそれぞれ文字列にする
+
+        @param positions: 緯度、経度、標高の順に並べた座標値
+        """
+        if self.isFullPrecision():
+            return list(map(repr, positions))
+
+        texts = [None] * len(positions)
+        texts[0::3] = map(self.__latlon, positions[0::3])
+        texts[1::3] = map(self.__latlon, positions[1::3])
+        texts[2::3] = map(self.__height, positions[2::3])
+        return texts
+
+    def heightText(self, height: float) -> str:
+        """ 標高の文字列 """
+        return self.__height(height)
+
+    def cornerText(self, lat: float, lon: float, upper: bool) -> str:
+        """
+        gml:Envelopeの角の文字列（標高は0）
+
+        桁を落としても範囲が地物を含むよう、下端は切り捨て、上端は切り上げる
+
+        @param upper: True:upperCorner False:lowerCorner
+        """
+        if self.__latlon_decimals is not None:
+            scale = 10 ** self.__latlon_decimals
+            rounding = math.ceil if upper else math.floor
+            lat = rounding(lat * scale) / scale
+            lon = rounding(lon * scale) / scale
+
+        return f"{self.__latlon(lat)} {self.__latlon(lon)} {self.__height(0.0)}"
+
+
+def checkDecimals(decimals):
+    """
+    小数点以下の桁数の確認
+
+    @param decimals: 桁数 Noneは全桁
+    """
+    if decimals is None:
+        return None
+
+    decimals = int(decimals)
+    if decimals < 0 or decimals > 17:
+        raise ValueError(f"小数点以下の桁数が範囲外です: {decimals}")
+    return decimals
+
+
+def decimalsFormatter(decimals):
+    """ 小数点以下の桁数で文字列にする関数 """
+    if decimals is None:
+        return repr
+
+    return f"%.{decimals}f".__mod__